@@ -0,0 +1,238 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# -------------------------------------------------------------------------
+# Context Packing
+# -------------------------------------------------------------------------
+# Shrinks what goes into the LM prompt fields before each call:
+#   - SQL results become a compact typed table (one header line with
+#     column:type, one pipe-separated line per row). When the rows do not fit,
+#     the head of the result is kept and count/sum/min/max/avg of the numeric
+#     columns are given for the whole result. A result the executor already
+#     cut at max_rows is labelled as its first N rows, never as all rows.
+#   - Retrieved chunks are cut down to their title plus the lines that share
+#     words with the question. Date lines ("- Dates: ...") and formula lines
+#     ("AOV = ...") are always kept, since the SQL needs them verbatim.
+#   - Each signature has a token budget for its packed context, and the
+#     packed context is never larger than what the signature got before
+#     packing (baseline_context), which is also what savings are measured
+#     against.
+# Token counts are estimates (about 4 characters per token), which is all a
+# budget needs and matches how the offline LM backends count usage.
+CONTEXT_BUDGETS = {
+    "sql_generator": 300,
+    # Below the ~360 tokens of the unpacked synthesizer context (800 characters
+    # of results, 200 per doc)
+    "synthesizer": 300,
+}
+
+SQL_CONTEXT_HEADER = "\nCONTEXT (Use dates/definitions from here!):"
+
+# Text cells are cut to this many characters in result tables
+MAX_CELL_CHARS = 40
+
+_WORD = re.compile(r"[a-z0-9]+")
+_KEY_LINE = re.compile(r"^\W*(Dates?:|[A-Z][\w ()]*=)")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "by", "do", "does", "for", "from", "give", "how", "in", "is", "it",
+    "of", "on", "or", "per", "return", "the", "to", "was", "were", "what", "when", "which", "who", "with",
+    "according", "during", "using", "defined", "definition", "docs", "str", "int", "float", "list", "rounded",
+    "decimals", "string",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+def _terms(text: str) -> set:
+    """Lowercased content words, with a plural 's' dropped."""
+    terms = set()
+    for word in _WORD.findall(text.lower()):
+        if word in _STOPWORDS:
+            continue
+        terms.add(word[:-1] if len(word) > 3 and word.endswith("s") else word)
+    return terms
+
+
+# --- SQL results -----------------------------------------------------------
+def _column_type(values: List[Any]) -> str:
+    kinds = {type(v) for v in values if v is not None}
+    if not kinds:
+        return "null"
+    if kinds <= {int, bool}:
+        return "int"
+    if kinds <= {int, float, bool}:
+        return "real"
+    return "text"
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, float):
+        return repr(round(value, 4))
+    text = str(value).replace("\n", " ").replace("|", "/")
+    return text if len(text) <= MAX_CELL_CHARS else text[:MAX_CELL_CHARS - 3] + "..."
+
+
+def _aggregates(rows: List[Dict], columns: List[str], types: Dict[str, str]) -> str:
+    parts = []
+    for col in columns:
+        if types[col] not in ("int", "real"):
+            continue
+        values = [row[col] for row in rows if row[col] is not None]
+        if values:
+            parts.append(f"{col} sum={_cell(sum(values))} min={_cell(min(values))} "
+                         f"max={_cell(max(values))} avg={_cell(sum(values) / len(values))}")
+    return "; ".join(parts)
+
+
+def pack_sql_results(rows: List[Dict], budget: int, truncated: bool = False) -> str:
+    """
+    SQL rows as a typed table within `budget` tokens:
+        DB RESULTS: 2 rows
+        CategoryName:text | Qty:int
+        Beverages | 1234
+        ...
+    Rows are kept in query order; if they do not all fit, the rest are
+    summarized by a "(N more rows ...)" line with aggregates over all rows.
+    `truncated` means the query returned more rows than `rows` (the
+    executor's max_rows cap); the header and aggregates then say "first N rows".
+    """
+    if not rows:
+        return ""
+    columns = list(rows[0].keys())
+    types = {col: _column_type([row.get(col) for row in rows]) for col in columns}
+    count = f"{len(rows)} row{'s' if len(rows) != 1 else ''}"
+    scope = f"first {count}" if truncated else "all rows"
+    header = f"DB RESULTS: {f'first {count} (more not fetched)' if truncated else count}\n" + \
+        " | ".join(f"{col}:{types[col]}" for col in columns)
+    lines = [" | ".join(_cell(row.get(col)) for col in columns) for row in rows]
+
+    used = estimate_tokens(header)
+    if used + sum(estimate_tokens(line) + 1 for line in lines) <= budget:
+        return header + "\n" + "\n".join(lines)
+
+    aggregates = _aggregates(rows, columns, types)
+    kept = []
+    for line in lines:
+        # Leave room for the summary line of the rows that get dropped
+        footer = f"({len(rows) - len(kept) - 1} more rows; {scope}: {aggregates})"
+        if used + estimate_tokens(line) + estimate_tokens(footer) + 2 > budget and kept:
+            break
+        kept.append(line)
+        used += estimate_tokens(line) + 1
+    footer = f"({len(rows) - len(kept)} more rows" + (f"; {scope}: {aggregates})" if aggregates else ")")
+    return header + "\n" + "\n".join(kept) + "\n" + footer
+
+
+# --- retrieved docs --------------------------------------------------------
+def _chunk_lines(text: str) -> Tuple[str, List[str]]:
+    """(title, body lines) of a markdown chunk; long lines are split into sentences."""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines:
+        return "", []
+    title = lines[0].lstrip("#").strip() if lines[0].startswith("#") else ""
+    body = lines[1:] if title else lines
+    sentences = []
+    for line in body:
+        sentences.extend(s.strip() for s in re.split(r"(?<=[.;])\s+(?=[A-Z-])", line) if s.strip())
+    return title, sentences
+
+
+def select_doc_lines(question: str, docs: List[Dict], budget: int) -> List[Tuple[Dict, str, List[str]]]:
+    """
+    (doc, title, lines) per retrieved chunk, in retrieval order, keeping the
+    lines relevant to the question within `budget` tokens.
+    A line is relevant if it is a date/formula line or shares at least half as
+    many question terms as the best line of its chunk.
+    Chunks with nothing relevant (title included) are dropped.
+    """
+    terms = _terms(question)
+    selected, used = [], 0
+    for doc in docs:
+        title, lines = _chunk_lines(doc['text'])
+        title_hits = len(terms & _terms(title))
+        scores = [len(terms & _terms(line)) for line in lines]
+        best = max(scores, default=0)
+        keep = [line for line, score in zip(lines, scores)
+                if _KEY_LINE.match(line) and (title_hits or score) or (score and score * 2 >= best)]
+        if not keep and not title_hits:
+            continue
+        if not keep and lines:
+            keep = lines[:1]
+        cost = estimate_tokens(title) + 2
+        fitted = []
+        for line in keep:
+            if used + cost + estimate_tokens(line) + 1 > budget:
+                break
+            fitted.append(line)
+            cost += estimate_tokens(line) + 1
+        if not fitted:
+            break
+        selected.append((doc, title, fitted))
+        used += cost
+    return selected
+
+
+def pack_docs(question: str, docs: List[Dict], budget: int) -> str:
+    """Relevant chunk lines, one "- Title: line; line" entry per chunk."""
+    entries = []
+    for _doc, title, lines in select_doc_lines(question, docs, budget):
+        body = "; ".join(line.lstrip("- ").strip() for line in lines)
+        entries.append(f"- {title}: {body}" if title else f"- {body}")
+    return "\n".join(entries)
+
+
+# --- per signature ---------------------------------------------------------
+def baseline_context(signature: str, sql_results: Optional[List[Dict]] = None,
+                     docs: Optional[List[Dict]] = None) -> str:
+    """The context `signature` was given before packing (every chunk in full; str() of rows and chunks cut short)."""
+    if signature == "sql_generator":
+        return SQL_CONTEXT_HEADER + "\n".join(f"- {d['text']}" for d in docs) if docs else ""
+    context = ""
+    if sql_results:
+        context += f"DB RESULTS: {str(sql_results)[:800]}\n"
+    if docs:
+        context += f"DOCS: {str([d['text'][:200] for d in docs])}\n"
+    return context
+
+
+def unpacked_size(signature: str, sql_results: Optional[List[Dict]] = None,
+                  docs: Optional[List[Dict]] = None) -> int:
+    """Tokens of the same context without packing."""
+    return estimate_tokens(baseline_context(signature, sql_results, docs))
+
+
+def pack_context(signature: str, question: str, sql_results: Optional[List[Dict]] = None,
+                 docs: Optional[List[Dict]] = None, budget: Optional[int] = None,
+                 truncated: bool = False) -> str:
+    """
+    The context for one signature within its budget. SQL results are packed
+    first (the synthesizer answers from them); the docs get what is left,
+    but never less than a quarter of the budget when there are docs.
+    `truncated` marks SQL results cut short by the executor's row cap.
+    The budget is capped at the unpacked size; in the rare case the packed
+    text still comes out larger (a single short row, where the table header
+    costs more than it saves), the unpacked context is used as is.
+    """
+    baseline = baseline_context(signature, sql_results, docs)
+    budget = budget if budget is not None else CONTEXT_BUDGETS[signature]
+    total = budget = min(budget, estimate_tokens(baseline))
+    if signature == "sql_generator":
+        packed = pack_docs(question, docs, budget) if docs else ""
+        packed = SQL_CONTEXT_HEADER + "\n" + packed if packed else ""
+        return packed if estimate_tokens(packed) <= estimate_tokens(baseline) else baseline
+    parts = []
+    if sql_results:
+        share = budget * 3 // 4 if docs else budget
+        table = pack_sql_results(sql_results, share, truncated)
+        parts.append(table)
+        budget -= estimate_tokens(table)
+    if docs:
+        packed = pack_docs(question, docs, max(budget, total // 4))
+        if packed:
+            parts.append("DOCS:\n" + packed)
+    packed = "\n".join(parts)
+    return packed if estimate_tokens(packed) <= estimate_tokens(baseline) else baseline
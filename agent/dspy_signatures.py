@@ -18,14 +18,7 @@ class RouterSignature(dspy.Signature):
 
 class GenerateSQLSignature(dspy.Signature):
     """
-    Write a SQLite query.
-    
-    SCHEMA:
-    - orders (OrderID, OrderDate, CustomerID)
-    - order_items (OrderID, ProductID, UnitPrice, Quantity, Discount)
-    - products (ProductID, ProductName, CategoryID, SupplierID)
-    - categories (CategoryID, CategoryName)
-    - customers (CustomerID, CompanyName)
+    Write a SQLite query using only the tables in schema_context.
     
     --- CHEAT SHEET EXAMPLES ---
     
@@ -46,7 +39,7 @@ class GenerateSQLSignature(dspy.Signature):
     Output the SQL string only.
     """
     question = dspy.InputField()
-    schema_context = dspy.InputField()
+    schema_context = dspy.InputField(desc="Tables and columns available")
     sql_query = dspy.OutputField()
 
 class SynthesizerSignature(dspy.Signature):
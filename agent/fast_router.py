@@ -0,0 +1,145 @@
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# -------------------------------------------------------------------------
+# Deterministic Fast-Path Router
+# -------------------------------------------------------------------------
+# Labelled questions for the model and the rule confidences. They must not
+# include (or paraphrase) questions of sample_questions_hybrid_eval.jsonl,
+# or the benchmark would score the router on its own training data.
+EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "router_examples.jsonl")
+
+# Mentions of the knowledge base (policies, calendar, KPI definitions)
+DOC_PATTERN = re.compile(
+    r"\b(according to|per the|as defined|definition|defined|polic(y|ies)|return (window|policy|days)"
+    r"|returns? (window|policy)|marketing calendar|calendar|campaign|kpi|docs?|documentation|catalog)\b",
+    re.IGNORECASE,
+)
+
+# Anything that has to be computed from the database
+METRIC_PATTERN = re.compile(
+    r"\b(how many|number of|revenue|quantity|sales|sold|count|total|average|aov|margin|sum"
+    r"|top(\s+\d+)?|highest|lowest|best|worst|most|least|rank)\b",
+    re.IGNORECASE,
+)
+
+# "How is X defined?" asks for the definition itself, not a computed value,
+# unless a period is given to compute it over
+DEFINITION_PATTERN = re.compile(r"\b(formula|defined|definition of|how is .+ (calculated|computed))\b", re.IGNORECASE)
+PERIOD_PATTERN = re.compile(
+    r"\b(\d{4}|january|february|march|april|may|june|july|august|september|october|november|december|during)\b",
+    re.IGNORECASE,
+)
+
+
+
+class FastRouter:
+    """
+    Classifies questions as rag / sql / hybrid without calling the LM.
+    Keyword rules decide the clear cases; a TF-IDF + logistic regression model
+    trained on router_examples.jsonl scores the rest. A rule's confidence is
+    how often it picks the right label on those examples (add-one smoothed),
+    and a rule below `min_confidence` leaves the question to the model.
+    `classify` returns None when neither is confident enough, so the caller
+    can fall back to the LM.
+    `doc_phrases` (e.g. section titles from the docs) count as doc mentions.
+    """
+
+    def __init__(self, doc_phrases: Optional[List[str]] = None, examples_path: str = EXAMPLES_PATH,
+                 min_confidence: float = 0.7):
+        self.doc_phrases = [p.lower() for p in (doc_phrases or []) if p]
+        self.examples_path = examples_path
+        self.min_confidence = min_confidence
+        self.fast_hits = 0
+        self.lm_fallbacks = 0
+        self._examples = None
+        self._rule_confidence = None
+        self._model = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def _mentions_docs(self, question: str) -> bool:
+        text = question.lower()
+        return bool(DOC_PATTERN.search(question)) or any(p in text for p in self.doc_phrases)
+
+    def _rule(self, question: str) -> Optional[Tuple[str, str]]:
+        """(rule name, label) of the first rule that fires, or None."""
+        docs = self._mentions_docs(question)
+        metric = bool(METRIC_PATTERN.search(question))
+        if docs and DEFINITION_PATTERN.search(question) and not PERIOD_PATTERN.search(question):
+            return "definition", "rag"
+        if docs and metric:
+            return "docs_metric", "hybrid"
+        if docs:
+            return "docs", "rag"
+        if metric:
+            return "metric", "sql"
+        return None
+
+    def _get_examples(self) -> List[Dict]:
+        if self._examples is None:
+            with open(self.examples_path, "r", encoding="utf-8") as f:
+                self._examples = [json.loads(line) for line in f if line.strip()]
+        return self._examples
+
+    def _get_rule_confidence(self) -> Dict[str, float]:
+        """Per rule, the share of the labelled examples it fires on that it labels correctly."""
+        if self._rule_confidence is None:
+            fired, correct = {}, {}
+            for example in self._get_examples():
+                hit = self._rule(example["question"])
+                if hit:
+                    fired[hit[0]] = fired.get(hit[0], 0) + 1
+                    correct[hit[0]] = correct.get(hit[0], 0) + (hit[1] == example["label"])
+            self._rule_confidence = {rule: (correct[rule] + 1) / (fired[rule] + 2) for rule in fired}
+        return self._rule_confidence
+
+    def _get_model(self):
+        # scikit-learn is only imported once a question needs the model
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sklearn.feature_extraction.text import TfidfVectorizer
+                    from sklearn.linear_model import LogisticRegression
+                    from sklearn.pipeline import make_pipeline
+
+                    examples = self._get_examples()
+                    model = make_pipeline(
+                        TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4), sublinear_tf=True),
+                        LogisticRegression(max_iter=1000, C=10.0),
+                    )
+                    model.fit([e["question"] for e in examples], [e["label"] for e in examples])
+                    self._model = model
+        return self._model
+
+    def classify(self, question: str) -> Optional[Dict]:
+        """Returns {"label", "confidence", "source"} or None if the LM should decide."""
+        hit = self._rule(question)
+        if hit:
+            rule, label = hit
+            # A rule that never fired on the examples gets the smoothed prior, 0.5
+            confidence = self._get_rule_confidence().get(rule, 0.5)
+            if confidence >= self.min_confidence:
+                self._count("fast_hits")
+                return {"label": label, "confidence": confidence, "source": "rules"}
+
+        model = self._get_model()
+        probs = model.predict_proba([question])[0]
+        best = probs.argmax()
+        if probs[best] >= self.min_confidence:
+            self._count("fast_hits")
+            return {"label": model.classes_[best], "confidence": float(probs[best]), "source": "model"}
+
+        self._count("lm_fallbacks")
+        return None
+
+    def _count(self, counter: str):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return {"fast_path": self.fast_hits, "lm_fallback": self.lm_fallbacks}
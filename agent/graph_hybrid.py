@@ -1,13 +1,21 @@
+import contextvars
+import logging
+import operator
 import os
-import dspy
 import re
-from typing import TypedDict, List, Dict, Any
-from langgraph.graph import StateGraph, END
+import threading
+import time
+from typing import Annotated, TypedDict, List, Dict, Any
 
-# Import our local tools
-from agent.tools.sqlite_tool import SQLiteDB
-from agent.rag.retrieval import SimpleRetriever
-from agent.dspy_signatures import RouterSignature, GenerateSQLSignature, SynthesizerSignature
+# Heavy dependencies (dspy, langgraph, numpy) and the tools themselves are
+# imported on first use, so importing this module stays cheap.
+from agent.context_packing import estimate_tokens, pack_context, unpacked_size
+from agent.lm_cache import LMCache, CachedPredict
+from agent.question_cache import QuestionCache
+from agent.tools.sql_rewriter import default_rewriter
+from agent.tracing import tracer
+
+logger = logging.getLogger(__name__)
 
 # -------------------------------------------------------------------------
 # Setup
@@ -15,13 +23,173 @@ from agent.dspy_signatures import RouterSignature, GenerateSQLSignature, Synthes
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(os.path.dirname(BASE_DIR), 'data', 'northwind.sqlite')
 DOCS_PATH = os.path.join(os.path.dirname(BASE_DIR), 'docs')
+CACHE_DIR = os.path.join(os.path.dirname(BASE_DIR), '.cache')
+LM_CACHE_PATH = os.path.join(CACHE_DIR, 'lm_cache.sqlite')
+QUESTION_CACHE_PATH = os.path.join(CACHE_DIR, 'question_cache.sqlite')
+
+# Guardrails for generated SQL. The synthesizer only sees the head of the
+# result, and runaway queries are interrupted and sent back to the repair loop.
+SQL_MAX_ROWS = 100
+SQL_TIMEOUT_SECONDS = 10.0
 
-db_tool = SQLiteDB(DB_PATH)
-retriever_tool = SimpleRetriever(DOCS_PATH)
+# Tables and columns shown to the SQL generator; the schema catalog filters
+# these down to the tables a given question needs.
+PROMPT_SCHEMA = {
+    "orders": ["OrderID", "OrderDate", "CustomerID"],
+    "order_items": ["OrderID", "ProductID", "UnitPrice", "Quantity", "Discount"],
+    "products": ["ProductID", "ProductName", "CategoryID", "SupplierID"],
+    "categories": ["CategoryID", "CategoryName"],
+    "customers": ["CustomerID", "CompanyName"],
+}
 
-router = dspy.Predict(RouterSignature)
-sql_generator = dspy.Predict(GenerateSQLSignature)
-synthesizer = dspy.Predict(SynthesizerSignature)
+lm_cache = LMCache(LM_CACHE_PATH)
+question_cache = QuestionCache(QUESTION_CACHE_PATH)
+
+# -------------------------------------------------------------------------
+# Lazy resources
+# -------------------------------------------------------------------------
+_resources: Dict[str, Any] = {}
+_resources_lock = threading.RLock()
+
+def _lazy(name: str, factory):
+    """Builds a shared resource once, on first use (safe across worker threads)."""
+    resource = _resources.get(name)
+    if resource is None:
+        with _resources_lock:
+            resource = _resources.get(name)
+            if resource is None:
+                resource = factory()
+                _resources[name] = resource
+    return resource
+
+def _build_db_tool():
+    from agent.tools.sqlite_tool import SQLiteDB
+    return SQLiteDB(DB_PATH, max_rows=SQL_MAX_ROWS, timeout=SQL_TIMEOUT_SECONDS, catalog_dir=CACHE_DIR,
+                    rollups=True)
+
+def _build_retriever():
+    from agent.rag.retrieval import SimpleRetriever
+    return SimpleRetriever(DOCS_PATH, index_dir=os.path.join(CACHE_DIR, 'retrieval_index'))
+
+def _build_predictors():
+    import dspy
+    from agent.dspy_signatures import RouterSignature, GenerateSQLSignature, SynthesizerSignature
+    return {
+        "router": CachedPredict(dspy.Predict(RouterSignature), lm_cache),
+        "sql_generator": CachedPredict(dspy.Predict(GenerateSQLSignature), lm_cache),
+        "synthesizer": CachedPredict(dspy.Predict(SynthesizerSignature), lm_cache),
+    }
+
+def _build_fast_router():
+    from agent.fast_router import FastRouter
+    # Section titles from the docs ("Summer Beverages 1997", ...) mark doc
+    # references; also match them without the trailing year
+    phrases = set()
+    for chunk in get_retriever().chunks:
+        title = chunk['id'].split("::", 1)[-1]
+        if title != "intro":
+            phrases.add(title)
+            phrases.add(re.sub(r"\s+\d{4}$", "", title))
+    return FastRouter(sorted(phrases))
+
+def _build_sql_templates():
+    from agent.sql_templates import SQLTemplates, parse_calendar
+    db = get_db_tool()
+    categories = db.execute_query("SELECT CategoryName FROM categories")
+    if isinstance(categories, str):
+        categories = []
+    templates = SQLTemplates([row['CategoryName'] for row in categories], parse_calendar(get_retriever().chunks))
+    # Templates this database cannot compile are never emitted
+    conn = db.pool.get()
+    templates.validate(lambda sql: conn.execute("EXPLAIN " + sql).close())
+    return templates
+
+def get_db_tool():
+    return _lazy("db_tool", _build_db_tool)
+
+def get_retriever():
+    return _lazy("retriever_tool", _build_retriever)
+
+def get_fast_router():
+    return _lazy("fast_router", _build_fast_router)
+
+def get_sql_templates():
+    return _lazy("sql_templates", _build_sql_templates)
+
+def get_predictor(name: str):
+    """One of "router", "sql_generator", "synthesizer"."""
+    return _lazy("predictors", _build_predictors)[name]
+
+def get_app():
+    return _lazy("app", build_app)
+
+def question_cache_context() -> str:
+    """What cached answers depend on: the database file, the loaded docs and the LM."""
+    import dspy
+    from agent.tools.schema_catalog import db_fingerprint
+    lm = dspy.settings.lm
+    return f"{db_fingerprint(DB_PATH)}|{get_retriever().content_hash}|{getattr(lm, 'model', '')}"
+
+def warm_up() -> Dict[str, float]:
+    """
+    Builds every shared resource now rather than on the first question (used by
+    the server before it accepts requests). Returns seconds spent per resource.
+    """
+    steps = [
+        ("db_tool", lambda: get_db_tool().catalog),
+        ("retriever_tool", get_retriever),
+        ("fast_router", lambda: get_fast_router()._get_model()),
+        ("sql_templates", get_sql_templates),
+        ("predictors", lambda: get_predictor("router")),
+        ("app", get_app),
+    ]
+    if question_cache.enabled:
+        steps.append(("question_cache", lambda: question_cache.preload(question_cache_context())))
+    seconds = {}
+    for name, step in steps:
+        start = time.perf_counter()
+        step()
+        seconds[name] = time.perf_counter() - start
+    return seconds
+
+def predict(name: str, **kwargs):
+    """Calls a predictor and traces its latency and token usage (none when served from the LM cache)."""
+    import dspy
+    start = time.perf_counter()
+    usage, failed = None, True
+    try:
+        with dspy.context(track_usage=True):
+            pred = get_predictor(name)(**kwargs)
+        usage = pred.get_lm_usage() if hasattr(pred, "get_lm_usage") else None
+        failed = False
+        return pred
+    finally:
+        tokens = list((usage or {}).values())
+        tracer.emit("lm", name, time.perf_counter() - start,
+                    prompt_tokens=sum(t.get('prompt_tokens') or 0 for t in tokens),
+                    completion_tokens=sum(t.get('completion_tokens') or 0 for t in tokens),
+                    cached=usage is None and not failed, errors=failed)
+
+def record_packing(signature: str, unpacked: int, packed: int) -> Dict[str, Any]:
+    """Traces the prompt tokens context packing saved for one LM call."""
+    tracer.emit("context", signature, 0.0, unpacked_tokens=unpacked, packed_tokens=packed,
+                saved_tokens=unpacked - packed)
+    return {"signature": signature, "unpacked": unpacked, "packed": packed}
+
+# Old module-level names (`from agent.graph_hybrid import app`) still work
+_LEGACY_NAMES = {
+    "app": get_app,
+    "db_tool": get_db_tool,
+    "retriever_tool": get_retriever,
+    "router": lambda: get_predictor("router"),
+    "sql_generator": lambda: get_predictor("sql_generator"),
+    "synthesizer": lambda: get_predictor("synthesizer"),
+}
+
+def __getattr__(name):
+    if name in _LEGACY_NAMES:
+        return _LEGACY_NAMES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # -------------------------------------------------------------------------
 # State
@@ -34,35 +202,44 @@ class AgentState(TypedDict):
     retrieved_docs: List[Dict]
     sql_query: str
     sql_results: List[Dict]
+    # True when sql_results stops at the executor's max_rows cap
+    sql_truncated: bool
     sql_error: str
     final_answer: Any
     explanation: str
     citations: List[str]
     retry_count: int
+    schema_context: str
+    doc_context: str
+    # One {"node", "seconds"} entry per node run; parallel branches append
+    timings: Annotated[List[Dict], operator.add]
+    # One {"signature", "unpacked", "packed"} entry per packed LM context
+    context_tokens: Annotated[List[Dict], operator.add]
 
 # -------------------------------------------------------------------------
 # Helper: Resilience Patch for SQL
 # -------------------------------------------------------------------------
+_FENCE = re.compile(r"```(?:sql)?", re.IGNORECASE)
+_SELECT = re.compile(r"SELECT", re.IGNORECASE)
+
 def clean_sql_query(sql: str) -> str:
     """
     Auto-corrects common LLM mistakes for SQLite.
     """
     # 1. Remove markdown
-    sql = sql.replace("```sql", "").replace("```", "").strip()
+    sql = _FENCE.sub("", sql).strip()
     
     # 2. Extract SELECT statement if buried in text
-    match = re.search(r"(SELECT.*?(?:;|$))", sql, re.IGNORECASE | re.DOTALL)
+    match = _SELECT.search(sql)
     if match:
-        sql = match.group(1).strip()
+        end = sql.find(";", match.start())
+        sql = sql[match.start():end + 1 if end != -1 else len(sql)].strip()
         
-    # 3. FIX: Replace YEAR(x) with strftime('%Y', x)
-    # Regex finds YEAR(anything) and turns it into SQLite format
-    sql = re.sub(r"YEAR\((.*?)\)", r"strftime('%Y', \1)", sql, flags=re.IGNORECASE)
-
-    # 4. FIX: Replace MONTH(x) with strftime('%m', x)
-    sql = re.sub(r"MONTH\((.*?)\)", r"strftime('%m', \1)", sql, flags=re.IGNORECASE)
+    # 3. Other dialects -> SQLite: YEAR/MONTH/DATE_FORMAT/EXTRACT, TOP n,
+    # ILIKE, unquoted "Order Details" (see agent/tools/sql_rewriter.py)
+    sql = default_rewriter.rewrite(sql)
     
-    # 5. Ensure it ends with ;
+    # 4. Ensure it ends with ;
     if not sql.endswith(";"): 
         sql += ";"
         
@@ -73,75 +250,123 @@ def clean_sql_query(sql: str) -> str:
 # -------------------------------------------------------------------------
 
 def router_node(state: AgentState):
-    """Decide tool with KEYWORD OVERRIDES."""
-    print(f"--- [Router] Analyzing: {state['question'][:40]}... ---")
+    """Decide tool: local fast path first, LM only when it is unsure, then KEYWORD OVERRIDES."""
+    logger.debug("[Router] Analyzing: %s...", state['question'][:40])
     question = state['question'].lower()
     
-    try:
-        pred = router(question=state['question'])
-        text = pred.answer.lower()
-        if 'sql' in text and 'rag' not in text: choice = 'sql'
-        elif 'rag' in text and 'sql' not in text: choice = 'rag'
-        else: choice = 'hybrid'
-    except:
-        choice = 'hybrid'
+    decision = get_fast_router().classify(state['question'])
+    if decision:
+        choice = decision['label']
+        logger.debug("[Router] Fast path (%s, %.2f): %s", decision['source'], decision['confidence'], choice)
+    else:
+        try:
+            pred = predict("router", question=state['question'])
+            text = pred.answer.lower()
+            if 'sql' in text and 'rag' not in text: choice = 'sql'
+            elif 'rag' in text and 'sql' not in text: choice = 'rag'
+            else: choice = 'hybrid'
+        except:
+            choice = 'hybrid'
 
     # Logic Booster: Force Hybrid/SQL for math
     math_keywords = ['how many', 'quantity', 'revenue', 'count', 'total', 'average', 'margin', 'top', 'highest', 'best']
     if any(k in question for k in math_keywords):
         if choice == 'rag':
-            print("--- [Router] Override: Detected math question. Forcing Hybrid. ---")
+            logger.debug("[Router] Override: Detected math question. Forcing Hybrid.")
             choice = 'hybrid'
 
     return {"tool_choice": choice}
 
 def retriever_node(state: AgentState):
     """Fetch docs."""
-    print("--- [Retriever] Fetching docs... ---")
-    docs = retriever_tool.retrieve(state['question'], k=3)
+    logger.debug("[Retriever] Fetching docs...")
+    start = time.perf_counter()
+    docs = get_retriever().retrieve(state['question'], k=3)
+    tracer.emit("retrieval", "bm25", time.perf_counter() - start, docs=len(docs))
     return {"retrieved_docs": docs}
 
+def select_schema(question: str) -> str:
+    """Prompt schema restricted to the tables the question needs."""
+    catalog = get_db_tool().catalog
+    tables = catalog.select_tables(question, PROMPT_SCHEMA)
+    return catalog.render(tables, PROMPT_SCHEMA)
+
+def schema_node(state: AgentState):
+    """Select tables for SQL generation (runs alongside the retriever)."""
+    logger.debug("[Schema] Selecting tables...")
+    return {"schema_context": select_schema(state['question'])}
+
 def sql_generator_node(state: AgentState):
     """Generate SQL and Apply Resilience Patch."""
-    print("--- [SQL Gen] Generating Query... ---")
+    logger.debug("[SQL Gen] Generating Query...")
+    update = {}
     
-    schema = """
-    Tables:
-    - orders (OrderID, OrderDate, CustomerID)
-    - order_items (OrderID, ProductID, UnitPrice, Quantity, Discount)
-    - products (ProductID, ProductName, CategoryID, SupplierID)
-    - categories (CategoryID, CategoryName)
-    - customers (CustomerID, CompanyName)
-    """
+    # Known question shapes skip the LM; retries after an error always use it
+    if not state.get('sql_error'):
+        match = get_sql_templates().match(state['question'])
+        if match:
+            logger.debug("[SQL Gen] Template: %s", match['template'])
+            update["sql_query"] = match['sql']
+            return update
+    
+    schema = state.get('schema_context') or select_schema(state['question'])
     
-    doc_context = ""
+    # Built once; repair retries reuse the same doc context
+    doc_context = state.get('doc_context') or ""
+    if not doc_context and state.get('retrieved_docs'):
+        doc_context = pack_context("sql_generator", state['question'], docs=state['retrieved_docs'])
+        if doc_context:
+            update["doc_context"] = doc_context
     if state.get('retrieved_docs'):
-        doc_context = "\nCONTEXT (Use dates/definitions from here!):" + "\n".join([f"- {d['text']}" for d in state['retrieved_docs']])
+        update["context_tokens"] = [record_packing("sql_generator",
+                                                   unpacked_size("sql_generator", docs=state['retrieved_docs']),
+                                                   estimate_tokens(doc_context))]
     
-    full_input = f"Question: {state['question']}\n{schema}\n{doc_context}"
+    # The schema goes in schema_context only, not repeated in the question
+    full_input = f"Question: {state['question']}\n{doc_context}"
     
     if state.get('sql_error'):
         full_input += f"\nFIX PREVIOUS ERROR: {state['sql_error']}"
 
     try:
-        pred = sql_generator(question=full_input, schema_context=schema)
+        pred = predict("sql_generator", question=full_input, schema_context=schema)
         # Apply the cleaner function
         clean_sql = clean_sql_query(pred.sql_query)
     except:
         clean_sql = "SELECT 1;"
 
-    return {"sql_query": clean_sql}
+    update["sql_query"] = clean_sql
+    return update
 
 def sql_executor_node(state: AgentState):
-    """Execute SQL."""
+    """Validate (and repair) the SQL, then execute it."""
     query = state['sql_query']
-    print(f"--- [Executor] Running: {query[:60]}... ---")
-    result = db_tool.execute_query(query)
+    update = {}
+
+    # Compile first: broken queries are repaired here or sent back to the LM unexecuted
+    start = time.perf_counter()
+    check = get_db_tool().validate(query)
+    tracer.emit("sql", "validate", time.perf_counter() - start,
+                repairs=len(check['repairs']), errors=not check['ok'])
+    if not check['ok']:
+        logger.debug("[Executor] Invalid SQL: %s", check['error'])
+        return {"sql_error": check['error'], "sql_results": [], "sql_truncated": False}
+    if check['repairs']:
+        logger.debug("[Executor] Repaired SQL: %s", "; ".join(check['repairs']))
+        query = update["sql_query"] = check['sql']
+
+    logger.debug("[Executor] Running: %s...", query[:60])
+    start = time.perf_counter()
+    result = get_db_tool().execute_query(query)
+    failed = isinstance(result, str) and result.startswith("Error")
+    tracer.emit("sql", "execute", time.perf_counter() - start,
+                rows=0 if failed else len(result), errors=failed)
     
-    if isinstance(result, str) and result.startswith("Error"):
-        return {"sql_error": result, "sql_results": []}
+    if failed:
+        update.update({"sql_error": result, "sql_results": [], "sql_truncated": False})
     else:
-        return {"sql_results": result, "sql_error": None}
+        update.update({"sql_results": result, "sql_truncated": result.truncated, "sql_error": None})
+    return update
 
 def repair_check_node(state: AgentState):
     if state.get('sql_error'):
@@ -150,20 +375,21 @@ def repair_check_node(state: AgentState):
 
 def synthesizer_node(state: AgentState):
     """Synthesize answer."""
-    print("--- [Synthesizer] formulating answer... ---")
+    logger.debug("[Synthesizer] formulating answer...")
     
-    context = ""
-    if state.get('sql_results'):
-        context += f"DB RESULTS: {str(state['sql_results'])[:800]}\n"
-    if state.get('retrieved_docs'):
-        context += f"DOCS: {str([d['text'][:200] for d in state['retrieved_docs']])}\n"
+    context = pack_context("synthesizer", state['question'], state.get('sql_results'), state.get('retrieved_docs'),
+                           truncated=state.get('sql_truncated', False))
+    packing = []
     
     if not state.get('sql_results') and state.get('tool_choice') != 'rag':
          # If we expected SQL data but got none
          final_text = "Could not calculate (No data found matching criteria)."
     else:
+        packing.append(record_packing("synthesizer",
+                                      unpacked_size("synthesizer", state.get('sql_results'), state.get('retrieved_docs')),
+                                      estimate_tokens(context)))
         try:
-            pred = synthesizer(question=state['question'], context=context)
+            pred = predict("synthesizer", question=state['question'], context=context)
             final_text = pred.answer.strip()
             if "Answer:" in final_text:
                 final_text = final_text.split("Answer:")[-1].strip()
@@ -179,41 +405,81 @@ def synthesizer_node(state: AgentState):
     return {
         "final_answer": final_text,
         "explanation": "Derived from database and docs.",
-        "citations": citations
+        "citations": citations,
+        "context_tokens": packing
     }
 
 # -------------------------------------------------------------------------
 # Graph Construction
 # -------------------------------------------------------------------------
-workflow = StateGraph(AgentState)
-workflow.add_node("router", router_node)
-workflow.add_node("retriever", retriever_node)
-workflow.add_node("sql_gen", sql_generator_node)
-workflow.add_node("executor", sql_executor_node)
-workflow.add_node("repair", repair_check_node)
-workflow.add_node("synthesizer", synthesizer_node)
+class QuestionCancelled(Exception):
+    """Raised before the next node once the caller has given up on the question."""
 
-workflow.set_entry_point("router")
+# A threading.Event the caller sets to stop the current question (see
+# run_agent_hybrid.run_concurrent). Nodes check it before they start; a node
+# already running (an LM call, a SQL query) is not interrupted.
+cancel_event: contextvars.ContextVar = contextvars.ContextVar("cancel_event", default=None)
 
-def route_decision(state):
-    return "retriever" if state['tool_choice'] in ['rag', 'hybrid'] else "sql_gen"
+def _timed(name: str, node):
+    """Wraps a node in a trace span and reports its wall time in state['timings']."""
+    def timed_node(state):
+        event = cancel_event.get()
+        if event is not None and event.is_set():
+            raise QuestionCancelled(f"{state.get('id')} cancelled before {name}")
+        start = time.perf_counter()
+        retry = state.get('retry_count', 0)
+        # `retry` is the repair attempt (max in the summary); `retried` counts the runs that were repairs
+        with tracer.span("node", name, question_id=state.get('id'), retry=retry, retried=retry > 0):
+            update = dict(node(state) or {})
+        update["timings"] = [{"node": name, "seconds": time.perf_counter() - start}]
+        return update
+    return timed_node
 
-workflow.add_conditional_edges("router", route_decision, {"retriever": "retriever", "sql_gen": "sql_gen"})
+def route_decision(state):
+    # Hybrid questions fetch docs and select tables in parallel
+    return {
+        "rag": ["retriever"],
+        "sql": ["schema"],
+    }.get(state['tool_choice'], ["retriever", "schema"])
 
 def post_retrieval(state):
-    return "synthesizer" if state['tool_choice'] == 'rag' else "sql_gen"
+    # For hybrid questions, the join edge below moves on to sql_gen
+    return "synthesizer" if state['tool_choice'] == 'rag' else []
 
-workflow.add_conditional_edges("retriever", post_retrieval, {"synthesizer": "synthesizer", "sql_gen": "sql_gen"})
-
-workflow.add_edge("sql_gen", "executor")
-workflow.add_edge("executor", "repair")
+def post_schema(state):
+    # SQL-only questions have no retrieval branch to wait for
+    return "sql_gen" if state['tool_choice'] == 'sql' else []
 
 def repair_logic(state):
     if state.get('sql_error') and state.get('retry_count', 0) < 2:
         return "retry"
     return "synthesizer"
 
-workflow.add_conditional_edges("repair", repair_logic, {"retry": "sql_gen", "synthesizer": "synthesizer"})
-workflow.add_edge("synthesizer", END)
+def build_app():
+    """Builds and compiles the LangGraph workflow."""
+    from langgraph.graph import StateGraph, END
+
+    workflow = StateGraph(AgentState)
+    workflow.add_node("router", _timed("router", router_node))
+    workflow.add_node("retriever", _timed("retriever", retriever_node))
+    workflow.add_node("schema", _timed("schema", schema_node))
+    workflow.add_node("sql_gen", _timed("sql_gen", sql_generator_node))
+    workflow.add_node("executor", _timed("executor", sql_executor_node))
+    workflow.add_node("repair", _timed("repair", repair_check_node))
+    workflow.add_node("synthesizer", _timed("synthesizer", synthesizer_node))
+
+    workflow.set_entry_point("router")
+
+    workflow.add_conditional_edges("router", route_decision, ["retriever", "schema"])
+    workflow.add_conditional_edges("retriever", post_retrieval, ["synthesizer"])
+    workflow.add_conditional_edges("schema", post_schema, ["sql_gen"])
+    # Hybrid: sql_gen starts once both parallel branches have finished
+    workflow.add_edge(["retriever", "schema"], "sql_gen")
+
+    workflow.add_edge("sql_gen", "executor")
+    workflow.add_edge("executor", "repair")
+
+    workflow.add_conditional_edges("repair", repair_logic, {"retry": "sql_gen", "synthesizer": "synthesizer"})
+    workflow.add_edge("synthesizer", END)
 
-app = workflow.compile()
\ No newline at end of file
+    return workflow.compile()
\ No newline at end of file
@@ -0,0 +1,300 @@
+import datetime
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# -------------------------------------------------------------------------
+# Pluggable LM Backends
+# -------------------------------------------------------------------------
+# "ollama" is the real model. "stub" and "replay" are local stand-ins that
+# plug into dspy.LM as custom engines, so prompts are still formatted and
+# parsed by dspy exactly as with a real model, but no server is needed:
+#   stub    scripted answers (rules from a JSONL file, then built-in
+#           deterministic answers for the question shapes the graph sees)
+#   replay  responses recorded from an earlier run (--lm-record), looked up
+#           by prompt; unrecorded prompts fall back to the stub
+# Both can add latency per call to load-test concurrency.
+# Custom engines (dspy.LM(engine=...)) and the dspy.lm15 request/response
+# types need the `dspy` package at 3.4.1 or later (see requirements.txt).
+BACKENDS = ("ollama", "stub", "replay")
+OLLAMA_MODEL = "phi3.5"
+OLLAMA_API_BASE = "http://localhost:11434"
+
+FIELD = re.compile(r"\[\[ ## (\w+) ## \]\]\n(.*?)(?=\n\n\[\[ ## |\n\nRespond with |\Z)", re.DOTALL)
+OUTPUT_FIELD = re.compile(r"starting with the field `\[\[ ## (\w+) ## \]\]`")
+
+
+def prompt_key(messages: List[Tuple[str, str]]) -> str:
+    """Stable key for a chat prompt given as (role, text) pairs."""
+    payload = json.dumps([[role, text] for role, text in messages])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _request_messages(request) -> List[Tuple[str, str]]:
+    messages = [("system", request.system)] if request.system else []
+    return messages + [(m.role, m.text) for m in request.messages]
+
+
+# --- built-in stub answers -------------------------------------------------
+REVENUE = "SUM(oi.UnitPrice * oi.Quantity * (1 - oi.Discount))"
+LINES = "FROM orders o JOIN order_items oi ON o.OrderID = oi.OrderID"
+PRODUCTS = " JOIN products p ON oi.ProductID = p.ProductID"
+CATEGORIES = PRODUCTS + " JOIN categories c ON p.CategoryID = c.CategoryID"
+MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+
+
+def stub_route(question: str) -> str:
+    q = question.lower()
+    needs_sql = re.search(r"how many|revenue|quantity|top|average|margin|total", q)
+    needs_docs = re.search(r"policy|calendar|kpi|definition|dates|'[^']+'", q)
+    if needs_sql and needs_docs:
+        return "hybrid"
+    return "sql" if needs_sql else "rag"
+
+
+def _period_filter(text: str) -> str:
+    dates = re.search(r"Dates:\s*(\d{4}-\d{2}-\d{2})\s*to\s*(\d{4}-\d{2}-\d{2})", text)
+    if dates:
+        end = datetime.date.fromisoformat(dates.group(2)) + datetime.timedelta(days=1)
+        return f"o.OrderDate >= '{dates.group(1)}' AND o.OrderDate < '{end.isoformat()}'"
+    month_year = re.search(r"\b(" + "|".join(MONTHS) + r")[a-z]*\.?\s+(\d{4})\b", text, re.IGNORECASE)
+    if month_year:
+        month = MONTHS.index(month_year.group(1).lower()) + 1
+        return f"o.OrderDate LIKE '{month_year.group(2)}-{month:02d}%'"
+    year = re.search(r"\b(19|20)\d{2}\b", text)
+    return f"o.OrderDate LIKE '{year.group(0)}%'" if year else ""
+
+
+def stub_sql(prompt: str) -> str:
+    """Cheat-sheet style SQL for the common question shapes."""
+    question = prompt.split("\nCONTEXT", 1)[0]
+    q = question.lower()
+    # A quoted campaign name is resolved from the dates in the doc context
+    where = [_period_filter(prompt if re.search(r"'[^']+'", question) else question)]
+    category = re.search(r"(?:for the|from the) '?([A-Z][\w/ ]*?)'? category", question)
+    if category:
+        where.append(f"c.CategoryName = '{category.group(1)}'")
+    where = " WHERE " + " AND ".join(w for w in where if w) if any(where) else ""
+
+    if "margin" in q:
+        return (f"SELECT cu.CompanyName, SUM((oi.UnitPrice - 0.7 * oi.UnitPrice) * oi.Quantity * (1 - oi.Discount))"
+                f" AS Margin {LINES} JOIN customers cu ON o.CustomerID = cu.CustomerID{where}"
+                " GROUP BY cu.CompanyName ORDER BY Margin DESC LIMIT 1;")
+    if "customer" in q:
+        return (f"SELECT cu.CompanyName, {REVENUE} AS Rev {LINES} JOIN customers cu ON o.CustomerID = cu.CustomerID"
+                f"{where} GROUP BY cu.CompanyName ORDER BY Rev DESC LIMIT 1;")
+    if "how many orders" in q:
+        return f"SELECT COUNT(DISTINCT o.OrderID) {LINES}{where};"
+    units = re.search(r"units of (.+?) were sold", question)
+    if units:
+        name = units.group(1).replace("'", "''")
+        where = (where + " AND" if where else " WHERE") + f" p.ProductName = '{name}'"
+        return f"SELECT SUM(oi.Quantity) {LINES}{PRODUCTS}{where};"
+    if "category" in q and "quantity" in q:
+        return (f"SELECT c.CategoryName, SUM(oi.Quantity) AS Qty {LINES}{CATEGORIES}{where}"
+                " GROUP BY c.CategoryName ORDER BY Qty DESC LIMIT 1;")
+    if re.search(r"\baov\b|average order value", q):
+        return f"SELECT {REVENUE} / COUNT(DISTINCT o.OrderID) {LINES}{where};"
+    top = re.search(r"\btop (\d+)|which (\d+) products", q)
+    if top:
+        n = top.group(1) or top.group(2)
+        return (f"SELECT p.ProductName, {REVENUE} AS Rev {LINES}{CATEGORIES}{where}"
+                f" GROUP BY p.ProductName ORDER BY Rev DESC LIMIT {n};")
+    return f"SELECT {REVENUE} {LINES}{CATEGORIES}{where};"
+
+
+def stub_answer(context: str) -> str:
+    """First value from the DB results table, else a fact from the docs."""
+    # Unpacked results (when packing would not make them smaller): "DB RESULTS: [{'col': value, ...}]"
+    rows = re.search(r"DB RESULTS: \[\{[^\n]*?:\s*(-?\d+(?:\.\d+)?)", context)
+    if rows:
+        return rows.group(1)
+    # Packed results: "DB RESULTS: N rows", a "col:type | ..." header, then rows
+    results = re.search(r"DB RESULTS: [^\n]*\n[^\n]*\n([^\n]*)", context)
+    if results:
+        number = re.search(r"-?\d+(?:\.\d+)?", results.group(1))
+        if number:
+            return number.group(0)
+    days = re.search(r"(\d+) days", context)
+    if days:
+        return days.group(1)
+    dates = re.search(r"Dates: (\S+) to (\S+)", context)
+    if dates:
+        return json.dumps({"start": dates.group(1), "end": dates.group(2)})
+    return "Could not determine"
+
+
+# --- engines ---------------------------------------------------------------
+class _LocalEngine:
+    """Shared plumbing: injected latency, call counting and the dspy Response."""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _respond(self, request, text: str):
+        from dspy.lm15 import Message, Response, TextPart, Usage
+
+        delay = self.latency + (random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+        with self._lock:
+            self.calls += 1
+        prompt_tokens = sum(len(t) for _, t in _request_messages(request)) // 4
+        output_tokens = len(text) // 4 + 1
+        return Response(
+            id=None, model="stub", finish_reason="stop",
+            message=Message.assistant([TextPart(text)]),
+            usage=Usage(input_tokens=prompt_tokens, output_tokens=output_tokens,
+                        total_tokens=prompt_tokens + output_tokens),
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls}
+
+
+class ScriptedEngine(_LocalEngine):
+    """
+    Answers every prompt without a model. Rules from `script_path` (JSONL of
+    {"field": "sql_query", "match": "<regex>", "response": "..."}; "field"
+    is the output field and optional) are tried in order against the
+    question; otherwise the built-in stub answers are used. Same prompt,
+    same response.
+    """
+
+    def __init__(self, script_path: Optional[str] = None, latency_ms: float = 0.0, jitter_ms: float = 0.0):
+        super().__init__(latency_ms, jitter_ms)
+        self.rules = []
+        if script_path:
+            with open(script_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        rule = json.loads(line)
+                        self.rules.append((rule.get("field"), re.compile(rule["match"], re.IGNORECASE),
+                                           rule["response"]))
+        self.scripted = 0
+
+    def answer(self, text: str) -> str:
+        """The completion text (in dspy's [[ ## field ## ]] format) for a user message."""
+        fields = {name: value.strip() for name, value in FIELD.findall(text)}
+        output = OUTPUT_FIELD.search(text)
+        output = output.group(1) if output else "answer"
+        question = fields.get("question", "")
+        for field, pattern, response in self.rules:
+            if field in (None, output) and pattern.search(question):
+                with self._lock:
+                    self.scripted += 1
+                value = response
+                break
+        else:
+            if output == "sql_query":
+                value = stub_sql(question)
+            elif "context" in fields:
+                value = stub_answer(fields["context"])
+            else:
+                value = stub_route(question)
+        return f"[[ ## {output} ## ]]\n{value}\n\n[[ ## completed ## ]]"
+
+    def complete(self, request):
+        return self._respond(request, self.answer(request.messages[-1].text))
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "scripted": self.scripted}
+
+
+class ReplayEngine(_LocalEngine):
+    """
+    Serves completions recorded by LMRecorder, keyed by the full prompt.
+    Prompts that were never recorded go to `fallback` (a ScriptedEngine by
+    default) and are counted as misses.
+    """
+
+    def __init__(self, path: str, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 fallback: Optional[ScriptedEngine] = None):
+        super().__init__(latency_ms, jitter_ms)
+        self.responses = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.responses[record["key"]] = record["outputs"][0]
+        self.fallback = fallback or ScriptedEngine()
+        self.hits = 0
+        self.misses = 0
+
+    def complete(self, request):
+        text = self.responses.get(prompt_key(_request_messages(request)))
+        with self._lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if text is None:
+            text = self.fallback.answer(request.messages[-1].text)
+        return self._respond(request, text)
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "hits": self.hits, "misses": self.misses}
+
+
+def _lm_recorder_class():
+    from dspy.utils.callback import BaseCallback
+
+    class LMRecorder(BaseCallback):
+        """Appends every LM prompt and completion to a JSONL file for ReplayEngine."""
+
+        def __init__(self, path: str):
+            self.path = path
+            self._pending = {}
+            self._lock = threading.Lock()
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        def on_lm_start(self, call_id, instance, inputs):
+            messages = inputs.get("messages") or [{"role": "user", "content": inputs.get("prompt") or ""}]
+            self._pending[call_id] = (getattr(instance, "model", ""),
+                                      [(m["role"], str(m["content"])) for m in messages])
+
+        def on_lm_end(self, call_id, outputs, exception=None):
+            pending = self._pending.pop(call_id, None)
+            if exception is not None or not outputs or pending is None:
+                return
+            model, messages = pending
+            texts = [o if isinstance(o, str) else o.get("text", "") for o in outputs]
+            record = {"key": prompt_key(messages), "model": model, "outputs": texts}
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+
+    return LMRecorder
+
+
+def build_lm(backend: str = "ollama", script: Optional[str] = None, replay: Optional[str] = None,
+             latency_ms: float = 0.0, jitter_ms: float = 0.0, record: Optional[str] = None):
+    """
+    A dspy.LM for the chosen backend. `record` appends every prompt and
+    completion to a JSONL file that a later `replay` run can serve.
+    Returns (lm, engine); engine is None for ollama.
+    """
+    import dspy
+
+    callbacks = [_lm_recorder_class()(record)] if record else []
+    if backend == "ollama":
+        lm = dspy.LM(model=f"ollama/{OLLAMA_MODEL}", api_base=OLLAMA_API_BASE, temperature=0, callbacks=callbacks)
+        return lm, None
+    if backend == "stub":
+        engine = ScriptedEngine(script, latency_ms, jitter_ms)
+    elif backend == "replay":
+        if not replay:
+            raise ValueError("the replay backend needs a recording (--lm-replay)")
+        engine = ReplayEngine(replay, latency_ms, jitter_ms, fallback=ScriptedEngine(script))
+    else:
+        raise ValueError(f"unknown LM backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+    # temperature=0 keeps LM cache keys in line with the ollama backend's
+    lm = dspy.LM(f"{backend}/offline", engine=engine, cache=False, temperature=0, callbacks=callbacks)
+    return lm, engine
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# -------------------------------------------------------------------------
+# Persistent LM Response Cache
+# -------------------------------------------------------------------------
+class LMCache:
+    """
+    SQLite-backed cache of LM predictions.
+    Entries older than `ttl_seconds` are treated as misses; once the cache
+    holds more than `max_entries`, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str, max_entries: int = 50000, ttl_seconds: Optional[float] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Opened on first use so importing the graph never touches the disk
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS lm_cache ("
+                " key TEXT PRIMARY KEY, signature TEXT, value TEXT,"
+                " created REAL, last_access REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_lm_cache_access ON lm_cache(last_access)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(signature: str, model: str, temperature: Any, inputs: Dict[str, Any]) -> str:
+        payload = json.dumps(
+            {"signature": signature, "model": model, "temperature": temperature, "inputs": inputs},
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value, created FROM lm_cache WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is None or (self.ttl_seconds is not None and now - row[1] > self.ttl_seconds):
+                if row is not None:
+                    conn.execute("DELETE FROM lm_cache WHERE key = ?", (key,))
+                    conn.commit()
+                self.misses += 1
+                return None
+            conn.execute("UPDATE lm_cache SET last_access = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key: str, signature: str, value: Dict[str, Any]):
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO lm_cache (key, signature, value, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, signature, json.dumps(value, default=str), now, now),
+            )
+            count = conn.execute("SELECT COUNT(*) FROM lm_cache").fetchone()[0]
+            if count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM lm_cache WHERE key IN "
+                    "(SELECT key FROM lm_cache ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+class CachedPredict:
+    """
+    Wraps a dspy.Predict so identical calls are answered from an LMCache.
+    The key covers the signature (name and instructions), the configured
+    model and temperature, and every input field.
+    """
+
+    def __init__(self, predict: "dspy.Predict", cache: LMCache):
+        self.predict = predict
+        self.cache = cache
+        signature = predict.signature
+        self.signature_name = signature.__name__
+        self._instructions = signature.instructions
+        self._output_fields = list(signature.output_fields.keys())
+
+    def __call__(self, **kwargs) -> "dspy.Prediction":
+        import dspy
+
+        if not self.cache.enabled:
+            return self.predict(**kwargs)
+
+        lm = dspy.settings.lm
+        model = getattr(lm, "model", str(lm))
+        temperature = getattr(lm, "kwargs", {}).get("temperature")
+        key = LMCache.make_key(
+            f"{self.signature_name}:{self._instructions}", model, temperature, kwargs
+        )
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            return dspy.Prediction(**cached)
+
+        pred = self.predict(**kwargs)
+        self.cache.set(key, self.signature_name, {f: getattr(pred, f, None) for f in self._output_fields})
+        return pred
@@ -0,0 +1,283 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, FrozenSet, List, Optional
+
+# -------------------------------------------------------------------------
+# Near-Duplicate Question Cache
+# -------------------------------------------------------------------------
+# Answers to earlier questions, matched on the normalized question text
+# (exact) or by character n-gram TF-IDF cosine similarity (near-duplicate).
+# Similar wording is not enough on its own: "top 3 ... 1997" and
+# "top 5 ... 1998" are close in n-gram space, and so are "opened" and
+# "unopened" or "before discounts" and "after discounts". A near match must
+# therefore use the same content words (everything but stopwords, compared
+# without plural/-ed endings, so only word order, inflection and stopwords may
+# differ), carry exactly the same entities (numbers, quoted names, capitalized
+# names, months, highest/lowest direction, the metric asked for and any
+# negation) and have the same format_hint.
+_NON_WORD = re.compile(r"[^a-z0-9'%./-]+")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_QUOTED = re.compile(r"['\"]([^'\"]+)['\"]")
+_CAPITALIZED = re.compile(r"(?<![.?!]\s)(?<!^)\b([A-Z][\w/&-]*(?:\s+[A-Z][\w/&-]*)*)")
+_MONTHS = ("january", "february", "march", "april", "may", "june", "july",
+           "august", "september", "october", "november", "december")
+_HIGH = {"highest", "most", "top", "best", "max", "maximum", "largest", "biggest"}
+_LOW = {"lowest", "least", "bottom", "worst", "min", "minimum", "smallest", "fewest"}
+# "Total quantity from X" is not "Total revenue from X"
+_METRICS = {"revenue": "revenue", "sales": "revenue", "quantity": "quantity", "units": "quantity",
+            "unit": "quantity", "aov": "aov", "average": "aov", "margin": "margin", "count": "count",
+            "many": "count", "number": "count"}
+# "orders not placed in 1997" is not "orders placed in 1997"
+_NEGATIONS = {"not", "no", "never", "without", "except", "excluding", "exclude", "non"}
+# Capitalized words that do not name an entity
+_NOT_ENTITIES = {"return", "revenue", "total", "per", "using", "according", "during", "what", "which",
+                 "who", "how", "top", "the", "kpi", "docs"}
+# Words a near-duplicate may add or drop. Nothing here may change the answer:
+# no negations, directions, comparisons or before/after.
+_STOPWORDS = {"a", "an", "the", "of", "in", "on", "at", "for", "to", "by", "from", "is", "are", "was", "were",
+              "be", "been", "do", "does", "did", "what", "which", "who", "whom", "how", "please", "me", "us",
+              "our", "we", "i", "you", "tell", "show", "give", "list", "find", "there", "that", "this", "it",
+              "its", "and", "as", "return", "s"}
+
+MERGE_PENDING = 256
+# Share of max_entries evicted at once, so the in-memory index is not rebuilt on every store
+EVICT_FRACTION = 0.1
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(_NON_WORD.sub(" ", question.lower()).split())
+
+
+def _stem(word: str) -> str:
+    """
+    Drops a possessive, plural or -ed ending and then a final e, so that
+    "orders"/"ordered" give "order" and "place"/"placed" give "plac".
+    """
+    word = word.strip("'./-")
+    if word.endswith("'s"):
+        word = word[:-2]
+    if len(word) > 4 and word.endswith("ies"):
+        word = word[:-3] + "y"
+    elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    elif len(word) > 5 and word.endswith("ed"):
+        word = word[:-2]
+    return word[:-1] if len(word) > 3 and word.endswith("e") else word
+
+
+def content_words(question: str) -> FrozenSet[str]:
+    """Stemmed words of the question other than stopwords."""
+    words = (w for w in _NON_WORD.sub(" ", question.lower()).split() if w not in _STOPWORDS)
+    return frozenset(stem for stem in map(_stem, words) if stem and stem not in _STOPWORDS)
+
+
+def question_entities(question: str) -> FrozenSet[str]:
+    """The facts a question is about; near-duplicates must agree on all of them."""
+    words = set(_NON_WORD.sub(" ", question.lower()).split())
+    entities = {f"n:{n}" for n in _NUMBER.findall(question)}
+    entities |= {f"q:{q.strip().lower()}" for q in _QUOTED.findall(question)}
+    for name in _CAPITALIZED.findall(question):
+        name = name.lower()
+        if name not in _NOT_ENTITIES:
+            entities.add(f"c:{name}")
+    entities |= {f"m:{m}" for m in _MONTHS if m in words or m[:3] in words}
+    if words & _HIGH:
+        entities.add("d:high")
+    if words & _LOW:
+        entities.add("d:low")
+    entities |= {f"k:{_METRICS[w]}" for w in words & _METRICS.keys()}
+    entities |= {f"x:{w}" for w in words & _NEGATIONS}
+    if any(w.endswith("n't") for w in words):
+        entities.add("x:not")
+    entities |= {f"w:{w}" for w in content_words(question)}
+    return frozenset(entities)
+
+
+class _Group:
+    """Entries sharing one format_hint, with a nearest-neighbour index over them."""
+
+    def __init__(self):
+        self.texts: List[str] = []
+        self.entities: List[FrozenSet[str]] = []
+        self.answers: List[Dict[str, Any]] = []
+        self.exact: Dict[str, int] = {}
+        self.indexed = 0
+        self.transformer = None
+        self.neighbors = None
+        self.pending = None
+
+    def add(self, text: str, entities: FrozenSet[str], answer: Dict[str, Any]):
+        if text in self.exact:
+            self.answers[self.exact[text]] = answer
+            return
+        self.exact[text] = len(self.texts)
+        self.texts.append(text)
+        self.entities.append(entities)
+        self.answers.append(answer)
+
+
+class QuestionCache:
+    """
+    Stores {final_answer, sql, citations, ...} per question in an SQLite file
+    and serves them for the same or a near-duplicate question.
+    Every call passes a `context` string (database fingerprint, docs snapshot,
+    model) and only entries stored under that context are used, so a changed
+    database, docs folder or LM never serves stale answers. Entries of other
+    contexts (e.g. another LM backend) stay on disk for when it comes back.
+    Once the file holds more than `max_entries`, the oldest entries (of any
+    context) are evicted.
+    """
+
+    def __init__(self, path: str, threshold: float = 0.85, max_entries: int = 50000):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.enabled = True
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._context = None
+        self._groups: Dict[str, _Group] = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        self._vectorizer = None
+
+    # --- storage ----------------------------------------------------------
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS question_cache ("
+                " context TEXT, format_hint TEXT, normalized TEXT, question TEXT, answer TEXT, created REAL,"
+                " PRIMARY KEY (context, format_hint, normalized))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_question_cache_created ON question_cache(created)")
+            self._conn.commit()
+        return self._conn
+
+    def _use_context(self, context: str):
+        """Loads this context's entries, unless they are the ones already loaded."""
+        if context != self._context:
+            self._load(context)
+
+    def _load(self, context: str):
+        conn = self._connect()
+        self._groups = {}
+        rows = conn.execute(
+            "SELECT format_hint, normalized, question, answer FROM question_cache WHERE context = ?"
+            " ORDER BY created DESC LIMIT ?", (context, self.max_entries)
+        ).fetchall()
+        for format_hint, normalized, question, answer in reversed(rows):
+            self._group(format_hint).add(normalized, question_entities(question), json.loads(answer))
+        self._context = context
+
+    def _group(self, format_hint: str) -> _Group:
+        group = self._groups.get(format_hint)
+        if group is None:
+            group = self._groups[format_hint] = _Group()
+        return group
+
+    # --- similarity -------------------------------------------------------
+    def _vectorize(self, texts: List[str]):
+        # scikit-learn is only imported once a near-duplicate lookup needs it
+        if self._vectorizer is None:
+            from sklearn.feature_extraction.text import HashingVectorizer
+            self._vectorizer = HashingVectorizer(analyzer="char_wb", ngram_range=(3, 5), n_features=2 ** 18,
+                                                 alternate_sign=False, norm=None)
+        return self._vectorizer.transform(texts)
+
+    def _reindex(self, group: _Group):
+        """Refits IDF and the neighbour index over every entry of the group."""
+        from sklearn.feature_extraction.text import TfidfTransformer
+        from sklearn.neighbors import NearestNeighbors
+
+        counts = self._vectorize(group.texts)
+        group.transformer = TfidfTransformer(sublinear_tf=True).fit(counts)
+        group.neighbors = NearestNeighbors(metric="cosine", algorithm="brute").fit(group.transformer.transform(counts))
+        group.indexed = len(group.texts)
+        group.pending = None
+
+    def _nearest(self, group: _Group, text: str, entities: FrozenSet[str]) -> Optional[int]:
+        if len(group.texts) - group.indexed > MERGE_PENDING or group.neighbors is None:
+            self._reindex(group)
+        query = group.transformer.transform(self._vectorize([text]))
+        candidates = []
+        k = min(5, group.indexed)
+        distances, indices = group.neighbors.kneighbors(query, n_neighbors=k)
+        candidates.extend(zip(1 - distances[0], indices[0]))
+        if group.indexed < len(group.texts):
+            # Entries added since the last reindex are compared directly
+            if group.pending is None or group.pending.shape[0] != len(group.texts) - group.indexed:
+                group.pending = group.transformer.transform(self._vectorize(group.texts[group.indexed:]))
+            similarities = (group.pending @ query.T).toarray().ravel()
+            candidates.extend((s, group.indexed + i) for i, s in enumerate(similarities))
+        for similarity, index in sorted(candidates, key=lambda c: -c[0]):
+            if similarity < self.threshold:
+                break
+            if group.entities[index] == entities:
+                return int(index)
+        return None
+
+    # --- public API -------------------------------------------------------
+    def lookup(self, question: str, format_hint: str, context: str) -> Optional[Dict[str, Any]]:
+        """The stored answer for this or a near-duplicate question, or None."""
+        text = normalize_question(question)
+        with self._lock:
+            self._use_context(context)
+            group = self._groups.get(format_hint)
+            index = group.exact.get(text) if group else None
+            if index is not None:
+                self.exact_hits += 1
+                return group.answers[index]
+            if group and group.texts:
+                index = self._nearest(group, text, question_entities(question))
+                if index is not None:
+                    self.near_hits += 1
+                    return group.answers[index]
+            self.misses += 1
+            return None
+
+    def preload(self, context: str):
+        """Loads this context's entries and builds their neighbour indexes now, not on the first lookup."""
+        with self._lock:
+            self._use_context(context)
+            for group in self._groups.values():
+                if group.texts and group.neighbors is None:
+                    self._reindex(group)
+
+    def store(self, question: str, format_hint: str, context: str, answer: Dict[str, Any]):
+        text = normalize_question(question)
+        with self._lock:
+            self._use_context(context)
+            self._group(format_hint).add(text, question_entities(question), answer)
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO question_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (context, format_hint, text, question, json.dumps(answer, default=str), time.time()),
+            )
+            count = conn.execute("SELECT COUNT(*) FROM question_cache").fetchone()[0]
+            if count > self.max_entries:
+                excess = count - self.max_entries + int(self.max_entries * EVICT_FRACTION)
+                conn.execute(
+                    "DELETE FROM question_cache WHERE rowid IN "
+                    "(SELECT rowid FROM question_cache ORDER BY created ASC LIMIT ?)", (excess,)
+                )
+            conn.commit()
+            if count > self.max_entries:
+                # Evicted entries may be this context's; indexes are rebuilt on the next lookup
+                self._load(context)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.exact_hits + self.near_hits + self.misses
+        return {
+            "exact": self.exact_hits,
+            "near": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.near_hits) / total, 3) if total else 0.0,
+        }
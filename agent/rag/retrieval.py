@@ -1,89 +1,367 @@
+import hashlib
+import json
+import logging
 import os
 import re
-from rank_bm25 import BM25Okapi
-from typing import List, Dict
+import uuid
+import numpy as np
+from typing import List, Dict, Tuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Arrays persisted by BM25Index.save (memory-mapped on load)
+INDEX_ARRAYS = ("offsets", "doc_ids", "tfs", "doc_len", "norm", "idf")
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores, best first, in O(n) via argpartition.
+    Ties are broken by chunk order, matching a stable descending sort.
+    """
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < n:
+        part = np.argpartition(-scores, k - 1)[:k]
+        kth = scores[part].min()
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:k - len(above)]
+        idx = np.concatenate([above, ties])
+    else:
+        idx = np.arange(n)
+    return idx[np.lexsort((idx, -scores[idx]))]
+
+
+def top_k_sparse(doc_ids: np.ndarray, scores: np.ndarray, n_docs: int, k: int) -> np.ndarray:
+    """
+    Same ranking as top_k_indices over a dense array in which every document
+    not in `doc_ids` (sorted ascending) scores 0, without building that array.
+    """
+    k = min(k, n_docs)
+    positive = scores > 0
+    result = doc_ids[positive][top_k_indices(scores[positive], k)].tolist()
+    if len(result) < k:
+        # Zero-score documents come next, in document order
+        nonzero = set(doc_ids[scores != 0].tolist())
+        doc = 0
+        while len(result) < k and doc < n_docs:
+            if doc not in nonzero:
+                result.append(doc)
+            doc += 1
+    if len(result) < k:
+        negative = scores < 0
+        result.extend(doc_ids[negative][top_k_indices(scores[negative], k - len(result))].tolist())
+    return np.asarray(result, dtype=np.intp)
+
+
+class BM25Index:
+    """
+    Okapi BM25 over an inverted index (same scoring as rank_bm25.BM25Okapi).
+    Postings for all terms live in two flat arrays (document ids and term
+    frequencies) sliced by per-term offsets; IDF and length normalisation are
+    precomputed, so a query only touches documents containing its terms.
+    """
+
+    def __init__(self, tokenized_corpus: Optional[List[List[str]]], k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        if tokenized_corpus is None:
+            # Filled in by BM25Index.load
+            return
+        self.n_docs = len(tokenized_corpus)
+
+        # Map tokens to term ids, then count (term, doc) pairs in one vectorized
+        # pass; sorting by term groups each term's postings contiguously.
+        self.vocab: Dict[str, int] = {}
+        vocab = self.vocab
+        term_ids = np.fromiter(
+            (vocab.setdefault(t, len(vocab)) for tokens in tokenized_corpus for t in tokens), dtype=np.int64
+        )
+        doc_len = np.array([len(tokens) for tokens in tokenized_corpus], dtype=np.int64)
+        doc_of_token = np.repeat(np.arange(self.n_docs, dtype=np.int64), doc_len)
+        stride = max(self.n_docs, 1)
+        pairs, tf = np.unique(term_ids * stride + doc_of_token, return_counts=True)
+        terms = pairs // stride
+
+        lengths = np.bincount(terms, minlength=len(vocab))
+        self.offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.doc_ids = (pairs % stride).astype(np.int32)
+        self.tfs = tf.astype(np.float32)
+
+        doc_len = doc_len.astype(np.float64)
+        self.doc_len = doc_len
+        avgdl = doc_len.mean() if self.n_docs else 1.0
+        self.norm = k1 * (1 - b + b * doc_len / avgdl)
+
+        # Same IDF (with epsilon floor for very common terms) as BM25Okapi
+        df = np.asarray(lengths, dtype=np.float64)
+        idf = np.log(self.n_docs - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            idf[idf < 0] = epsilon * idf.mean()
+        self.idf = idf
+
+    def save(self, directory: str, tag: str) -> Dict:
+        """Writes the arrays as `<name>-<tag>.npy` plus the vocabulary; returns their metadata."""
+        for name in INDEX_ARRAYS:
+            np.save(os.path.join(directory, f"{name}-{tag}.npy"), getattr(self, name))
+        with open(os.path.join(directory, f"vocab-{tag}.json"), "w", encoding="utf-8") as f:
+            json.dump(list(self.vocab), f)
+        return {"tag": tag, "n_docs": self.n_docs, "k1": self.k1, "b": self.b}
+
+    @classmethod
+    def load(cls, directory: str, meta: Dict) -> "BM25Index":
+        """
+        Loads an index written by save(); the arrays are memory-mapped, not read.
+        Raises FileNotFoundError for a missing file and ValueError for a
+        truncated or inconsistent one.
+        """
+        index = cls(None, k1=meta["k1"], b=meta["b"])
+        index.n_docs = meta["n_docs"]
+        tag = meta["tag"]
+        for name in INDEX_ARRAYS:
+            setattr(index, name, np.load(os.path.join(directory, f"{name}-{tag}.npy"), mmap_mode="r"))
+        with open(os.path.join(directory, f"vocab-{tag}.json"), "r", encoding="utf-8") as f:
+            index.vocab = {term: tid for tid, term in enumerate(json.load(f))}
+        n_terms = len(index.vocab)
+        if (len(index.offsets) != n_terms + 1 or len(index.idf) != n_terms
+                or len(index.doc_len) != index.n_docs or len(index.norm) != index.n_docs
+                or len(index.doc_ids) != len(index.tfs) or (n_terms and index.offsets[-1] != len(index.doc_ids))):
+            raise ValueError(f"BM25 snapshot {tag} is inconsistent")
+        return index
+
+    def term_scores(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Documents containing `term` (ascending) and the term's BM25 contribution to each."""
+        tid = self.vocab.get(term)
+        if tid is None:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+        start, end = self.offsets[tid], self.offsets[tid + 1]
+        docs = self.doc_ids[start:end]
+        tf = self.tfs[start:end].astype(np.float64)
+        return docs, self.idf[tid] * (tf * (self.k1 + 1) / (tf + self.norm[docs]))
+
+    @staticmethod
+    def combine(parts: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Sums per-term (docs, scores) pairs into one sparse score vector."""
+        parts = [p for p in parts if len(p[0])]
+        if not parts:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+        if len(parts) == 1:
+            return parts[0]
+        docs, inverse = np.unique(np.concatenate([p[0] for p in parts]), return_inverse=True)
+        return docs, np.bincount(inverse, weights=np.concatenate([p[1] for p in parts]))
+
+    def score(self, tokens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        return self.combine([self.term_scores(t) for t in tokens])
+
+    def get_scores(self, tokens: List[str]) -> np.ndarray:
+        """Dense score for every document (BM25Okapi.get_scores equivalent)."""
+        scores = np.zeros(self.n_docs)
+        docs, doc_scores = self.score(tokens)
+        scores[docs] = doc_scores
+        return scores
+
+    def top_k(self, tokens: List[str], k: int) -> np.ndarray:
+        docs, doc_scores = self.score(tokens)
+        return top_k_sparse(docs, doc_scores, self.n_docs, k)
+
+def chunk_markdown(filename: str, content: str) -> List[Dict]:
+    """
+    Splits one markdown file into chunks by Level 2 headers (##),
+    keeping each header with its body so context isn't lost.
+    """
+    chunks = []
+    # Split by Level 2 headers (## Title)
+    # We prepend the header back to the chunk so context isn't lost
+    parts = re.split(r'(^##\s.*)', content, flags=re.MULTILINE)
+    
+    # The first part (index 0) is usually the title/intro before the first ##
+    # subsequent parts are [header, content, header, content...]
+    
+    current_doc_name = filename.replace(".md", "")
+    
+    # Handle the intro part (before first ##)
+    if parts[0].strip():
+        chunks.append({
+            "id": f"{current_doc_name}::intro",
+            "text": parts[0].strip(),
+            "source": filename
+        })
+
+    # Handle the rest (header + body)
+    for i in range(1, len(parts), 2):
+        header = parts[i].strip()
+        body = parts[i+1].strip() if i+1 < len(parts) else ""
+        full_text = f"{header}\n{body}"
+        
+        # specific ID for citation e.g., marketing_calendar::Summer Beverages 1997
+        # Clean header for ID
+        clean_header = re.sub(r'[^\w\s-]', '', header.replace("##", "").strip())
+        chunk_id = f"{current_doc_name}::{clean_header}"
+        
+        chunks.append({
+            "id": chunk_id,
+            "text": full_text,
+            "source": filename
+        })
+    return chunks
+
+
+def _content_hash(digests: Dict[str, str]) -> str:
+    """One hash for a docs folder from its per-file sha256 digests."""
+    return hashlib.sha256(json.dumps(sorted(digests.items())).encode("utf-8")).hexdigest()
+
 
 class SimpleRetriever:
-    def __init__(self, docs_path: str):
+    def __init__(self, docs_path: str, index_dir: Optional[str] = None):
+        """
+        Loads and indexes the .md files in docs_path.
+        With `index_dir`, chunks and the BM25 index are snapshotted there: an
+        unchanged docs folder is loaded from the snapshot (arrays memory-mapped),
+        and only files whose mtime/size and content hash changed are re-chunked.
+        Any change rebuilds the BM25 arrays from all chunks, since IDF and the
+        average chunk length depend on the whole corpus. A missing or damaged
+        snapshot is rebuilt.
+        """
         self.docs_path = docs_path
+        self.index_dir = index_dir
         self.chunks = []
         self.bm25 = None
-        self._load_and_chunk()
-        self._build_index()
+        # Identifies the loaded docs (file names and contents)
+        self.content_hash = ""
+        if not os.path.exists(self.docs_path):
+            raise FileNotFoundError(f"Docs folder not found: {self.docs_path}")
+        if index_dir:
+            self._load_snapshot()
+        else:
+            self._load_and_chunk()
+            self._build_index()
+
+    def _markdown_files(self) -> List[str]:
+        return sorted(f for f in os.listdir(self.docs_path) if f.endswith(".md"))
 
     def _load_and_chunk(self):
         """
         Reads all .md files in docs_path and splits them into chunks.
         Splits by markdown headers (##) to keep context together.
         """
-        if not os.path.exists(self.docs_path):
-            raise FileNotFoundError(f"Docs folder not found: {self.docs_path}")
-
-        for filename in os.listdir(self.docs_path):
-            if filename.endswith(".md"):
-                filepath = os.path.join(self.docs_path, filename)
-                with open(filepath, "r", encoding="utf-8") as f:
-                    content = f.read()
-                
-                # Split by Level 2 headers (## Title)
-                # We prepend the header back to the chunk so context isn't lost
-                parts = re.split(r'(^##\s.*)', content, flags=re.MULTILINE)
-                
-                # The first part (index 0) is usually the title/intro before the first ##
-                # subsequent parts are [header, content, header, content...]
-                
-                current_doc_name = filename.replace(".md", "")
-                
-                # Handle the intro part (before first ##)
-                if parts[0].strip():
-                    self.chunks.append({
-                        "id": f"{current_doc_name}::intro",
-                        "text": parts[0].strip(),
-                        "source": filename
-                    })
-
-                # Handle the rest (header + body)
-                for i in range(1, len(parts), 2):
-                    header = parts[i].strip()
-                    body = parts[i+1].strip() if i+1 < len(parts) else ""
-                    full_text = f"{header}\n{body}"
-                    
-                    # specific ID for citation e.g., marketing_calendar::Summer Beverages 1997
-                    # Clean header for ID
-                    clean_header = re.sub(r'[^\w\s-]', '', header.replace("##", "").strip())
-                    chunk_id = f"{current_doc_name}::{clean_header}"
-                    
-                    self.chunks.append({
-                        "id": chunk_id,
-                        "text": full_text,
-                        "source": filename
-                    })
+        digests = {}
+        for filename in self._markdown_files():
+            filepath = os.path.join(self.docs_path, filename)
+            with open(filepath, "rb") as f:
+                raw = f.read()
+            digests[filename] = hashlib.sha256(raw).hexdigest()
+            self.chunks.extend(chunk_markdown(filename, raw.decode("utf-8")))
+        self.content_hash = _content_hash(digests)
 
     def _build_index(self):
         """
         Tokenizes chunks and builds the BM25 index.
         """
         tokenized_corpus = [chunk["text"].lower().split() for chunk in self.chunks]
-        self.bm25 = BM25Okapi(tokenized_corpus)
+        self.bm25 = BM25Index(tokenized_corpus)
+
+    # --- on-disk snapshot -------------------------------------------------
+    def _manifest_path(self) -> str:
+        return os.path.join(self.index_dir, "manifest.json")
+
+    def _load_snapshot(self):
+        """Loads the snapshot, re-chunking only changed files and rewriting it if needed."""
+        manifest = {}
+        if os.path.exists(self._manifest_path()):
+            try:
+                with open(self._manifest_path(), "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except ValueError:
+                logger.warning("Unreadable retrieval manifest in %s; rebuilding the snapshot", self.index_dir)
+        old_files = manifest.get("files", {})
+
+        files, changed = {}, False
+        for filename in self._markdown_files():
+            filepath = os.path.join(self.docs_path, filename)
+            st = os.stat(filepath)
+            entry = old_files.get(filename)
+            if entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+                files[filename] = entry
+                continue
+            with open(filepath, "rb") as f:
+                raw = f.read()
+            digest = hashlib.sha256(raw).hexdigest()
+            if entry and entry["sha256"] == digest:
+                # Touched but not edited: keep chunks, just record the new mtime
+                files[filename] = dict(entry, mtime_ns=st.st_mtime_ns, size=st.st_size)
+            else:
+                files[filename] = {
+                    "mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha256": digest,
+                    "chunks": chunk_markdown(filename, raw.decode("utf-8")),
+                }
+                changed = True
+        changed = changed or set(files) != set(old_files) or "index" not in manifest
+
+        for filename in files:
+            self.chunks.extend(files[filename]["chunks"])
+        self.content_hash = _content_hash({name: entry["sha256"] for name, entry in files.items()})
+
+        if not changed:
+            try:
+                self.bm25 = BM25Index.load(self.index_dir, manifest["index"])
+            except (FileNotFoundError, ValueError) as e:
+                logger.warning("Retrieval snapshot in %s is damaged (%s); rebuilding it", self.index_dir, e)
+            else:
+                if files != old_files:
+                    self._write_manifest(files, manifest["index"])
+                return
+
+        self._build_index()
+        os.makedirs(self.index_dir, exist_ok=True)
+        meta = self.bm25.save(self.index_dir, uuid.uuid4().hex[:12])
+        self._write_manifest(files, meta)
+        self._remove_stale(meta["tag"])
+
+    def _write_manifest(self, files: Dict, index_meta: Dict):
+        # Written last and atomically, so a crash never points at partial arrays
+        tmp = self._manifest_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"files": files, "index": index_meta}, f)
+        os.replace(tmp, self._manifest_path())
+
+    def _remove_stale(self, tag: str):
+        """Deletes array/vocab files from earlier snapshots."""
+        for name in os.listdir(self.index_dir):
+            stem, ext = os.path.splitext(name)
+            if ext in (".npy", ".json") and "-" in stem and not stem.endswith(f"-{tag}"):
+                try:
+                    os.remove(os.path.join(self.index_dir, name))
+                except OSError:
+                    # Still mapped by another process (e.g. on Windows)
+                    pass
 
     def retrieve(self, query: str, k: int = 3) -> List[Dict]:
         """
         Returns top k relevant chunks for the query.
         """
         tokenized_query = query.lower().split()
-        scores = self.bm25.get_scores(tokenized_query)
-        
-        # Zip scores with chunks
-        scored_chunks = []
-        for i, score in enumerate(scores):
-            scored_chunks.append({
-                "score": score,
-                "chunk": self.chunks[i]
-            })
-        
-        # Sort by score descending and take top k
-        scored_chunks.sort(key=lambda x: x["score"], reverse=True)
-        return [item["chunk"] for item in scored_chunks[:k]]
+        return [self.chunks[i] for i in self.bm25.top_k(tokenized_query, k)]
+
+    def retrieve_many(self, queries: List[str], k: int = 3) -> List[List[Dict]]:
+        """
+        Returns top k chunks for each query. Each distinct term's postings are
+        scored once for the whole batch and reused by every query containing it.
+        """
+        tokenized = [q.lower().split() for q in queries]
+        term_scores = {}
+        for tokens in tokenized:
+            for term in tokens:
+                if term not in term_scores:
+                    term_scores[term] = self.bm25.term_scores(term)
+
+        results = []
+        for tokens in tokenized:
+            docs, scores = self.bm25.combine([term_scores[t] for t in tokens])
+            top = top_k_sparse(docs, scores, self.bm25.n_docs, k)
+            results.append([self.chunks[i] for i in top])
+        return results
 
 # Quick test block
 if __name__ == "__main__":
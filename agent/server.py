@@ -0,0 +1,390 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import signal
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from agent.graph_hybrid import get_db_tool, warm_up
+from agent.question_cache import normalize_question
+from agent.tracing import percentile, tracer
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+# Agent Server
+# -------------------------------------------------------------------------
+# Keeps one process (and the compiled graph, database connections, BM25
+# index, router model and caches) alive between questions, so a question
+# costs only its own graph run. Serves HTTP on host:port or on a Unix socket:
+#   POST /ask      {"question": ..., "format_hint": "int", "id": optional} -> output object
+#   POST /batch    JSONL of such objects -> JSONL outputs, streamed as they finish
+#   GET  /health   liveness and queue depth
+#   GET  /metrics  request counts, scheduler latency, component stats and the
+#                  trace summary (?reset=1 starts a new trace window)
+# Every question goes through one scheduler with a fixed set of worker
+# threads (each keeping its own read-only SQLite connection):
+#   - Identical questions (same normalized text and format_hint) in flight at
+#     the same time, from any clients, share one graph run.
+#   - Interactive /ask requests are taken before queued /batch items, so a
+#     large batch does not hold up a single question.
+#   - Batch items whose client has disconnected are dropped before they start.
+INTERACTIVE, BATCH, _STOP = 0, 1, 2
+# Scheduler latency percentiles are over the most recent runs
+LATENCY_WINDOW = 10000
+MAX_BODY_BYTES = 16 * 2**20
+DEFAULT_FORMAT_HINT = "str"
+
+
+class QuestionScheduler:
+    """
+    Runs questions on `workers` long-lived threads, by priority then arrival.
+    `answer(item)` returns the output object for one question.
+    """
+
+    def __init__(self, answer: Callable[[Dict], Dict], workers: int):
+        self.answer = answer
+        self.workers = workers
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.dropped = 0
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._in_flight: Dict[Tuple[str, str], Future] = {}
+        self._running = 0
+        self._seconds = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._work, name=f"agent-worker-{n}", daemon=True)
+                         for n in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, item: Dict, priority: int = INTERACTIVE) -> Future:
+        """Future of the output for `item`, carrying its own id even when the run is shared."""
+        key = (normalize_question(item['question']), item['format_hint'])
+        with self._lock:
+            self.submitted += 1
+            shared = self._in_flight.get(key)
+            if shared is None:
+                shared = self._in_flight[key] = Future()
+                shared.waiters = 0
+                self._queue.put((priority, next(self._order), key, item, shared))
+            else:
+                self.coalesced += 1
+            shared.waiters += 1
+        result = Future()
+        result.shared = shared
+
+        def resolve(done: Future):
+            if done.cancelled():
+                result.cancel()
+            elif done.exception() is not None:
+                result.set_exception(done.exception())
+            else:
+                result.set_result({**done.result(), "id": item['id']})
+
+        shared.add_done_callback(resolve)
+        return result
+
+    def release(self, future: Future):
+        """The caller no longer wants `future`; its run is skipped if nobody else does and it has not started."""
+        with self._lock:
+            future.shared.waiters -= 1
+
+    @staticmethod
+    def running_seconds(future: Future) -> float:
+        """How long the run behind `future` has been going (0 while queued)."""
+        started = getattr(future.shared, "started", None)
+        return time.monotonic() - started if started is not None else 0.0
+
+    def _work(self):
+        # Each worker's own connection, opened before its first question
+        get_db_tool().pool.get()
+        while True:
+            priority, _order, key, item, shared = self._queue.get()
+            if priority == _STOP:
+                return
+            with self._lock:
+                if shared.waiters <= 0:
+                    del self._in_flight[key]
+                    self.dropped += 1
+                    shared.cancel()
+                    continue
+                self._running += 1
+            shared.started = time.monotonic()
+            shared.set_running_or_notify_cancel()
+            try:
+                output = self.answer(item)
+                error = None
+            except Exception as e:
+                output, error = None, e
+            with self._lock:
+                self._running -= 1
+                self.completed += 1
+                self._seconds.append(time.monotonic() - shared.started)
+                del self._in_flight[key]
+            if error is not None:
+                shared.set_exception(error)
+            else:
+                shared.set_result(output)
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put((_STOP, next(self._order), None, None, None))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            seconds = list(self._seconds)
+            running = self._running
+        return {
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "completed": self.completed,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+            "running": running,
+            "p50_ms": percentile(seconds, 50) * 1000,
+            "p95_ms": percentile(seconds, 95) * 1000,
+            "p99_ms": percentile(seconds, 99) * 1000,
+        }
+
+
+class AgentService:
+    """
+    What the HTTP handler talks to. `error(id, message)` builds the output for a
+    question that timed out; `component_stats()` is reported under /metrics.
+    """
+
+    def __init__(self, answer: Callable[[Dict], Dict], error: Callable[[str, str], Dict],
+                 component_stats: Callable[[], Dict], workers: int = 4, timeout: Optional[float] = None,
+                 warm_up_seconds: Optional[Dict[str, float]] = None):
+        self.scheduler = QuestionScheduler(answer, workers)
+        self.error = error
+        self.component_stats = component_stats
+        self.timeout = timeout
+        self.warm_up_seconds = warm_up_seconds or {}
+        self.started = time.monotonic()
+        self.requests: Dict[str, int] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def count(self, path: str):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def item(self, obj: Any) -> Dict:
+        """An input object with its defaults filled in; ValueError if it has no question."""
+        if not isinstance(obj, dict) or not isinstance(obj.get('question'), str) or not obj['question'].strip():
+            raise ValueError('expected an object with a non-empty "question"')
+        return {
+            "id": str(obj['id']) if obj.get('id') is not None else f"req-{next(self._ids)}",
+            "question": obj['question'],
+            "format_hint": obj.get('format_hint') or DEFAULT_FORMAT_HINT,
+        }
+
+    def results(self, items: Iterable[Dict], priority: int) -> Iterator[Dict]:
+        """
+        Outputs in completion order. A question running longer than `timeout`
+        gets an error output; like run_concurrent, its thread finishes in the
+        background. Closing the generator early releases the unanswered items.
+        """
+        scheduler = self.scheduler
+        pending = {scheduler.submit(item, priority): item for item in items}
+        try:
+            while pending:
+                done, _ = wait(pending, timeout=1.0 if self.timeout else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    scheduler.release(future)
+                    if future.cancelled():
+                        yield self.error(item['id'], "Cancelled")
+                    elif future.exception() is not None:
+                        yield self.error(item['id'], str(future.exception()))
+                    else:
+                        yield future.result()
+                if self.timeout:
+                    for future, item in list(pending.items()):
+                        if scheduler.running_seconds(future) > self.timeout:
+                            logger.warning("TIMEOUT processing %s after %ss", item['id'], self.timeout)
+                            del pending[future]
+                            scheduler.release(future)
+                            yield self.error(item['id'], f"Timed out after {self.timeout}s")
+        finally:
+            for future in pending:
+                scheduler.release(future)
+
+    def ask(self, item: Dict) -> Dict:
+        return next(self.results([item], INTERACTIVE))
+
+    def health(self) -> Dict[str, Any]:
+        stats = self.scheduler.stats()
+        return {"status": "ok", "uptime_s": round(time.monotonic() - self.started, 3),
+                "workers": stats["workers"], "queued": stats["queued"], "running": stats["running"]}
+
+    def metrics(self, reset: bool = False) -> Dict[str, Any]:
+        with self._lock:
+            requests = dict(self.requests)
+        metrics = {
+            "uptime_s": round(time.monotonic() - self.started, 3),
+            "warm_up_s": self.warm_up_seconds,
+            "requests": requests,
+            "scheduler": self.scheduler.stats(),
+            "components": self.component_stats(),
+            "trace": tracer.summary(),
+        }
+        if reset:
+            # The trace keeps every event's latency; a long-running server starts a new window
+            tracer.reset()
+        return metrics
+
+    def close(self):
+        self.scheduler.close()
+
+
+# -------------------------------------------------------------------------
+# HTTP
+# -------------------------------------------------------------------------
+class AgentHandler(BaseHTTPRequestHandler):
+    server_version = "NorthwindCopilot/1.0"
+
+    @property
+    def service(self) -> AgentService:
+        return self.server.service
+
+    def address_string(self) -> str:
+        # Unix socket peers have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    def _send_json(self, status: int, body: Any):
+        data = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> Optional[str]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            self._send_json(413, {"error": f"request body over {MAX_BODY_BYTES} bytes"})
+            return None
+        return self.rfile.read(length).decode("utf-8")
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path in ("/health", "/metrics"):
+            self.service.count(url.path)
+        if url.path == "/health":
+            self._send_json(200, self.service.health())
+        elif url.path == "/metrics":
+            self._send_json(200, self.service.metrics(reset=parse_qs(url.query).get("reset") == ["1"]))
+        else:
+            self._send_json(404, {"error": f"unknown path {url.path}"})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path not in ("/ask", "/batch"):
+            self._send_json(404, {"error": f"unknown path {path}"})
+            return
+        self.service.count(path)
+        body = self._body()
+        if body is None:
+            return
+        try:
+            if path == "/ask":
+                item = self.service.item(json.loads(body))
+            else:
+                items = self._batch_items(body)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        if path == "/ask":
+            self._send_json(200, self.service.ask(item))
+            return
+        # Streamed: the response ends when the connection closes
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        results = self.service.results(items, BATCH)
+        try:
+            for output in results:
+                self.wfile.write((json.dumps(output, default=str) + "\n").encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("Batch client disconnected; dropping its remaining questions")
+        finally:
+            results.close()
+
+    def _batch_items(self, body: str) -> List[Dict]:
+        items = []
+        for number, line in enumerate(body.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                items.append(self.service.item(json.loads(line)))
+            except ValueError as e:
+                raise ValueError(f"line {number}: {e}") from None
+        return items
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(address: str, service: AgentService) -> socketserver.BaseServer:
+    """HTTP server on "host:port" (or ":port") or on a Unix socket given as "unix:/path/to.sock"."""
+    if address.startswith("unix:"):
+        path = address[len("unix:"):]
+        if os.path.exists(path):
+            # Left behind by a server that did not shut down, unless one still answers on it
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                raise OSError(f"a server is already listening on {path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(path)
+            finally:
+                probe.close()
+        server = UnixHTTPServer(path, AgentHandler)
+    else:
+        host, _, port = address.rpartition(":")
+        server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), AgentHandler)
+    server.service = service
+    return server
+
+
+def serve(address: str, answer: Callable[[Dict], Dict], error: Callable[[str, str], Dict],
+          component_stats: Callable[[], Dict], workers: int = 4, timeout: Optional[float] = None):
+    """Builds every resource, then serves questions on `address` until interrupted."""
+    print("Warming up...")
+    seconds = warm_up()
+    print("Ready in " + ", ".join(f"{name} {s:.2f}s" for name, s in seconds.items()))
+    service = AgentService(answer, error, component_stats, workers=workers, timeout=timeout,
+                           warm_up_seconds=seconds)
+    server = make_server(address, service)
+    print(f"Serving on {address} with {workers} workers (POST /ask, POST /batch, GET /health, GET /metrics)")
+    # Shut down the same way on SIGTERM as on Ctrl-C (removes the socket file)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if address.startswith("unix:") and os.path.exists(address[len("unix:"):]):
+            os.remove(address[len("unix:"):])
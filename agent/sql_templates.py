@@ -0,0 +1,275 @@
+import datetime
+import logging
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+# Parametric SQL Templates
+# -------------------------------------------------------------------------
+REVENUE_EXPR = "SUM(oi.UnitPrice * oi.Quantity * (1 - oi.Discount))"
+
+CATEGORY_JOIN = " JOIN categories c ON p.CategoryID = c.CategoryID"
+
+# The same shapes as the GenerateSQLSignature cheat sheet. {where} is either
+# empty or " WHERE ..." built from the resolved filters; {category_join} is
+# only filled in when there is a category filter.
+TEMPLATES = {
+    "top_products_by_revenue": (
+        f"SELECT p.ProductName, {REVENUE_EXPR} AS Rev FROM orders o"
+        " JOIN order_items oi ON o.OrderID = oi.OrderID"
+        " JOIN products p ON oi.ProductID = p.ProductID"
+        "{category_join}{where} GROUP BY p.ProductName ORDER BY Rev DESC LIMIT {n};"
+    ),
+    "category_revenue": (
+        f"SELECT {REVENUE_EXPR} AS Revenue FROM orders o"
+        " JOIN order_items oi ON o.OrderID = oi.OrderID"
+        " JOIN products p ON oi.ProductID = p.ProductID"
+        " JOIN categories c ON p.CategoryID = c.CategoryID"
+        "{where};"
+    ),
+    "aov": (
+        f"SELECT {REVENUE_EXPR} / COUNT(DISTINCT o.OrderID) AS AOV FROM orders o"
+        " JOIN order_items oi ON o.OrderID = oi.OrderID"
+        "{where};"
+    ),
+    "top_category_by_quantity": (
+        "SELECT c.CategoryName, SUM(oi.Quantity) AS Qty FROM orders o"
+        " JOIN order_items oi ON o.OrderID = oi.OrderID"
+        " JOIN products p ON oi.ProductID = p.ProductID"
+        " JOIN categories c ON p.CategoryID = c.CategoryID"
+        "{where} GROUP BY c.CategoryName ORDER BY Qty DESC LIMIT 1;"
+    ),
+}
+
+# Which optional filters each template accepts
+TEMPLATE_FILTERS = {
+    "top_products_by_revenue": {"period", "category"},
+    "category_revenue": {"period", "category"},
+    "aov": {"period"},
+    "top_category_by_quantity": {"period"},
+}
+
+TOP_N_PRODUCTS = re.compile(r"\btop\s+(\d{1,3})\s+products?\b.*\brevenue\b", re.IGNORECASE)
+REVENUE = re.compile(r"\b(total\s+)?revenue\b", re.IGNORECASE)
+AOV = re.compile(r"\b(aov|average order value)\b", re.IGNORECASE)
+TOP_CATEGORY_QTY = re.compile(
+    r"\b(which|top|highest|most)\b.*\bcategory\b.*\b(quantity|units)\b"
+    r"|\btop\s+category\s+by\s+quantity\b",
+    re.IGNORECASE,
+)
+# A template is only used when every word of the question is accounted for:
+# by a slot (N, category, period), by the template's own words, or by the
+# wording common to all of them. Anything else ("lowest", "Q3", "share",
+# "before discounts", "over 1000", "and what was ...") changes the query, so
+# the LM writes it instead.
+COMMON_WORDS = {
+    "what", "was", "is", "the", "a", "an", "in", "during", "for", "of", "from", "by", "per", "as", "using",
+    "according", "to", "definition", "defined", "kpi", "docs", "marketing", "calendar", "dates",
+}
+TEMPLATE_WORDS = {
+    "top_products_by_revenue": {"top", "products", "total", "revenue", "category"},
+    "category_revenue": {"total", "revenue", "category"},
+    "aov": {"aov", "average", "order", "value"},
+    "top_category_by_quantity": {"which", "top", "highest", "most", "product", "category", "had", "total",
+                                 "quantity", "units", "sold"},
+}
+# The answer format ("Return a float rounded to 2 decimals.") and the revenue
+# formula the templates already use are not part of what is asked
+FORMAT_INSTRUCTION = re.compile(r"(?:^|(?<=[.?!]))\s*Return\b.*$", re.DOTALL)
+REVENUE_DEFINITION = re.compile(
+    r"\bRevenue uses Order Details:\s*SUM\(\s*UnitPrice\s*\*\s*Quantity\s*\*\s*\(\s*1\s*-\s*Discount\s*\)\s*\)\.?",
+    re.IGNORECASE,
+)
+WORD = re.compile(r"[a-z0-9]+")
+CALENDAR_HINT = re.compile(r"\b(campaign|calendar|promotion|season)\b", re.IGNORECASE)
+ALL_TIME = re.compile(r"\ball[-\s]time\b", re.IGNORECASE)
+YEAR = re.compile(r"\b(19\d{2}|20\d{2})\b")
+MONTHS = ["january", "february", "march", "april", "may", "june", "july",
+          "august", "september", "october", "november", "december"]
+MONTH_YEAR = re.compile(
+    r"\b(" + "|".join(m[:3] + r"[a-z]*" for m in MONTHS) + r")\.?\s+(19\d{2}|20\d{2})\b",
+    re.IGNORECASE,
+)
+QUOTED = re.compile(r"(?<!\w)['\"]([^'\"]+)['\"]")
+CALENDAR_DATES = re.compile(r"Dates:\s*(\d{4}-\d{2}-\d{2})\s*to\s*(\d{4}-\d{2}-\d{2})")
+
+# Returned by _resolve_period when a period is mentioned but cannot be pinned down
+_UNRESOLVED = object()
+
+
+def _sql_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def parse_calendar(chunks: Iterable[Dict]) -> Dict[str, Tuple[str, str]]:
+    """
+    Date ranges from the marketing calendar chunks, keyed by lowercased
+    section title: {"summer beverages 1997": ("1997-06-01", "1997-06-30")}.
+    """
+    calendar = {}
+    for chunk in chunks:
+        if not chunk.get("source", "").startswith("marketing_calendar"):
+            continue
+        match = CALENDAR_DATES.search(chunk["text"])
+        title = chunk["text"].splitlines()[0].lstrip("#").strip()
+        if match and title:
+            calendar[title.lower()] = (match.group(1), match.group(2))
+    return calendar
+
+
+class SQLTemplates:
+    """
+    Emits SQL for the common question shapes (top-N products by revenue,
+    category revenue, AOV, top category by quantity) without calling the LM.
+    Entities are filled from the question: N, a known category name and a
+    period (a marketing calendar section, "June 1997" or a year).
+    `match` returns None whenever the question does not fit a template
+    exactly, so the caller falls back to the SQL generator.
+    """
+
+    def __init__(self, categories: Iterable[str], calendar: Optional[Dict[str, Tuple[str, str]]] = None):
+        self.categories = sorted(set(categories), key=len, reverse=True)
+        self.calendar = calendar or {}
+        self.templates = dict(TEMPLATES)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def validate(self, explain) -> List[str]:
+        """
+        Compiles every template once through `explain(sql)` (which should raise
+        or return an error string on failure) and drops the ones this database
+        cannot run. Returns the names that were dropped.
+        """
+        dropped = []
+        for name, template in list(self.templates.items()):
+            try:
+                error = explain(template.format(where="", n=1, category_join=""))
+            except Exception as e:
+                error = str(e)
+            if isinstance(error, str) and error:
+                del self.templates[name]
+                dropped.append(name)
+        return dropped
+
+    # --- entities ---------------------------------------------------------
+    @staticmethod
+    def _category_variants(name: str) -> List[str]:
+        # "Dairy Products" is often written as just "Dairy"; "Meat/Poultry" as "Meat"
+        return sorted({name.lower(), re.split(r"[\s/]", name.lower())[0]}, key=len, reverse=True)
+
+    def _resolve_category(self, question: str) -> Optional[str]:
+        text = question.lower()
+        for name in self.categories:
+            if any(re.search(r"\b" + re.escape(v) + r"\b", text) for v in self._category_variants(name)):
+                return name
+        return None
+
+    def _resolve_period(self, question: str):
+        """(start, end_exclusive) ISO dates, None for no period, or _UNRESOLVED."""
+        text = question.lower()
+        for title, (start, end) in self.calendar.items():
+            if title in text:
+                end_exclusive = datetime.date.fromisoformat(end) + datetime.timedelta(days=1)
+                return start, end_exclusive.isoformat()
+        # A campaign or other quoted name we do not know the dates of
+        known = {c.lower() for c in self.categories}
+        if CALENDAR_HINT.search(question) or any(q.lower() not in known for q in QUOTED.findall(question)):
+            return _UNRESOLVED
+
+        month_years = MONTH_YEAR.findall(question)
+        years = set(YEAR.findall(question))
+        if len(month_years) == 1 and len(years) == 1:
+            month = [m[:3] for m in MONTHS].index(month_years[0][0][:3].lower()) + 1
+            year = int(month_years[0][1])
+            start = datetime.date(year, month, 1)
+            end = datetime.date(year + month // 12, month % 12 + 1, 1)
+            return start.isoformat(), end.isoformat()
+        if len(years) == 1 and not month_years:
+            year = int(years.pop())
+            return f"{year}-01-01", f"{year + 1}-01-01"
+        if years or month_years:
+            return _UNRESOLVED
+        return None
+
+    # --- matching ---------------------------------------------------------
+    def _shape(self, question: str) -> Optional[Tuple[str, Dict[str, int]]]:
+        top_n = TOP_N_PRODUCTS.search(question)
+        if top_n:
+            return "top_products_by_revenue", {"n": int(top_n.group(1))}
+        if AOV.search(question):
+            return "aov", {}
+        if TOP_CATEGORY_QTY.search(question):
+            return "top_category_by_quantity", {}
+        if REVENUE.search(question) and not re.search(r"\b(top|highest|lowest|which|rank)\b", question, re.IGNORECASE):
+            return "category_revenue", {}
+        return None
+
+    def match(self, question: str) -> Optional[Dict[str, str]]:
+        """Returns {"template", "sql"} or None if the LM should write the query."""
+        result = self._match(question)
+        with self._lock:
+            if result:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return result
+
+    def _uncovered(self, text: str, name: str, category: Optional[str]) -> List[str]:
+        """Words of `text` (calendar titles already removed) that no slot or template word accounts for."""
+        text = FORMAT_INSTRUCTION.sub(" ", REVENUE_DEFINITION.sub(" ", text))
+        text = ALL_TIME.sub(" ", text)
+        text = MONTH_YEAR.sub(" ", text)
+        text = YEAR.sub(" ", text)
+        if name == "top_products_by_revenue":
+            text = re.sub(r"\btop\s+\d{1,3}\b", " top ", text, flags=re.IGNORECASE)
+        text = text.lower()
+        if category:
+            for variant in self._category_variants(category):
+                text = re.sub(r"\b" + re.escape(variant) + r"\b", " ", text)
+        allowed = COMMON_WORDS | TEMPLATE_WORDS[name]
+        return [word for word in WORD.findall(text) if word not in allowed]
+
+    def _match(self, question: str) -> Optional[Dict[str, str]]:
+        shape = self._shape(question)
+        if shape is None or shape[0] not in self.templates:
+            return None
+        name, params = shape
+        allowed = TEMPLATE_FILTERS[name]
+
+        period = None if ALL_TIME.search(question) else self._resolve_period(question)
+        # "Summer Beverages 1997" names a period, not the Beverages category
+        text = question
+        for title in self.calendar:
+            text = re.sub(re.escape(title), " ", text, flags=re.IGNORECASE)
+        category = self._resolve_category(text)
+        if period is _UNRESOLVED:
+            return None
+        if period and "period" not in allowed:
+            return None
+        if category and "category" not in allowed:
+            return None
+        if name == "category_revenue" and not category:
+            return None
+        if not 0 < params.get("n", 1) <= 100:
+            return None
+        uncovered = self._uncovered(text, name, category)
+        if uncovered:
+            logger.debug("No template for %r: %s not covered by %s", question, uncovered, name)
+            return None
+
+        conditions = []
+        if category:
+            conditions.append(f"c.CategoryName = {_sql_literal(category)}")
+        if period:
+            conditions.append(f"o.OrderDate >= {_sql_literal(period[0])} AND o.OrderDate < {_sql_literal(period[1])}")
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        category_join = CATEGORY_JOIN if category else ""
+        return {"template": name,
+                "sql": self.templates[name].format(where=where, category_join=category_join, **params)}
+
+    def stats(self) -> Dict[str, int]:
+        return {"template": self.hits, "lm": self.misses}
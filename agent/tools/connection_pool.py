@@ -0,0 +1,58 @@
+import os
+import sqlite3
+import threading
+import urllib.parse
+from typing import List
+
+# -------------------------------------------------------------------------
+# Read-only, tuned SQLite connections
+# -------------------------------------------------------------------------
+PERFORMANCE_PRAGMAS = (
+    "PRAGMA query_only = ON",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",     # 64 MiB page cache per connection
+    "PRAGMA mmap_size = 268435456",   # 256 MiB memory-mapped I/O
+)
+
+# Number of compiled statements sqlite3 keeps per connection
+STATEMENT_CACHE_SIZE = 256
+
+
+def connect_readonly(db_path: str) -> sqlite3.Connection:
+    """Opens `db_path` read-only via a `mode=ro` URI and applies the performance pragmas."""
+    uri = "file:" + urllib.parse.quote(os.path.abspath(db_path)) + "?mode=ro"
+    conn = sqlite3.connect(
+        uri, uri=True, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE
+    )
+    for pragma in PERFORMANCE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """
+    Hands out one long-lived read-only connection per thread, so each worker
+    keeps its page cache and compiled statements across queries.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_readonly(self.db_path)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
@@ -0,0 +1,322 @@
+import json
+import re
+import sqlite3
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+# -------------------------------------------------------------------------
+# Index Advisor
+# -------------------------------------------------------------------------
+# OrderDate is declared DATETIME (NUMERIC affinity), so `LIKE '1997-06%'` can
+# never use an index on it. A TEXT column holding the date part can: the
+# prefix filter becomes a range on OrderDay (see rewrite_date_prefix).
+# Adding OrderDay changes the Orders table itself: `SELECT *` on it (and on
+# the views over it) returns one more column. `apply` therefore only adds it
+# when asked to (add_order_day=True, --add-order-day on the command line);
+# otherwise the proposals that need it are left out.
+NORMALIZED_DATE_COLUMN = "OrderDay"
+NORMALIZED_DATE_DDL = (
+    f"ALTER TABLE Orders ADD COLUMN {NORMALIZED_DATE_COLUMN} TEXT "
+    "GENERATED ALWAYS AS (substr(OrderDate, 1, 10)) VIRTUAL"
+)
+
+# Widest index proposed; beyond this only the seek columns are kept
+MAX_INDEX_COLUMNS = 6
+
+_DATE_PREFIX = re.compile(r"\b((?:\w+\.)?)OrderDate\s+LIKE\s+'(\d{4}(?:-\d{2}){0,2})%'", re.IGNORECASE)
+_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_TABLE_REF = re.compile(
+    r"\b(?:from|join)\s+(\"[^\"]+\"|\w+)"
+    r"(?:\s+(?:as\s+)?(?!(?:on|where|join|inner|left|cross|natural|group|order|limit|using)\b)(\w+))?",
+    re.IGNORECASE,
+)
+_COLREF = r"(?:(\w+)\.)?(\w+)"
+_JOIN_EQ = re.compile(rf"\b{_COLREF}\s*==?\s*{_COLREF}\b")
+_LITERAL_EQ = re.compile(rf"\b{_COLREF}\s*(?:==?|\bIN\b)\s*(?:'|\d|\()", re.IGNORECASE)
+_RANGE = re.compile(rf"\b{_COLREF}\s*(?:>=|<=|>|<|\bBETWEEN\b|\bLIKE\s+'[^%_'])", re.IGNORECASE)
+_VIEW = re.compile(r"select\s+\*\s+from\s+(\"[^\"]+\"|\w+)\s*;?\s*$", re.IGNORECASE)
+
+
+def rewrite_date_prefix(sql: str) -> str:
+    """
+    `o.OrderDate LIKE '1997-06%'` -> `(o.OrderDay >= '1997-06' AND o.OrderDay < '1997-07')`.
+    OrderDay is the first 10 characters of OrderDate as TEXT, so for prefixes
+    of a date this selects exactly the same rows, through an index.
+    """
+    def bounds(m):
+        alias, prefix = m.group(1), m.group(2)
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        col = f"{alias}{NORMALIZED_DATE_COLUMN}"
+        return f"({col} >= '{prefix}' AND {col} < '{upper}')"
+    return _DATE_PREFIX.sub(bounds, sql)
+
+
+def load_query_log(path: str) -> Counter:
+    """Executed SQL from a SQLiteDB `query_log` file, with how often each ran."""
+    queries = Counter()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                queries[json.loads(line)["sql"].strip().rstrip(";")] += 1
+    return queries
+
+
+class IndexAdvisor:
+    """
+    Analyzes a SQL workload with EXPLAIN QUERY PLAN (via SQLiteDB.explain),
+    reports full-table scans, automatic indexes and non-covering lookups, and
+    proposes covering indexes: columns compared to literals (or the join key)
+    first, one range column next, then every other column the query reads
+    from that table. Date-prefix LIKE filters are served by the normalized
+    OrderDay column, which `apply` adds only when allowed to.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    # --- schema helpers ---------------------------------------------------
+    def has_order_day(self) -> bool:
+        """Whether Orders already has the normalized OrderDay column."""
+        return NORMALIZED_DATE_COLUMN.lower() in (c.lower() for c in self.db.catalog.columns("Orders"))
+
+    def _base_tables(self) -> Dict[str, str]:
+        """Lowercased table/view name -> underlying table (views are `SELECT * FROM x`)."""
+        catalog = self.db.catalog
+        base = {name.lower(): name for name, info in catalog.tables.items() if info["type"] == "table"}
+        rows = self.db.pool.get().execute("SELECT name, sql FROM sqlite_master WHERE type = 'view'").fetchall()
+        for name, sql in rows:
+            m = _VIEW.search(sql or "")
+            target = catalog.resolve(m.group(1).strip('"')) if m else None
+            if target and catalog.tables[target]["type"] == "table":
+                base[name.lower()] = target
+        return base
+
+    def _existing_indexes(self, table: str) -> List[List[str]]:
+        conn = self.db.pool.get()
+        quoted = '"' + table.replace('"', '""') + '"'
+        indexes = []
+        for idx in conn.execute(f"PRAGMA index_list({quoted})").fetchall():
+            name = '"' + idx[1].replace('"', '""') + '"'
+            cols = [c[2] for c in conn.execute(f"PRAGMA index_info({name})").fetchall()]
+            indexes.append([c.lower() for c in cols if c])
+        return indexes
+
+    # --- analysis ---------------------------------------------------------
+    def analyze(self, queries: Dict[str, int]) -> List[Dict[str, Any]]:
+        """
+        One entry per query: {"sql", "count", "plan", "scans", "automatic",
+        "lookups", "error"}. Table names in scans/lookups are as the plan
+        prints them (alias or table).
+        """
+        results = []
+        # Date-prefix filters run as OrderDay ranges once that column exists
+        normalized = self.has_order_day()
+        for sql, count in sorted(queries.items(), key=lambda kv: -kv[1]):
+            plan = self.db.explain(rewrite_date_prefix(sql) if normalized else sql)
+            entry = {"sql": sql, "count": count, "plan": [], "scans": [], "automatic": [], "lookups": [], "error": None}
+            if isinstance(plan, str):
+                entry["error"] = plan
+                results.append(entry)
+                continue
+            entry["plan"] = [p["detail"] for p in plan]
+            for detail in entry["plan"]:
+                m = re.match(r"^(SCAN|SEARCH) (.+?)(?: USING (.*))?$", detail)
+                if not m:
+                    continue
+                kind, name, using = m.group(1), m.group(2), m.group(3) or ""
+                if "AUTOMATIC" in using:
+                    entry["automatic"].append(name)
+                elif kind == "SCAN" and "COVERING INDEX" not in using:
+                    entry["scans"].append(name)
+                elif kind == "SEARCH" and using.startswith("INDEX") and "COVERING" not in using:
+                    entry["lookups"].append(name)
+            results.append(entry)
+        return results
+
+    def _references(self, sql: str, base: Dict[str, str]) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Per alias: base table, literal/join equality, range and used columns."""
+        # Literal contents could look like column names; keep only whether they start with a wildcard
+        text = _LITERAL.sub(lambda m: "'%'" if m.group(0)[1:2] in ("%", "_") else "'x'", sql)
+        aliases = {}
+        for m in _TABLE_REF.finditer(text):
+            table = base.get(m.group(1).strip('"').lower())
+            if table is None:
+                return None
+            alias = (m.group(2) or m.group(1).strip('"')).lower()
+            aliases[alias] = {"table": table, "literal": [], "join": [], "range": [], "used": set(),
+                              "names": {alias, table.lower()}}
+
+        catalog = self.db.catalog
+        columns = {a: {c.lower(): c for c in catalog.columns(info["table"])} for a, info in aliases.items()}
+
+        def owner(alias, col):
+            col = col.lower()
+            if alias:
+                alias = alias.lower()
+                return alias if alias in aliases and col in columns[alias] else None
+            matches = [a for a in aliases if col in columns[a]]
+            return matches[0] if len(matches) == 1 else None
+
+        for m in re.finditer(rf"\b{_COLREF}\b", text):
+            a = owner(m.group(1), m.group(2))
+            if a:
+                aliases[a]["used"].add(columns[a][m.group(2).lower()])
+        for pattern, kind in ((_JOIN_EQ, "join"), (_LITERAL_EQ, "literal"), (_RANGE, "range")):
+            for m in pattern.finditer(text):
+                sides = [(m.group(1), m.group(2))] + ([(m.group(3), m.group(4))] if kind == "join" else [])
+                if kind == "join" and not all(owner(*s) for s in sides):
+                    continue
+                for alias, col in sides:
+                    a = owner(alias, col)
+                    if a and columns[a][col.lower()] not in aliases[a][kind]:
+                        aliases[a][kind].append(columns[a][col.lower()])
+        return aliases
+
+    def propose(self, analysis: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Index proposals for the tables the plans scan or look up without a
+        covering index: {"table", "columns", "sql", "normalized_date", "queries"}.
+        Proposals that are a prefix of another (or of an existing index) are dropped.
+        """
+        base = self._base_tables()
+        proposals: Dict[tuple, Dict[str, Any]] = {}
+        for entry in analysis:
+            flagged = {n.lower() for n in entry["scans"] + entry["automatic"] + entry["lookups"]}
+            if entry["error"] or not flagged:
+                continue
+            refs = self._references(entry["sql"], base)
+            if not refs:
+                continue
+            for alias, info in refs.items():
+                if not info["names"] & flagged:
+                    continue
+                normalized = False
+                ranges = list(info["range"])
+                if info["table"].lower() == "orders" and _DATE_PREFIX.search(entry["sql"]):
+                    ranges = [NORMALIZED_DATE_COLUMN] + [r for r in ranges if r.lower() != "orderdate"]
+                    normalized = True
+                # Tables with literal filters drive the join; the others are probed by join key
+                if info["literal"] or ranges:
+                    seek = info["literal"] + ranges[:1]
+                else:
+                    seek = info["join"]
+                if not seek:
+                    continue
+                cover = {c for c in info["used"] if c not in seek and not (normalized and c == "OrderDate")}
+                key = (info["table"], tuple(c.lower() for c in seek))
+                proposal = proposals.setdefault(key, {"table": info["table"], "seek": seek, "cover": set(),
+                                                      "normalized_date": normalized, "queries": 0})
+                proposal["cover"] |= cover
+                proposal["queries"] += entry["count"]
+
+        # A seek that is a prefix of a longer one is served by the longer index
+        for key in sorted(proposals, key=lambda k: len(k[1])):
+            longer = [k for k in proposals if k[0] == key[0] and len(k[1]) > len(key[1]) and k[1][:len(key[1])] == key[1]]
+            if longer:
+                target = proposals[longer[0]]
+                target["cover"] |= proposals[key]["cover"]
+                target["queries"] += proposals[key]["queries"]
+                target["normalized_date"] |= proposals[key]["normalized_date"]
+                del proposals[key]
+
+        # One index per seek prefix, covering what all its queries read
+        for proposal in proposals.values():
+            seek = proposal.pop("seek")
+            cover = sorted((c for c in proposal.pop("cover") if c not in seek), key=str.lower)
+            proposal["columns"] = seek + cover if len(seek) + len(cover) <= MAX_INDEX_COLUMNS else seek
+        proposals = {(p["table"], tuple(c.lower() for c in p["columns"])): p for p in proposals.values()}
+
+        existing = {t: self._existing_indexes(t) for t in {k[0] for k in proposals}}
+        kept = []
+        for (table, cols), proposal in proposals.items():
+            longer = [list(c) for (t, c) in proposals if t == table and len(c) > len(cols)] + existing[table]
+            if any(other[:len(cols)] == list(cols) for other in longer):
+                continue
+            name = "idx_advisor_" + re.sub(r"\W+", "_", table.lower()) + "_" + "_".join(c.lower() for c in proposal["columns"])
+            quoted = '"' + table.replace('"', '""') + '"'
+            proposal["sql"] = f"CREATE INDEX IF NOT EXISTS {name} ON {quoted}({', '.join(proposal['columns'])})"
+            kept.append(proposal)
+        return sorted(kept, key=lambda p: -p["queries"])
+
+    def apply(self, proposals: Iterable[Dict[str, Any]], add_order_day: bool = False) -> List[str]:
+        """
+        Creates the proposed indexes with a writable connection and returns the
+        statements run. Proposals on OrderDay are skipped while that column
+        does not exist, unless `add_order_day` allows adding it to Orders.
+        """
+        proposals = list(proposals)
+        statements = []
+        if any(p["normalized_date"] for p in proposals) and not self.has_order_day():
+            if add_order_day:
+                statements.append(NORMALIZED_DATE_DDL)
+            else:
+                proposals = [p for p in proposals if not p["normalized_date"]]
+        statements += [p["sql"] for p in proposals]
+        if not statements:
+            return statements
+        conn = sqlite3.connect(self.db.db_path)
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.commit()
+            conn.execute("ANALYZE")
+        finally:
+            conn.close()
+        # Open read connections keep planning with the schema and statistics they loaded
+        self.db.pool.close()
+        return statements
+
+    @staticmethod
+    def report(analysis: List[Dict[str, Any]], proposals: List[Dict[str, Any]]) -> str:
+        lines = [f"Analyzed {len(analysis)} distinct queries ({sum(e['count'] for e in analysis)} executions)."]
+        for entry in analysis:
+            issues = ([f"full scan of {n}" for n in entry["scans"]]
+                      + [f"automatic index on {n}" for n in entry["automatic"]]
+                      + [f"non-covering lookup on {n}" for n in entry["lookups"]])
+            if entry["error"]:
+                issues = [entry["error"]]
+            if issues:
+                lines.append(f"- x{entry['count']} {entry['sql'][:100]}")
+                lines.extend(f"    {issue}" for issue in issues)
+        lines.append("Proposed indexes:" if proposals else "No indexes to propose.")
+        for p in proposals:
+            note = " (uses normalized OrderDay)" if p["normalized_date"] else ""
+            lines.append(f"  {p['sql']};  -- {p['queries']} executions{note}")
+        return "\n".join(lines)
+
+
+# python -m agent.tools.index_advisor --log .cache/sql_log.jsonl [--apply]
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    from agent.tools.sqlite_tool import SQLiteDB
+
+    default_db = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../data/northwind.sqlite"))
+    parser = argparse.ArgumentParser(description="Propose indexes for an executed SQL workload.")
+    parser.add_argument("--db", default=default_db, help="SQLite database")
+    parser.add_argument("--log", action="append", default=[], help="SQLiteDB query_log JSONL file (repeatable)")
+    parser.add_argument("--sql", action="append", default=[], help="Extra query to analyze (repeatable)")
+    parser.add_argument("--apply", action="store_true", help="Create the proposed indexes")
+    parser.add_argument("--add-order-day", action="store_true",
+                        help="With --apply, also add the generated OrderDay column to Orders for the proposals "
+                             "that need it (SELECT * on Orders then returns one more column)")
+    args = parser.parse_args()
+
+    workload = Counter(args.sql)
+    for path in args.log:
+        workload.update(load_query_log(path))
+    if not workload:
+        parser.error("no queries: pass --log and/or --sql")
+
+    db = SQLiteDB(args.db, cache_size=0)
+    advisor = IndexAdvisor(db)
+    analysis = advisor.analyze(workload)
+    proposals = advisor.propose(analysis)
+    print(advisor.report(analysis, proposals))
+    if args.apply and proposals:
+        for statement in advisor.apply(proposals, add_order_day=args.add_order_day):
+            print(f"Executed: {statement}")
+        skipped = sum(p["normalized_date"] for p in proposals) if not advisor.has_order_day() else 0
+        if skipped:
+            print(f"Skipped {skipped} index(es) on OrderDay; pass --add-order-day to add that column to Orders.")
@@ -0,0 +1,134 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from agent.tools.connection_pool import connect_readonly
+
+# -------------------------------------------------------------------------
+# SQL Result Cache
+# -------------------------------------------------------------------------
+# Quoted literals/identifiers are matched first so whitespace inside them is kept
+_LITERAL_OR_SPACE = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|\s+""")
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapses whitespace and trailing semicolons so trivially different SQL shares a key."""
+    collapsed = _LITERAL_OR_SPACE.sub(lambda m: m.group(1) or " ", sql)
+    return collapsed.strip().rstrip(";").strip()
+
+
+class QueryCache:
+    """
+    Bounded LRU cache of query results, optionally persisted to an SQLite file.
+    Keys are normalized SQL plus a caller-supplied variant (e.g. the row cap);
+    values must be JSON-serializable to be persisted.
+    Every lookup is checked against the database fingerprint; when the file's
+    mtime/size or `PRAGMA data_version` changes, all cached results are dropped.
+    Cached values are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, db_path: str, max_entries: int = 256, persist_path: Optional[str] = None):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._version_conn = None
+        self._disk = None
+
+    # --- invalidation -----------------------------------------------------
+    def _file_state(self) -> Tuple[int, int]:
+        st = os.stat(self.db_path)
+        return st.st_mtime_ns, st.st_size
+
+    def _data_version(self) -> int:
+        # data_version only moves when *another* connection commits, so it
+        # must be read from a connection that stays open between queries.
+        if self._version_conn is None:
+            self._version_conn = connect_readonly(self.db_path)
+        return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _check_fingerprint(self):
+        fingerprint = (self._file_state(), self._data_version())
+        if fingerprint != self._fingerprint:
+            if self._fingerprint is not None:
+                self._entries.clear()
+            self._fingerprint = fingerprint
+
+    # --- disk persistence -------------------------------------------------
+    def _disk_conn(self) -> Optional[sqlite3.Connection]:
+        if self.persist_path and self._disk is None:
+            os.makedirs(os.path.dirname(self.persist_path) or ".", exist_ok=True)
+            self._disk = sqlite3.connect(self.persist_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS query_cache (sql TEXT PRIMARY KEY, db_state TEXT, rows TEXT)"
+            )
+            self._disk.commit()
+        return self._disk
+
+    def _disk_state(self) -> str:
+        return "%d:%d" % self._fingerprint[0]
+
+    def _disk_get(self, key: str) -> Optional[Any]:
+        conn = self._disk_conn()
+        if conn is None:
+            return None
+        row = conn.execute("SELECT db_state, rows FROM query_cache WHERE sql = ?", (key,)).fetchone()
+        if row is None or row[0] != self._disk_state():
+            return None
+        return json.loads(row[1])
+
+    def _disk_set(self, key: str, rows: Any):
+        conn = self._disk_conn()
+        if conn is None:
+            return
+        conn.execute(
+            "INSERT OR REPLACE INTO query_cache (sql, db_state, rows) VALUES (?, ?, ?)",
+            (key, self._disk_state(), json.dumps(rows, default=str)),
+        )
+        conn.commit()
+
+    # --- public API -------------------------------------------------------
+    def get(self, sql: str, variant: str = "") -> Optional[Any]:
+        key = f"{variant}|{normalize_sql(sql)}"
+        with self._lock:
+            self._check_fingerprint()
+            rows = self._entries.get(key)
+            if rows is None:
+                rows = self._disk_get(key)
+                if rows is not None:
+                    self._store(key, rows)
+            else:
+                self._entries.move_to_end(key)
+            if rows is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return rows
+
+    def set(self, sql: str, rows: Any, variant: str = ""):
+        key = f"{variant}|{normalize_sql(sql)}"
+        with self._lock:
+            self._check_fingerprint()
+            self._store(key, rows)
+            self._disk_set(key, rows)
+
+    def _store(self, key: str, rows: Any):
+        self._entries[key] = rows
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
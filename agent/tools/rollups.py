@@ -0,0 +1,475 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# -------------------------------------------------------------------------
+# Materialized Daily Rollups
+# -------------------------------------------------------------------------
+# Revenue/quantity pre-aggregated per day (and per product, category and
+# customer). OrderDay is the first 10 characters of OrderDate, so `>=`, `<`
+# and LIKE-prefix filters on OrderDate give the same rows on OrderDay.
+ROLLUP_DDL = """
+CREATE TABLE IF NOT EXISTS rollup_daily (
+    OrderDay TEXT, Revenue REAL, Quantity INTEGER, Orders INTEGER, Lines INTEGER);
+CREATE TABLE IF NOT EXISTS rollup_product_daily (
+    OrderDay TEXT, ProductID INTEGER, ProductName TEXT, CategoryID INTEGER, CategoryName TEXT,
+    Revenue REAL, Quantity INTEGER);
+CREATE TABLE IF NOT EXISTS rollup_category_daily (
+    OrderDay TEXT, CategoryID INTEGER, CategoryName TEXT, Revenue REAL, Quantity INTEGER, Orders INTEGER);
+CREATE TABLE IF NOT EXISTS rollup_customer_daily (
+    OrderDay TEXT, CustomerID TEXT, CompanyName TEXT, Revenue REAL, Quantity INTEGER, Orders INTEGER);
+CREATE INDEX IF NOT EXISTS idx_rollup_daily_day ON rollup_daily(OrderDay);
+CREATE INDEX IF NOT EXISTS idx_rollup_product_daily_day ON rollup_product_daily(OrderDay);
+CREATE INDEX IF NOT EXISTS idx_rollup_category_daily_day ON rollup_category_daily(OrderDay);
+CREATE INDEX IF NOT EXISTS idx_rollup_category_daily_name ON rollup_category_daily(CategoryName, OrderDay);
+CREATE INDEX IF NOT EXISTS idx_rollup_customer_daily_day ON rollup_customer_daily(OrderDay);
+CREATE TABLE IF NOT EXISTS rollup_meta (key TEXT PRIMARY KEY, value TEXT);
+-- Days whose rollup rows are stale; '*' means everything is
+CREATE TABLE IF NOT EXISTS rollup_dirty_days (OrderDay TEXT PRIMARY KEY);
+"""
+
+_DAY = "substr(o.OrderDate, 1, 10)"
+_REVENUE = "SUM(oi.UnitPrice * oi.Quantity * (1 - oi.Discount))"
+_LINES = 'FROM "Order Details" oi JOIN Orders o ON o.OrderID = oi.OrderID'
+
+# INSERT ... SELECT per rollup; {filter} restricts the rebuild to dirty days
+ROLLUP_QUERIES = {
+    "rollup_daily": (
+        f"INSERT INTO rollup_daily SELECT {_DAY}, {_REVENUE}, SUM(oi.Quantity),"
+        f" COUNT(DISTINCT o.OrderID), COUNT(*) {_LINES} {{filter}} GROUP BY 1"
+    ),
+    "rollup_product_daily": (
+        f"INSERT INTO rollup_product_daily SELECT {_DAY}, p.ProductID, p.ProductName, c.CategoryID,"
+        f" c.CategoryName, {_REVENUE}, SUM(oi.Quantity) {_LINES}"
+        " JOIN Products p ON p.ProductID = oi.ProductID JOIN Categories c ON c.CategoryID = p.CategoryID"
+        " {filter} GROUP BY 1, p.ProductID"
+    ),
+    "rollup_category_daily": (
+        f"INSERT INTO rollup_category_daily SELECT {_DAY}, c.CategoryID, c.CategoryName, {_REVENUE},"
+        f" SUM(oi.Quantity), COUNT(DISTINCT o.OrderID) {_LINES}"
+        " JOIN Products p ON p.ProductID = oi.ProductID JOIN Categories c ON c.CategoryID = p.CategoryID"
+        " {filter} GROUP BY 1, c.CategoryID"
+    ),
+    "rollup_customer_daily": (
+        f"INSERT INTO rollup_customer_daily SELECT {_DAY}, cu.CustomerID, cu.CompanyName, {_REVENUE},"
+        f" SUM(oi.Quantity), COUNT(DISTINCT o.OrderID) {_LINES}"
+        " JOIN Customers cu ON cu.CustomerID = o.CustomerID"
+        " {filter} GROUP BY 1, cu.CustomerID"
+    ),
+}
+
+# Rollups built over inner joins match raw queries only if no order line is
+# dropped by those joins; otherwise the rewriter stays off.
+COMPLETENESS_CHECKS = (
+    'SELECT COUNT(*) FROM "Order Details" oi WHERE oi.OrderID NOT IN (SELECT OrderID FROM Orders)',
+    'SELECT COUNT(*) FROM "Order Details" oi WHERE oi.ProductID NOT IN (SELECT ProductID FROM Products)',
+    "SELECT COUNT(*) FROM Products p WHERE p.CategoryID IS NULL OR p.CategoryID NOT IN (SELECT CategoryID FROM Categories)",
+    "SELECT COUNT(*) FROM Orders o WHERE o.CustomerID IS NULL OR o.CustomerID NOT IN (SELECT CustomerID FROM Customers)",
+)
+
+_DIRTY_DAY = "INSERT OR IGNORE INTO rollup_dirty_days VALUES (COALESCE(substr({row}.OrderDate, 1, 10), '*'));"
+_DIRTY_LINE = ("INSERT OR IGNORE INTO rollup_dirty_days SELECT COALESCE(substr(OrderDate, 1, 10), '*')"
+               " FROM Orders WHERE OrderID = {row}.OrderID;")
+_DIRTY_ALL = "INSERT OR IGNORE INTO rollup_dirty_days VALUES ('*');"
+
+
+def _trigger_ddl() -> str:
+    """Triggers that record which days a write to the base tables made stale."""
+    statements = []
+    for event, rows in (("INSERT", ["NEW"]), ("DELETE", ["OLD"]), ("UPDATE", ["OLD", "NEW"])):
+        for table, template, name in (("Orders", _DIRTY_DAY, "orders"),
+                                      ('"Order Details"', _DIRTY_LINE, "order_details")):
+            body = " ".join(template.format(row=row) for row in rows)
+            statements.append(
+                f"CREATE TRIGGER IF NOT EXISTS rollup_dirty_{name}_{event.lower()} "
+                f"AFTER {event} ON {table} BEGIN {body} END;"
+            )
+        for table in ("Products", "Categories", "Customers"):
+            statements.append(
+                f"CREATE TRIGGER IF NOT EXISTS rollup_dirty_{table.lower()}_{event.lower()} "
+                f"AFTER {event} ON {table} BEGIN {_DIRTY_ALL} END;"
+            )
+    return "\n".join(statements)
+
+
+def build_rollups(db_path: str, full: bool = False) -> Dict[str, object]:
+    """
+    Creates or refreshes the rollup tables with a separate writable connection.
+    Only the days recorded by the dirty-day triggers are recomputed, unless
+    `full` is set or the rollups have never been built.
+    Returns {"mode": "full" | "incremental" | "fresh", "days", "complete", "seconds"}.
+    """
+    start = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(ROLLUP_DDL)
+        conn.executescript(_trigger_ddl())
+        built = conn.execute("SELECT value FROM rollup_meta WHERE key = 'built_at'").fetchone()
+        dirty = [r[0] for r in conn.execute("SELECT OrderDay FROM rollup_dirty_days")]
+        if not built or "*" in dirty:
+            full = True
+        if not full and not dirty:
+            return {"mode": "fresh", "days": 0, "complete": _is_complete(conn),
+                    "seconds": time.perf_counter() - start}
+
+        with conn:
+            if full:
+                for table in ROLLUP_QUERIES:
+                    conn.execute(f"DELETE FROM {table}")
+                    conn.execute(ROLLUP_QUERIES[table].format(filter=""))
+            else:
+                for table in ROLLUP_QUERIES:
+                    conn.execute(f"DELETE FROM {table} WHERE OrderDay IN (SELECT OrderDay FROM rollup_dirty_days)")
+                    conn.execute(ROLLUP_QUERIES[table].format(
+                        filter=f"WHERE {_DAY} IN (SELECT OrderDay FROM rollup_dirty_days)"))
+            complete = all(conn.execute(check).fetchone()[0] == 0 for check in COMPLETENESS_CHECKS)
+            conn.execute("DELETE FROM rollup_dirty_days")
+            conn.executemany(
+                "INSERT OR REPLACE INTO rollup_meta VALUES (?, ?)",
+                [("built_at", str(time.time())), ("complete", "1" if complete else "0")],
+            )
+        conn.execute("ANALYZE")
+        days = conn.execute("SELECT COUNT(*) FROM rollup_daily").fetchone()[0] if full else len(dirty)
+        return {"mode": "full" if full else "incremental", "days": days, "complete": complete,
+                "seconds": time.perf_counter() - start}
+    finally:
+        conn.close()
+
+
+def _is_complete(conn: sqlite3.Connection) -> bool:
+    row = conn.execute("SELECT value FROM rollup_meta WHERE key = 'complete'").fetchone()
+    return bool(row and row[0] == "1")
+
+
+# -------------------------------------------------------------------------
+# Query Rewriter
+# -------------------------------------------------------------------------
+TABLE_ALIASES = {
+    "orders": "orders", "order_items": "order_items", '"order details"': "order_items",
+    "products": "products", "categories": "categories", "customers": "customers",
+}
+JOIN_KEYS = {"orderid", "productid", "categoryid", "customerid"}
+
+# Dimension columns: canonical name -> (owning tables, dimension kind)
+DIMENSIONS = {
+    "productname": ({"products"}, "product"),
+    "productid": ({"products", "order_items"}, "product"),
+    "categoryname": ({"categories"}, "category"),
+    "categoryid": ({"products", "categories"}, "category"),
+    "companyname": ({"customers"}, "customer"),
+    "customerid": ({"orders", "customers"}, "customer"),
+}
+ROLLUP_COLUMNS = {
+    "productname": "ProductName", "productid": "ProductID", "categoryname": "CategoryName",
+    "categoryid": "CategoryID", "companyname": "CompanyName", "customerid": "CustomerID",
+}
+# Which rollup serves a query, by the dimensions it touches
+ROLLUP_FOR = {
+    frozenset(): "rollup_daily",
+    frozenset({"product"}): "rollup_product_daily",
+    frozenset({"product", "category"}): "rollup_product_daily",
+    frozenset({"category"}): "rollup_category_daily",
+    frozenset({"customer"}): "rollup_customer_daily",
+}
+# Rollups that carry a distinct-order count
+ORDER_COUNTS = {"rollup_daily", "rollup_category_daily", "rollup_customer_daily"}
+
+_CLAUSES = ("from", "where", "group by", "having", "order by", "limit")
+_IDENT = r'(?:\w+|"[^"]+")'
+_COLUMN = re.compile(rf"^(?:(\w+)\.)?(\w+)$")
+_TABLE_REF = re.compile(rf"^({_IDENT})(?:\s+(?:as\s+)?(\w+))?$", re.IGNORECASE)
+_JOIN = re.compile(r"\s+(?:inner\s+)?join\s+", re.IGNORECASE)
+_ON = re.compile(rf"^(.+?)\s+on\s+(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)$", re.IGNORECASE)
+_ALIAS = re.compile(r'^(.+?)\s+as\s+(\w+|"[^"]+")$', re.IGNORECASE | re.DOTALL)
+_ROUND = re.compile(r"^round\((.+),(\d+)\)$")
+_DATE_COND = re.compile(r"^(.+?)\s*(>=|<|like)\s*'([0-9%_-]{1,11})'$", re.IGNORECASE)
+_EQ_COND = re.compile(r"^(.+?)\s*=\s*('(?:[^']|'')*'|\d+)$")
+_ORDER_ITEM = re.compile(r"^(.+?)(?:\s+(asc|desc))?$", re.IGNORECASE | re.DOTALL)
+
+
+def _split_top_level(text: str, sep: str) -> List[str]:
+    """Splits on `sep` (a regex) outside parentheses and quotes."""
+    parts, depth, quote, last = [], 0, None, 0
+    pattern = re.compile(sep, re.IGNORECASE)
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif depth == 0:
+            m = pattern.match(text, i)
+            if m and (m.end() > i or i > last):
+                # Zero-width separators (lookaheads) split without consuming
+                parts.append(text[last:i])
+                last = m.end()
+                i = max(m.end(), i + 1)
+                continue
+        i += 1
+    parts.append(text[last:])
+    return [p.strip() for p in parts]
+
+
+def _clauses(sql: str) -> Optional[Dict[str, str]]:
+    """Splits a single SELECT into its clauses, or None if it has other parts."""
+    keyword = r"\b(" + "|".join(c.replace(" ", r"\s+") for c in _CLAUSES) + r")\b"
+    pieces = _split_top_level(sql, r"(?=" + keyword + r")")
+    head = pieces[0]
+    if not re.match(r"^select\s", head, re.IGNORECASE) or re.match(r"^select\s+distinct\b", head, re.IGNORECASE):
+        return None
+    clauses = {"select": head[6:].strip()}
+    for piece in pieces[1:]:
+        m = re.match(keyword, piece, re.IGNORECASE)
+        name = re.sub(r"\s+", " ", m.group(1).lower())
+        if name in clauses:
+            return None
+        clauses[name] = piece[m.end():].strip()
+    return clauses
+
+
+def _squash(expr: str) -> str:
+    return re.sub(r"\s+", "", expr).lower()
+
+
+class RollupRewriter:
+    """
+    Rewrites aggregate queries over orders / order_items / products /
+    categories / customers into queries on the daily rollup tables.
+    Handles SUM of revenue or quantity, COUNT(DISTINCT OrderID) and their
+    ratio (AOV), optionally inside ROUND, grouped or filtered by product,
+    category or customer, with `>=`, `<` and LIKE-prefix OrderDate filters.
+    `rewrite` returns None for anything else, or while the rollups are
+    missing, stale (dirty days pending) or built over incomplete joins.
+    """
+
+    def __init__(self, pool, db_path: str):
+        self.pool = pool
+        self.db_path = db_path
+        self.rewritten = 0
+        self.passed = 0
+        self._lock = threading.Lock()
+        self._state = None
+        self._available = False
+
+    def available(self) -> bool:
+        """Whether the rollups are usable; re-checked only when the database file changes."""
+        st = os.stat(self.db_path)
+        state = (st.st_mtime_ns, st.st_size)
+        if state != self._state:
+            conn = self.pool.get()
+            try:
+                dirty = conn.execute("SELECT EXISTS(SELECT 1 FROM rollup_dirty_days)").fetchone()[0]
+                available = _is_complete(conn) and not dirty
+            except sqlite3.Error:
+                available = False
+            self._available, self._state = available, state
+        return self._available
+
+    def rewrite(self, sql: str) -> Optional[str]:
+        rewritten = self._rewrite(sql) if self.available() else None
+        with self._lock:
+            if rewritten:
+                self.rewritten += 1
+            else:
+                self.passed += 1
+        return rewritten
+
+    def stats(self) -> Dict[str, int]:
+        return {"rollup": self.rewritten, "raw": self.passed}
+
+    # --- parsing ----------------------------------------------------------
+    def _rewrite(self, sql: str) -> Optional[str]:
+        sql = sql.strip().rstrip(";").strip()
+        if ";" in sql or re.search(r"\b(or|between|having|union|left|outer|cross)\b|\(\s*select\b", sql, re.IGNORECASE):
+            return None
+        clauses = _clauses(sql)
+        if not clauses or "from" not in clauses:
+            return None
+        aliases = self._parse_from(clauses["from"])
+        if aliases is None:
+            return None
+
+        dims = set()
+        select, items = [], {}
+        for item in _split_top_level(clauses["select"], r","):
+            m = _ALIAS.match(item)
+            expr, alias = (m.group(1).strip(), m.group(2)) if m else (item, None)
+            target = self._expression(expr, aliases, dims)
+            if target is None:
+                return None
+            if alias is None:
+                # SQLite names unaliased columns after the column or the expression text
+                col = _COLUMN.match(expr)
+                alias = col.group(2) if col else expr
+                alias = '"' + alias.replace('"', '""') + '"'
+            select.append((target, alias))
+            items[_squash(expr)] = target
+            items[alias.strip('"').lower()] = target
+
+        where = []
+        for cond in (_split_top_level(clauses["where"], r"\s+and\s+") if "where" in clauses else []):
+            target = self._condition(cond, aliases, dims)
+            if target is None:
+                return None
+            where.append(target)
+
+        group = []
+        for g in (_split_top_level(clauses["group by"], r",") if "group by" in clauses else []):
+            target = items.get(_squash(g)) or items.get(g.strip('"').lower()) or self._dimension(g, aliases, dims)
+            if target is None or target.startswith(("SUM(", "COALESCE(")):
+                return None
+            group.append(target)
+
+        order = []
+        for o in (_split_top_level(clauses["order by"], r",") if "order by" in clauses else []):
+            m = _ORDER_ITEM.match(o)
+            key = m.group(1).strip()
+            target = (items.get(_squash(key)) or items.get(key.strip('"').lower())
+                      or self._dimension(key, aliases, dims) or self._expression(key, aliases, dims))
+            if target is None:
+                return None
+            order.append(target + (f" {m.group(2).upper()}" if m.group(2) else ""))
+
+        limit = clauses.get("limit")
+        if limit is not None and not re.match(r"^\d+(\s+offset\s+\d+)?$", limit, re.IGNORECASE):
+            return None
+
+        table = ROLLUP_FOR.get(frozenset(dims))
+        if table is None:
+            return None
+        uses_orders = any("SUM(Orders)" in t for t, _a in select) or any("SUM(Orders)" in o for o in order)
+        if uses_orders and table not in ORDER_COUNTS:
+            return None
+        if uses_orders and table == "rollup_category_daily" and not self._single_category(group, where):
+            # Distinct orders only add up across days within one category
+            return None
+
+        out = f"SELECT {', '.join(f'{t} AS {a}' for t, a in select)} FROM {table}"
+        if where:
+            out += " WHERE " + " AND ".join(where)
+        if group:
+            out += " GROUP BY " + ", ".join(group)
+        if order:
+            out += " ORDER BY " + ", ".join(order)
+        if limit is not None:
+            out += f" LIMIT {limit}"
+        return out
+
+    @staticmethod
+    def _single_category(group: List[str], where: List[str]) -> bool:
+        return any(g in ("CategoryName", "CategoryID") for g in group) or any(
+            re.match(r"^Category(Name|ID) = ", w) for w in where)
+
+    @staticmethod
+    def _parse_from(text: str) -> Optional[Dict[str, str]]:
+        """alias -> canonical table, if the FROM clause is a chain of key joins."""
+        aliases = {}
+        for i, part in enumerate(_JOIN.split(text)):
+            if i:
+                m = _ON.match(part.strip())
+                if not m or m.group(3).lower() != m.group(5).lower() or m.group(3).lower() not in JOIN_KEYS:
+                    return None
+                part = m.group(1)
+            m = _TABLE_REF.match(part.strip())
+            if not m:
+                return None
+            table = TABLE_ALIASES.get(m.group(1).lower())
+            if table is None:
+                return None
+            aliases[(m.group(2) or m.group(1)).lower().strip('"')] = table
+        if "order_items" not in aliases.values():
+            return None
+        return aliases
+
+    def _column(self, ref: str, aliases: Dict[str, str]) -> Optional[Tuple[Optional[str], str]]:
+        m = _COLUMN.match(ref.strip())
+        if not m:
+            return None
+        alias, col = m.group(1), m.group(2).lower()
+        if alias is None:
+            return None, col
+        table = aliases.get(alias.lower())
+        return (table, col) if table else None
+
+    def _dimension(self, ref: str, aliases: Dict[str, str], dims: set) -> Optional[str]:
+        col = self._column(ref, aliases)
+        if not col or col[1] not in DIMENSIONS:
+            return None
+        owners, kind = DIMENSIONS[col[1]]
+        if col[0] is not None and col[0] not in owners:
+            return None
+        if col[0] is None and not owners & set(aliases.values()):
+            return None
+        dims.add(kind)
+        return ROLLUP_COLUMNS[col[1]]
+
+    def _is(self, ref: str, column: str, table: str, aliases: Dict[str, str]) -> bool:
+        col = self._column(ref, aliases)
+        return bool(col) and col[1] == column and col[0] in (None, table)
+
+    def _expression(self, expr: str, aliases: Dict[str, str], dims: set) -> Optional[str]:
+        squashed = _squash(expr)
+        m = _ROUND.match(squashed)
+        if m:
+            inner = self._aggregate(m.group(1), aliases)
+            return f"ROUND({inner}, {m.group(2)})" if inner else None
+        return self._aggregate(squashed, aliases) or self._dimension(expr, aliases, dims)
+
+    def _aggregate(self, squashed: str, aliases: Dict[str, str]) -> Optional[str]:
+        parts = _split_top_level(squashed, r"/")
+        if len(parts) == 2:
+            num, den = self._aggregate(parts[0], aliases), self._aggregate(parts[1], aliases)
+            return f"{num} / {den}" if num and den and "/" not in num + den else None
+        m = re.match(r"^sum\((.+)\)$", squashed)
+        if m:
+            factors = sorted(_split_top_level(m.group(1), r"\*"))
+            if len(factors) == 1 and self._is(factors[0], "quantity", "order_items", aliases):
+                return "SUM(Quantity)"
+            if len(factors) == 3:
+                discount = [f for f in factors if f.startswith("(1-")]
+                rest = [f for f in factors if not f.startswith("(1-")]
+                if (len(discount) == 1 and self._is(discount[0][3:-1], "discount", "order_items", aliases)
+                        and len(rest) == 2
+                        and any(self._is(f, "unitprice", "order_items", aliases) for f in rest)
+                        and any(self._is(f, "quantity", "order_items", aliases) for f in rest)):
+                    return "SUM(Revenue)"
+            return None
+        m = re.match(r"^count\(distinct(.+)\)$", squashed)
+        if m and self._is(m.group(1), "orderid", "orders", aliases):
+            # COUNT is 0, not NULL, when no day matches
+            return "COALESCE(SUM(Orders), 0)"
+        return None
+
+    def _condition(self, cond: str, aliases: Dict[str, str], dims: set) -> Optional[str]:
+        m = _DATE_COND.match(cond.strip())
+        if m and self._is(m.group(1), "orderdate", "orders", aliases):
+            op, value = m.group(2).upper(), m.group(3)
+            if op == "LIKE":
+                # Only prefixes of the day ("1997", "1997-06%") keep their meaning on OrderDay
+                if not value.endswith("%") or "%" in value[:-1] or len(value) > 11:
+                    return None
+            elif "%" in value or "_" in value or len(value) > 10:
+                return None
+            return f"OrderDay {op} '{value}'"
+        m = _EQ_COND.match(cond.strip())
+        if m:
+            column = self._dimension(m.group(1), aliases, dims)
+            return f"{column} = {m.group(2)}" if column else None
+        return None
+
+
+# Builds or refreshes the rollups of the default database when run directly
+if __name__ == "__main__":
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.abspath(
+        os.path.join(os.path.dirname(__file__), "../../data/northwind.sqlite"))
+    print(build_rollups(path, full="--full" in sys.argv))
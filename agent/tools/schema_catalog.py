@@ -0,0 +1,198 @@
+import json
+import os
+import re
+import sqlite3
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional
+
+# -------------------------------------------------------------------------
+# Schema Catalog
+# -------------------------------------------------------------------------
+# Question words that imply a table is needed, beyond the table/column names
+TABLE_KEYWORDS = {
+    "orders": ["order", "date", "aov", "1996", "1997", "1998", "month", "year",
+               "january", "february", "march", "april", "may", "june", "july",
+               "august", "september", "october", "november", "december",
+               "summer", "winter", "spring", "autumn", "fall"],
+    "order_items": ["revenue", "quantity", "sold", "sales", "discount", "price",
+                    "aov", "margin", "gross", "units"],
+    "products": ["product", "item"],
+    "categories": ["category", "categories", "beverages", "condiments", "confections",
+                   "dairy", "grains", "cereals", "meat", "poultry", "produce", "seafood"],
+    "customers": ["customer", "client", "company", "buyer"],
+}
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def db_fingerprint(db_path: str) -> str:
+    """Identifies the current state of the database file (mtime and size)."""
+    st = os.stat(db_path)
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+class SchemaCatalog:
+    """
+    Tables, views, columns, foreign keys and row counts of a database,
+    introspected once and cached on disk keyed by the database fingerprint.
+    """
+
+    def __init__(self, tables: Dict[str, Dict[str, Any]], fingerprint: str = ""):
+        self.tables = tables
+        self.fingerprint = fingerprint
+        self._by_lower = {name.lower(): name for name in tables}
+        self._joins = self._infer_joins()
+
+    # --- construction -----------------------------------------------------
+    @classmethod
+    def introspect(cls, conn: sqlite3.Connection, fingerprint: str = "") -> "SchemaCatalog":
+        tables = {}
+        rows = conn.execute(
+            "SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view') "
+            "AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        ).fetchall()
+        for name, kind in rows:
+            quoted = '"' + name.replace('"', '""') + '"'
+            try:
+                # table_xinfo also lists generated columns (hidden = 2/3); 1 marks virtual-table internals
+                columns = [(c[1], c[2]) for c in conn.execute(f"PRAGMA table_xinfo({quoted})") if c[6] != 1]
+            except sqlite3.Error:
+                # A view over a missing table cannot be described
+                continue
+            foreign_keys = [(fk[3], fk[2], fk[4]) for fk in conn.execute(f"PRAGMA foreign_key_list({quoted})")]
+            # Counting through a view re-runs its query, so only count tables
+            row_count = conn.execute(f"SELECT COUNT(*) FROM {quoted}").fetchone()[0] if kind == "table" else None
+            tables[name] = {
+                "type": kind,
+                "columns": columns,
+                "foreign_keys": foreign_keys,
+                "row_count": row_count,
+            }
+        return cls(tables, fingerprint)
+
+    @classmethod
+    def load(cls, db_path: str, conn: sqlite3.Connection, cache_dir: Optional[str] = None) -> "SchemaCatalog":
+        """Returns the catalog from `cache_dir` if it matches the database, else introspects it."""
+        fingerprint = db_fingerprint(db_path)
+        cache_file = None
+        if cache_dir:
+            cache_file = os.path.join(cache_dir, f"schema_{os.path.basename(db_path)}.json")
+            if os.path.exists(cache_file):
+                with open(cache_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("fingerprint") == fingerprint:
+                    return cls.from_dict(data)
+
+        catalog = cls.introspect(conn, fingerprint)
+        if cache_file:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_file, "w", encoding="utf-8") as f:
+                json.dump(catalog.to_dict(), f)
+        return catalog
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"fingerprint": self.fingerprint, "tables": self.tables}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SchemaCatalog":
+        tables = {}
+        for name, info in data["tables"].items():
+            tables[name] = dict(info)
+            tables[name]["columns"] = [tuple(c) for c in info["columns"]]
+            tables[name]["foreign_keys"] = [tuple(fk) for fk in info["foreign_keys"]]
+        return cls(tables, data.get("fingerprint", ""))
+
+    # --- lookup -----------------------------------------------------------
+    def resolve(self, name: str) -> Optional[str]:
+        """Case-insensitive table lookup (SQLite identifiers are case-insensitive)."""
+        return self._by_lower.get(name.lower())
+
+    def columns(self, table: str) -> List[str]:
+        name = self.resolve(table)
+        return [c[0] for c in self.tables[name]["columns"]] if name else []
+
+    def _infer_joins(self) -> Dict[str, set]:
+        """
+        Join graph between tables. Declared foreign keys are used where present;
+        views carry none, so tables sharing an `...ID` column are linked too.
+        """
+        joins = {name: set() for name in self.tables}
+        id_columns: Dict[str, List[str]] = {}
+        for name, info in self.tables.items():
+            for col, _type in info["columns"]:
+                if col.lower().endswith("id"):
+                    id_columns.setdefault(col.lower(), []).append(name)
+            for _col, ref_table, _ref_col in info["foreign_keys"]:
+                ref = self.resolve(ref_table)
+                if ref:
+                    joins[name].add(ref)
+                    joins[ref].add(name)
+        for names in id_columns.values():
+            for a in names:
+                joins[a].update(n for n in names if n != a)
+        return joins
+
+    # --- prompt rendering -------------------------------------------------
+    def select_tables(self, question: str, candidates: Iterable[str]) -> List[str]:
+        """
+        Picks the candidate tables a question needs (by table/column names and
+        TABLE_KEYWORDS), then adds the tables required to join them together.
+        Falls back to every candidate when nothing matches.
+        """
+        candidates = [c for c in candidates if self.resolve(c)]
+        words = set(_WORD.findall(question.lower()))
+
+        selected = []
+        for table in candidates:
+            names = {table.lower(), table.lower().rstrip("s")}
+            names.update(col.lower() for col in self.columns(table))
+            keywords = TABLE_KEYWORDS.get(table.lower(), [])
+            # Prefix match so "orders", "categories", "sold" etc. hit their stems
+            if names & words or any(w.startswith(k) for k in keywords for w in words):
+                selected.append(table)
+        if not selected:
+            return list(candidates)
+
+        # Connect the selection through the join graph (shortest paths)
+        allowed = {self.resolve(c): c for c in candidates}
+        result = list(selected)
+        anchor = self.resolve(selected[0])
+        for table in selected[1:]:
+            for step in self._join_path(anchor, self.resolve(table), allowed):
+                if allowed[step] not in result:
+                    result.append(allowed[step])
+        return [c for c in candidates if c in result]
+
+    def _join_path(self, start: str, goal: str, allowed: Dict[str, str]) -> List[str]:
+        prev = {start: None}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if node == goal:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = prev[node]
+                return path
+            for nxt in self._joins.get(node, ()):
+                if nxt in allowed and nxt not in prev:
+                    prev[nxt] = node
+                    queue.append(nxt)
+        return []
+
+    def render(self, tables: Iterable[str], columns: Optional[Dict[str, List[str]]] = None) -> str:
+        """
+        Compact prompt schema, one line per table: `- name (Col1, Col2, ...)`.
+        `columns` optionally restricts which columns are shown per table.
+        """
+        lines = ["Tables:"]
+        for table in tables:
+            name = self.resolve(table)
+            if not name:
+                continue
+            cols = self.columns(name)
+            if columns and table in columns:
+                wanted = {c.lower() for c in columns[table]}
+                cols = [c for c in cols if c.lower() in wanted]
+            lines.append(f"- {table} ({', '.join(cols)})")
+        return "\n".join(lines)
@@ -0,0 +1,315 @@
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# -------------------------------------------------------------------------
+# SQL Dialect Rewriter
+# -------------------------------------------------------------------------
+# Translates other dialects' constructs in generated SQL to SQLite in one
+# pass over the tokens. String literals, quoted identifiers and comments are
+# single tokens, so nothing inside them is rewritten. Parenthesized groups
+# are rewritten recursively, so nested calls such as YEAR(MAX(o.OrderDate))
+# keep their own parentheses.
+# Rules are looked up by keyword (dict, uppercase; one rule per keyword) and
+# are pluggable:
+#   FunctionRule   NAME(args) -> text built from the rewritten arguments
+#   KeywordRule    one word -> another (ILIKE -> LIKE)
+#   TopRule        SELECT TOP n ... -> SELECT ... LIMIT n
+#   QuoteNameRule  unquoted multi-word names (Order Details) -> "Order Details"
+# SQL without any rule's trigger word is returned as is without tokenizing,
+# which is the common case for queries that are already valid SQLite.
+# Tokens are plain strings (findall is several times faster than building
+# match objects); a token's kind is told by its first character.
+_TOKEN = re.compile(
+    r"[A-Za-z_][\w$]*"                      # word
+    r"|\s+"                                 # whitespace
+    r"|'[^']*(?:''[^']*)*'?"                 # string literal
+    r"|\d+(?:\.\d*)?(?:[eE][-+]?\d+)?"        # number
+    r'|"[^"]*(?:""[^"]*)*"?|`[^`]*`?|\[[^\]]*\]?'  # quoted identifier
+    r"|--[^\n]*|/\*.*?(?:\*/|\Z)"             # comment
+    r"|.",                                  # operator / punctuation
+    re.DOTALL,
+)
+_WORD_START = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_")
+
+
+def _is_skipped(token: str) -> bool:
+    """Whitespace or a comment."""
+    return token[0].isspace() or token.startswith("--") or token.startswith("/*")
+
+
+class _Level:
+    """Per-statement state of one nesting level (a TOP moved to the end as LIMIT)."""
+    __slots__ = ("limit", "has_limit")
+
+    def __init__(self):
+        self.limit = None
+        self.has_limit = False
+
+
+class _Pass:
+    """One rewrite of a token list; rules read tokens through it."""
+    __slots__ = ("tokens", "rules", "close")
+
+    def __init__(self, tokens: List[str], rules: Dict[str, "Rule"]):
+        self.tokens = tokens
+        self.rules = rules
+        # Index of the matching ")" for every balanced "("
+        self.close: Dict[int, int] = {}
+        stack = []
+        for i, token in enumerate(tokens):
+            if token == "(":
+                stack.append(i)
+            elif token == ")" and stack:
+                self.close[stack.pop()] = i
+
+    def next_code(self, i: int, end: int) -> int:
+        """Index of the first token at or after `i` that is not whitespace/comment (or `end`)."""
+        while i < end and _is_skipped(self.tokens[i]):
+            i += 1
+        return i
+
+    def prev_code(self, i: int) -> Optional[str]:
+        i -= 1
+        while i >= 0 and _is_skipped(self.tokens[i]):
+            i -= 1
+        return self.tokens[i] if i >= 0 else None
+
+    def call_args(self, open_index: int) -> List[str]:
+        """Rewritten top-level arguments of the call whose "(" is at `open_index`."""
+        close = self.close[open_index]
+        args, start, i = [], open_index + 1, open_index + 1
+        while i < close:
+            token = self.tokens[i]
+            if token == "(" and i in self.close:
+                i = self.close[i]
+            elif token == ",":
+                args.append(self.render(start, i).strip())
+                start = i + 1
+            i += 1
+        last = self.render(start, close).strip()
+        if last or args:
+            args.append(last)
+        return args
+
+    def render(self, start: int, end: int) -> str:
+        tokens, rules, close = self.tokens, self.rules, self.close
+        out: List[str] = []
+        level = _Level()
+        i = start
+        while i < end:
+            token = tokens[i]
+            if token[0] in _WORD_START:
+                upper = token.upper()
+                rule = rules.get(upper)
+                if rule is not None:
+                    done = rule.apply(self, i, end, level)
+                    if done is not None:
+                        out.append(done[0])
+                        i = done[1]
+                        continue
+                if upper == "LIMIT":
+                    level.has_limit = True
+            elif token == "(" and i in close:
+                j = close[i]
+                out.append("(" + self.render(i + 1, j) + ")")
+                i = j + 1
+                continue
+            out.append(token)
+            i += 1
+        if level.limit is not None and not level.has_limit:
+            # Before any trailing semicolon/whitespace
+            tail = []
+            while out and (not out[-1].strip() or out[-1] == ";"):
+                tail.append(out.pop())
+            out.append(f" LIMIT {level.limit}")
+            out.extend(reversed(tail))
+        return "".join(out)
+
+
+# --- rules -----------------------------------------------------------------
+class Rule:
+    """
+    Rewrites the construct starting at one keyword. `trigger` is an uppercase
+    substring that any SQL the rule applies to contains.
+    """
+    keyword = ""
+
+    @property
+    def trigger(self) -> str:
+        return self.keyword
+
+    def apply(self, p: _Pass, i: int, end: int, level: _Level) -> Optional[Tuple[str, int]]:
+        """(replacement text, index of the next token), or None to leave token `i` as is."""
+        raise NotImplementedError
+
+
+class FunctionRule(Rule):
+    """NAME(args) -> build(args); build gets the rewritten argument texts and may return None."""
+
+    def __init__(self, name: str, build: Callable[[List[str]], Optional[str]]):
+        self.keyword = name.upper()
+        self.build = build
+
+    def apply(self, p, i, end, level):
+        j = p.next_code(i + 1, end)
+        if j >= end or p.tokens[j] != "(" or j not in p.close:
+            return None
+        text = self.build(p.call_args(j))
+        return (text, p.close[j] + 1) if text is not None else None
+
+
+class KeywordRule(Rule):
+    def __init__(self, word: str, replacement: str):
+        self.keyword = word.upper()
+        self.replacement = replacement
+
+    def apply(self, p, i, end, level):
+        return self.replacement, i + 1
+
+
+class TopRule(Rule):
+    """SELECT [DISTINCT] TOP n / TOP (n) -> LIMIT n at the end of the same statement."""
+    keyword = "TOP"
+
+    def apply(self, p, i, end, level):
+        prev = p.prev_code(i)
+        if prev is None or prev.upper() not in ("SELECT", "DISTINCT", "ALL"):
+            return None
+        j = p.next_code(i + 1, end)
+        parenthesized = j < end and p.tokens[j] == "("
+        if parenthesized:
+            j = p.next_code(j + 1, end)
+        if j >= end or not p.tokens[j].isdigit():
+            return None
+        n = p.tokens[j]
+        if parenthesized:
+            j = p.next_code(j + 1, end)
+            if j >= end or p.tokens[j] != ")":
+                return None
+        level.limit = n
+        # Drop the whitespace after "TOP n" as well
+        return "", p.next_code(j + 1, end)
+
+
+class QuoteNameRule(Rule):
+    """An unquoted identifier with spaces, e.g. Order Details -> "Order Details"."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.words = [w.upper() for w in name.split()]
+        self.keyword = self.words[0]
+
+    @property
+    def trigger(self) -> str:
+        # "ORDER" alone is in most queries (ORDER BY)
+        return self.words[-1]
+
+    def apply(self, p, i, end, level):
+        j = i
+        for word in self.words[1:]:
+            j += 1
+            if j >= end or not p.tokens[j].isspace():
+                return None
+            j += 1
+            if j >= end or p.tokens[j].upper() != word:
+                return None
+        return '"' + self.name.replace('"', '""') + '"', j + 1
+
+
+# --- dialect translations --------------------------------------------------
+# MySQL DATE_FORMAT specifiers and the strftime ones that print exactly the
+# same text. Any other specifier (%M month name, %b, %W, %y two-digit year,
+# unpadded %e/%c/%k, ...) either means something else in strftime (%M is
+# minutes) or has no equivalent, so DATE_FORMAT is left for the LM to redo.
+_MYSQL_SPECIFIERS = {"Y": "Y", "m": "m", "d": "d", "H": "H", "i": "M", "s": "S", "S": "S", "j": "j",
+                     "w": "w", "T": "H:%M:%S", "%": "%"}
+_SPECIFIER = re.compile(r"%(.)", re.DOTALL)
+_EXTRACT_ARG = re.compile(r"(YEAR|MONTH|DAY)\s+FROM\s+(.+)", re.IGNORECASE | re.DOTALL)
+_PART_FORMATS = {"YEAR": "%Y", "MONTH": "%m", "DAY": "%d"}
+
+
+def _date_part(fmt: str) -> Callable[[List[str]], Optional[str]]:
+    # Integer, like the MySQL function, so `YEAR(d) = 1997` keeps working
+    return lambda a: f"CAST(strftime('{fmt}', {a[0]}) AS INTEGER)" if len(a) == 1 else None
+
+
+def _date_format(args: List[str]) -> Optional[str]:
+    if len(args) != 2:
+        return None
+    fmt = args[1]
+    if fmt.startswith("'"):
+        if any(m.group(1) not in _MYSQL_SPECIFIERS for m in _SPECIFIER.finditer(fmt)):
+            return None
+        fmt = _SPECIFIER.sub(lambda m: "%" + _MYSQL_SPECIFIERS[m.group(1)], fmt)
+    return f"strftime({fmt}, {args[0]})"
+
+
+def _extract(args: List[str]) -> Optional[str]:
+    match = _EXTRACT_ARG.fullmatch(args[0]) if len(args) == 1 else None
+    if not match:
+        return None
+    return f"CAST(strftime('{_PART_FORMATS[match.group(1).upper()]}', {match.group(2).strip()}) AS INTEGER)"
+
+
+def _to_char(args: List[str]) -> Optional[str]:
+    if len(args) != 2:
+        return None
+    fmt = args[1].replace("YYYY", "%Y").replace("MM", "%m").replace("DD", "%d")
+    return f"strftime({fmt}, {args[0]})"
+
+
+# Applied to every generated query
+DEFAULT_RULES: List[Rule] = [
+    FunctionRule("YEAR", _date_part("%Y")),
+    FunctionRule("MONTH", _date_part("%m")),
+    FunctionRule("DATE_FORMAT", _date_format),
+    FunctionRule("EXTRACT", _extract),
+    TopRule(),
+    KeywordRule("ILIKE", "LIKE"),
+    QuoteNameRule("Order Details"),
+]
+
+# Only applied when SQLite reports the function missing (see sql_validator.py):
+# some exist in newer SQLite versions with different NULL handling
+REPAIR_RULES: Dict[str, Rule] = {rule.keyword: rule for rule in [
+    FunctionRule("DAY", _date_part("%d")),
+    FunctionRule("DAYOFMONTH", _date_part("%d")),
+    FunctionRule("TO_CHAR", _to_char),
+    FunctionRule("DATEDIFF", lambda a: f"CAST(julianday({a[0]}) - julianday({a[1]}) AS INTEGER)"
+                 if len(a) == 2 else None),
+    FunctionRule("NOW", lambda a: "datetime('now')" if not a else None),
+    FunctionRule("GETDATE", lambda a: "datetime('now')" if not a else None),
+    FunctionRule("CURDATE", lambda a: "date('now')" if not a else None),
+    FunctionRule("CONCAT", lambda a: "(" + " || ".join(a) + ")" if a else None),
+    FunctionRule("NVL", lambda a: f"IFNULL({a[0]}, {a[1]})" if len(a) == 2 else None),
+    FunctionRule("ISNULL", lambda a: f"IFNULL({a[0]}, {a[1]})" if len(a) == 2 else None),
+    FunctionRule("LEN", lambda a: f"length({a[0]})" if len(a) == 1 else None),
+]}
+
+
+class SQLRewriter:
+    """Single-pass, rule-based rewrite of SQL text; safe to share between threads."""
+
+    def __init__(self, rules: Iterable[Rule] = DEFAULT_RULES):
+        self.rules: Dict[str, Rule] = {}
+        for rule in rules:
+            self.rules[rule.keyword.upper()] = rule
+        # A query none of the rules can apply to is never tokenized
+        self._triggers = tuple(sorted({rule.trigger for rule in self.rules.values()}))
+
+    def with_rules(self, *rules: Rule) -> "SQLRewriter":
+        """A rewriter with these rules added (replacing rules for the same keyword)."""
+        return SQLRewriter(list(self.rules.values()) + list(rules))
+
+    def rewrite(self, sql: str) -> str:
+        upper = sql.upper()
+        for trigger in self._triggers:
+            if trigger in upper:
+                break
+        else:
+            return sql
+        tokens = _TOKEN.findall(sql)
+        return _Pass(tokens, self.rules).render(0, len(tokens))
+
+
+default_rewriter = SQLRewriter()
@@ -0,0 +1,320 @@
+import difflib
+import logging
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from agent.tools.schema_catalog import SchemaCatalog
+from agent.tools.sql_rewriter import DEFAULT_RULES, REPAIR_RULES, QuoteNameRule, SQLRewriter
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+# SQL Validator
+# -------------------------------------------------------------------------
+# Checks generated SQL before it runs. SQLite compiles it with EXPLAIN,
+# which resolves every table, column and function without reading any rows.
+# The compile error then picks a deterministic repair, and the query is
+# compiled again:
+#   no such table     -> closest table in the schema catalog
+#   no such column    -> closest column of the tables the query uses
+#                        (only when exactly one name is close enough)
+#   ambiguous column  -> qualified, if all tables that have it are joined on it
+#   no such function  -> SQLite equivalent (DATE_FORMAT, DAY, NOW, CONCAT, ...)
+#   syntax error      -> quoted multi-word tables ("Order Details"),
+#                        TOP n -> LIMIT n, ILIKE -> LIKE, EXTRACT(... FROM x)
+# The dialect rewrites are the rules of agent/tools/sql_rewriter.py.
+# Only single read-only statements (SELECT / WITH ... SELECT) are accepted.
+# Whatever cannot be repaired goes back to the LM with the error and the
+# columns it could have used.
+MAX_REPAIRS = 6
+# Queries already known to compile are not compiled again (per schema)
+MEMO_ENTRIES = 1024
+# How close (difflib ratio) a name must be to replace an unknown one; with
+# two or more names this close the query goes back to the LM instead
+NAME_CUTOFF = 0.85
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_WRITE_KEYWORDS = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|REPLACE|DROP|CREATE|ALTER|ATTACH|DETACH|PRAGMA|VACUUM|REINDEX|ANALYZE)\b(?!\s*\()",
+    re.IGNORECASE,
+)
+_TABLE_REF = re.compile(
+    r'\b(?:FROM|JOIN)\s+("[^"]+"|`[^`]+`|\[[^\]]+\]|\w+)(?:\s+(?:AS\s+)?(?!(?:ON|USING|WHERE|JOIN|INNER|LEFT|RIGHT|'
+    r'CROSS|NATURAL|GROUP|ORDER|LIMIT|HAVING|UNION)\b)(\w+))?',
+    re.IGNORECASE,
+)
+
+
+def _normalized(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def _unquote(name: str) -> str:
+    return name[1:-1] if name[:1] in "\"`[" else name
+
+
+def _quote(name: str) -> str:
+    return name if re.fullmatch(r"[A-Za-z_]\w*", name) else '"' + name.replace('"', '""') + '"'
+
+
+def _sub_code(pattern: re.Pattern, repl, sql: str) -> str:
+    """re.sub applied outside string literals only."""
+    parts, last = [], 0
+    for literal in _LITERAL.finditer(sql):
+        parts.append(pattern.sub(repl, sql[last:literal.start()]))
+        parts.append(literal.group(0))
+        last = literal.end()
+    parts.append(pattern.sub(repl, sql[last:]))
+    return "".join(parts)
+
+
+def _code_only(sql: str) -> str:
+    """`sql` with string literal contents blanked out (same length, so offsets still match)."""
+    return _LITERAL.sub(lambda m: "'" + " " * (len(m.group(0)) - 2) + "'", sql)
+
+
+class SQLValidator:
+    """
+    Compiles SQL against the database (EXPLAIN, nothing is executed) and
+    repairs what it can using the schema catalog.
+    `prepare` compiles one statement and raises sqlite3.Error on failure.
+    """
+
+    def __init__(self, catalog: Callable[[], SchemaCatalog], prepare: Callable[[str], None]):
+        self._catalog = catalog
+        self.prepare = prepare
+        self.checked = 0
+        self.repaired = 0
+        self.rejected = 0
+        self._valid: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._schema = None
+        self._lock = threading.Lock()
+
+    # --- public API -------------------------------------------------------
+    def validate(self, sql: str) -> Dict[str, Any]:
+        """
+        {"sql": the (possibly repaired) query, "ok": bool, "error": str,
+         "repairs": ["no such column: o.OrderDat -> o.OrderDate", ...]}
+        """
+        original = sql
+        schema = self._catalog().fingerprint
+        with self._lock:
+            self.checked += 1
+            if schema != self._schema:
+                self._valid.clear()
+                self._schema = schema
+            known = self._valid.get(original)
+            if known is not None:
+                self._valid.move_to_end(original)
+                if known["repairs"]:
+                    self.repaired += 1
+                return known
+        repairs: List[str] = []
+        sql, error = self._statement(sql)
+        seen = set()
+        while error is None:
+            try:
+                self.prepare(sql)
+                break
+            except sqlite3.Error as e:
+                message = str(e)
+            if message in seen or len(repairs) >= MAX_REPAIRS:
+                error = message
+                break
+            seen.add(message)
+            fixed, note = self._repair(sql, message)
+            if fixed is None or fixed == sql:
+                error = message
+                break
+            repairs.append(f"{message} -> {note}")
+            sql = fixed
+        if error is not None:
+            with self._lock:
+                self.rejected += 1
+            return {"sql": sql, "ok": False, "error": self._explain_error(sql, error), "repairs": repairs}
+        result = {"sql": sql, "ok": True, "error": "", "repairs": repairs}
+        with self._lock:
+            if repairs:
+                self.repaired += 1
+            self._valid[original] = result
+            while len(self._valid) > MEMO_ENTRIES:
+                self._valid.popitem(last=False)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"checked": self.checked, "repaired": self.repaired, "rejected": self.rejected}
+
+    # --- checks -----------------------------------------------------------
+    @staticmethod
+    def _statement(sql: str) -> Tuple[str, Optional[str]]:
+        """The single statement without its trailing semicolon, or an error for anything but a query."""
+        sql = sql.strip().rstrip(";").strip()
+        code = _code_only(sql)
+        if ";" in code:
+            return sql, "only one statement is allowed"
+        if not re.match(r"\s*(SELECT|WITH)\b", code, re.IGNORECASE):
+            return sql, "only SELECT queries are allowed"
+        write = _WRITE_KEYWORDS.search(code)
+        if write:
+            return sql, f"only SELECT queries are allowed ({write.group(1).upper()} found)"
+        return sql, None
+
+    def _tables_used(self, sql: str) -> List[Tuple[str, Optional[str]]]:
+        """(catalog table, alias) for every FROM/JOIN reference that resolves."""
+        catalog = self._catalog()
+        used = []
+        for name, alias in _TABLE_REF.findall(_code_only(sql)):
+            table = catalog.resolve(_unquote(name))
+            if table:
+                used.append((table, alias or None))
+        return used
+
+    def _explain_error(self, sql: str, error: str) -> str:
+        """The compile error plus the columns the query could use, for the LM retry."""
+        message = f"Error validating SQL: {error}"
+        if "no such column" in error or "ambiguous column" in error:
+            catalog = self._catalog()
+            columns = "; ".join(f"{table}: {', '.join(catalog.columns(table))}"
+                                for table, _alias in dict.fromkeys(self._tables_used(sql)))
+            if columns:
+                message += f". Columns available: {columns}"
+        elif "no such table" in error:
+            catalog = self._catalog()
+            message += f". Tables available: {', '.join(catalog.tables)}"
+        return message
+
+    # --- repairs ----------------------------------------------------------
+    def _repair(self, sql: str, message: str) -> Tuple[Optional[str], str]:
+        match = re.match(r"no such table: (?:\w+\.)?(.+)", message)
+        if match:
+            return self._repair_table(sql, match.group(1))
+        match = re.match(r"no such column: (?:(\w+)\.)?(.+)", message)
+        if match:
+            return self._repair_column(sql, match.group(1), match.group(2))
+        match = re.match(r"ambiguous column name: (?:\w+\.)?(.+)", message)
+        if match:
+            return self._qualify_column(sql, match.group(1))
+        match = re.match(r"no such function: (\w+)", message)
+        if match:
+            name = match.group(1).upper()
+            rule = REPAIR_RULES.get(name) or next((r for r in DEFAULT_RULES if r.keyword == name), None)
+            if rule is None:
+                return None, ""
+            return SQLRewriter([rule]).rewrite(sql), f"SQLite equivalent of {name}"
+        if "syntax error" in message:
+            return self._repair_syntax(sql)
+        return None, ""
+
+    def _closest(self, name: str, candidates: List[str]) -> Optional[str]:
+        """
+        The one candidate `name` stands for: the same name up to case and
+        punctuation, else the only one within NAME_CUTOFF, else the only
+        abbreviation match. None when there are several.
+        """
+        by_normalized = {_normalized(c): c for c in candidates}
+        if _normalized(name) in by_normalized:
+            return by_normalized[_normalized(name)]
+        lowered = {c.lower(): c for c in candidates}
+        close = difflib.get_close_matches(name.lower(), list(lowered), n=len(lowered), cutoff=NAME_CUTOFF)
+        if len(close) > 1:
+            logger.info("Not repairing %s: %s are all close", name, ", ".join(lowered[c] for c in close))
+            return None
+        if close:
+            logger.info("Repairing %s as %s (closest name)", name, lowered[close[0]])
+            return lowered[close[0]]
+        # Abbreviations ("Qty" for Quantity): same first letter, letters in order, one candidate only
+        abbreviation = re.compile(".*".join(map(re.escape, _normalized(name))))
+        matches = {c for c in candidates if _normalized(c)[:1] == _normalized(name)[:1]
+                   and abbreviation.match(_normalized(c))}
+        if len(matches) != 1:
+            if matches:
+                logger.info("Not repairing %s: %s all abbreviate to it", name, ", ".join(sorted(matches)))
+            return None
+        column = matches.pop()
+        logger.info("Repairing %s as %s (abbreviation)", name, column)
+        return column
+
+    def _repair_table(self, sql: str, name: str) -> Tuple[Optional[str], str]:
+        catalog = self._catalog()
+        table = self._closest(name, list(catalog.tables))
+        if table is None:
+            return None, ""
+        pattern = re.compile(r'(?<![\w."])(?:"|`|\[)?' + re.escape(name) + r'(?:"|`|\])?(?![\w"])')
+        return _sub_code(pattern, lambda _m: _quote(table), sql), _quote(table)
+
+    def _repair_column(self, sql: str, qualifier: Optional[str], name: str) -> Tuple[Optional[str], str]:
+        catalog = self._catalog()
+        used = self._tables_used(sql)
+        if qualifier:
+            tables = [t for t, alias in used if (alias or t).lower() == qualifier.lower()
+                      or t.lower() == qualifier.lower()]
+        else:
+            tables = [t for t, _alias in used]
+        column = self._closest(name, [c for t in dict.fromkeys(tables) for c in catalog.columns(t)])
+        if column is None:
+            return None, ""
+        prefix = re.escape(qualifier) + r"\s*\.\s*" if qualifier else r"(?<![\w.])"
+        pattern = re.compile(prefix + r'(?:"|`|\[)?' + re.escape(name) + r'(?:"|`|\])?(?![\w"])', re.IGNORECASE)
+        replacement = f"{qualifier}.{_quote(column)}" if qualifier else _quote(column)
+        return _sub_code(pattern, lambda _m: replacement, sql), replacement
+
+    def _qualify_column(self, sql: str, name: str) -> Tuple[Optional[str], str]:
+        """
+        Qualifies the column references to `name`, but only when every table
+        that has the column is joined on it (`p.ProductID = oi.ProductID`), so
+        the choice cannot change the result. Otherwise (products.UnitPrice is
+        not order_items.UnitPrice) the error goes back to the LM.
+        An output alias of the same name is left alone: its definition
+        (`AS name`) and its uses in ORDER BY, where SQLite resolves result
+        aliases before table columns.
+        """
+        catalog = self._catalog()
+        owners = [(table, alias) for table, alias in self._tables_used(sql)
+                  if any(c.lower() == name.lower() for c in catalog.columns(table))]
+        if not owners:
+            return None, ""
+        code = _code_only(sql)
+        if not self._joined_on(code, name, [(alias or table).lower() for table, alias in owners]):
+            logger.info("Not qualifying %s: %s are not joined on it", name,
+                        ", ".join(alias or table for table, alias in owners))
+            return None, ""
+        table, alias = owners[0]
+        qualified = f"{alias or _quote(table)}.{name}"
+        pattern = re.compile(r'(?<![\w."])' + re.escape(name) + r'(?![\w"])', re.IGNORECASE)
+        is_alias = re.search(r"\bAS\s+" + re.escape(name) + r"\b", code, re.IGNORECASE)
+        order_by = [m.end() for m in re.finditer(r"\bORDER\s+BY\b", code, re.IGNORECASE)]
+        alias_from = order_by[-1] if is_alias and order_by else len(code)
+        parts, last = [], 0
+        for match in pattern.finditer(code):
+            if match.start() >= alias_from or re.search(r"\bAS\s+$", code[:match.start()], re.IGNORECASE):
+                continue
+            parts.append(sql[last:match.start()] + qualified)
+            last = match.end()
+        return "".join(parts) + sql[last:], qualified
+
+    @staticmethod
+    def _joined_on(code: str, name: str, qualifiers: List[str]) -> bool:
+        """Whether equalities `a.name = b.name` in `code` connect all of `qualifiers`."""
+        ref = r'("[^"]+"|`[^`]+`|\[[^\]]+\]|\w+)\s*\.\s*["`\[]?' + re.escape(name) + r'["`\]]?(?![\w])'
+        group = {q: q for q in qualifiers}
+
+        def root(q):
+            while group[q] != q:
+                q = group[q]
+            return q
+
+        for m in re.finditer(ref + r"\s*==?\s*" + ref, code, re.IGNORECASE):
+            left, right = _unquote(m.group(1)).lower(), _unquote(m.group(2)).lower()
+            if left in group and right in group:
+                group[root(left)] = root(right)
+        return len({root(q) for q in qualifiers}) == 1
+
+    def _repair_syntax(self, sql: str) -> Tuple[Optional[str], str]:
+        """Dialect syntax SQLite rejects: TOP n, ILIKE, EXTRACT, unquoted names with spaces."""
+        spaced = [QuoteNameRule(table) for table in self._catalog().tables if " " in table]
+        fixed = SQLRewriter(DEFAULT_RULES + spaced).rewrite(sql)
+        return (fixed, "dialect rewrite") if fixed != sql else (None, "")
@@ -1,58 +1,249 @@
+import json
 import sqlite3
-import pandas as pd
-from typing import List, Dict, Union, Any
+import threading
+import time
+from typing import List, Dict, Union, Any, Optional
 import os
 
+from agent.tools.connection_pool import ConnectionPool
+from agent.tools.index_advisor import NORMALIZED_DATE_COLUMN, rewrite_date_prefix
+from agent.tools.query_cache import QueryCache
+from agent.tools.rollups import RollupRewriter
+from agent.tools.schema_catalog import SchemaCatalog, db_fingerprint
+from agent.tools.sql_validator import SQLValidator
+
+OUTPUT_FORMATS = ("records", "columns", "pandas")
+
+# How many SQLite VM instructions run between wall-clock checks
+PROGRESS_INTERVAL = 10000
+
+TIMEOUT_HINT = ("Make the query cheaper: join tables on their key columns, "
+                "filter by date early, and aggregate instead of returning raw rows.")
+
+
+
+class Records(list):
+    """Row dicts of a query result; `truncated` is True when the row cap cut it short."""
+
+    def __init__(self, rows=(), truncated: bool = False):
+        super().__init__(rows)
+        self.truncated = truncated
+
+
+def _timeout_error(timeout: float) -> str:
+    return f"Error executing SQL (timeout): query exceeded the {timeout:g}s limit. {TIMEOUT_HINT}"
+
+
 class SQLiteDB:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, cache_size: int = 256, cache_path: Optional[str] = None,
+                 max_rows: Optional[int] = None, timeout: Optional[float] = None,
+                 catalog_dir: Optional[str] = None, rollups: bool = False,
+                 query_log: Optional[str] = None):
         """
         Initialize with path to the SQLite database.
+        Queries run on pooled read-only connections (one per thread).
+        Results of successful queries are kept in an LRU cache of `cache_size`
+        entries (0 disables it), persisted to `cache_path` when given.
+        `max_rows` caps how many rows a query materializes (None = no cap) and
+        `timeout` interrupts queries running longer than that many seconds.
+        The schema catalog is introspected on first use and cached in `catalog_dir`.
+        With `rollups`, eligible aggregate queries are answered from the daily
+        rollup tables (see agent/tools/rollups.py) while those are up to date.
+        Once the index advisor has added the normalized OrderDay column,
+        `OrderDate LIKE '1997-06%'` filters are run as index range scans on it.
+        Every executed query is appended to the `query_log` JSONL file, if set,
+        for the index advisor to analyze.
         """
         self.db_path = db_path
         if not os.path.exists(db_path):
             raise FileNotFoundError(f"Database not found at {db_path}")
+        self.max_rows = max_rows
+        self.timeout = timeout
+        self.pool = ConnectionPool(db_path)
+        self.cache = QueryCache(db_path, cache_size, cache_path) if cache_size > 0 else None
+        self.catalog_dir = catalog_dir
+        self.rewriter = RollupRewriter(self.pool, db_path) if rollups else None
+        self.query_log = query_log
+        self._log_lock = threading.Lock()
+        self._catalog = None
+        self.validator = SQLValidator(lambda: self.catalog, self._prepare)
+
+    @property
+    def catalog(self) -> SchemaCatalog:
+        """Schema catalog, rebuilt only when the database file changes."""
+        if self._catalog is None or self._catalog.fingerprint != db_fingerprint(self.db_path):
+            self._catalog = SchemaCatalog.load(self.db_path, self.pool.get(), self.catalog_dir)
+        return self._catalog
 
-    def execute_query(self, sql: str) -> Union[List[Dict[str, Any]], str]:
+    def _fetch(self, sql: str, max_rows: Optional[int], deadline: Optional[float]) -> Dict[str, Any]:
         """
-        Executes a SQL query and returns the results as a list of dictionaries.
-        Returns an error string if execution fails.
+        Runs the query on a pooled cursor and returns columns plus raw row tuples.
+        Rows are pulled lazily, so a row cap also bounds the work SQLite does.
+        A progress handler aborts the statement once time.monotonic() passes `deadline`.
         """
+        conn = self.pool.get()
+        if deadline is not None:
+            conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_INTERVAL)
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                # Use pandas for easy conversion to dict, but handles simple selects well
-                df = pd.read_sql_query(sql, conn)
-                return df.to_dict(orient="records")
+            cursor = conn.execute(sql)
+            columns = [d[0] for d in cursor.description] if cursor.description else []
+            if max_rows is None:
+                rows = cursor.fetchall()
+                truncated = False
+            else:
+                # One extra row tells us whether the cap cut the result short
+                rows = cursor.fetchmany(max_rows + 1)
+                truncated = len(rows) > max_rows
+                rows = rows[:max_rows]
+            cursor.close()
+        finally:
+            if deadline is not None:
+                conn.set_progress_handler(None, PROGRESS_INTERVAL)
+        return {"columns": columns, "rows": rows, "truncated": truncated}
+
+    def _rewrites(self, sql: str) -> List[str]:
+        """Cheaper equivalents of `sql` to try before it, best first."""
+        candidates = []
+        rolled = self.rewriter.rewrite(sql) if self.rewriter is not None else None
+        if rolled:
+            candidates.append(rolled)
+        if NORMALIZED_DATE_COLUMN.lower() in (c.lower() for c in self.catalog.columns("Orders")):
+            dated = rewrite_date_prefix(sql)
+            if dated != sql:
+                candidates.append(dated)
+        return candidates
+
+    def _log(self, sql: str, executed: str, seconds: float, rows: int):
+        if not self.query_log:
+            return
+        entry = {"sql": sql, "executed": executed, "seconds": round(seconds, 6), "rows": rows}
+        with self._log_lock:
+            with open(self.query_log, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    @staticmethod
+    def _materialize(result: Dict[str, Any], output: str):
+        columns, rows = result["columns"], result["rows"]
+        if output == "records":
+            return Records((dict(zip(columns, row)) for row in rows), result["truncated"])
+        if output == "columns":
+            return {
+                "columns": columns,
+                "data": {col: [row[i] for row in rows] for i, col in enumerate(columns)},
+                "row_count": len(rows),
+                "truncated": result["truncated"],
+            }
+        # pandas is only imported when explicitly requested
+        import pandas as pd
+        frame = pd.DataFrame.from_records(rows, columns=columns)
+        frame.attrs["truncated"] = result["truncated"]
+        return frame
+
+    def execute_query(self, sql: str, max_rows: Optional[int] = None, output: str = "records",
+                      timeout: Optional[float] = None) -> Union["Records", Dict[str, Any], str]:
+        """
+        Executes a SQL query and returns the results as a list of dictionaries
+        (a Records list whose `truncated` attribute says whether `max_rows` cut it short).
+        `max_rows` and `timeout` override the instance-wide limits for this call.
+        `output="columns"` returns column-oriented arrays with column names and a
+        `truncated` flag instead; `output="pandas"` returns a DataFrame with
+        `attrs["truncated"]`.
+        Returns an error string if execution fails; a query stopped by the
+        time limit yields "Error executing SQL (timeout): ..." with a repair hint.
+        """
+        if output not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {output}")
+        if max_rows is None:
+            max_rows = self.max_rows
+        if timeout is None:
+            timeout = self.timeout
+        variant = str(max_rows)
+
+        result = self.cache.get(sql, variant) if self.cache is not None else None
+        if result is None:
+            start = time.perf_counter()
+            # One deadline for the rewrites and the original query together
+            deadline = time.monotonic() + timeout if timeout is not None else None
+            executed = None
+            for candidate in self._rewrites(sql):
+                try:
+                    result = self._fetch(candidate, max_rows, deadline)
+                    executed = candidate
+                    break
+                except sqlite3.OperationalError as e:
+                    if deadline is not None and "interrupted" in str(e):
+                        # The original query would only get what is left of the same limit
+                        return _timeout_error(timeout)
+                except sqlite3.Error:
+                    # Fall back to the original query, whose error is the one to report
+                    continue
+            if result is None:
+                try:
+                    result = self._fetch(sql, max_rows, deadline)
+                    executed = sql
+                except sqlite3.OperationalError as e:
+                    if deadline is not None and "interrupted" in str(e):
+                        return _timeout_error(timeout)
+                    return f"Error executing SQL: {str(e)}"
+                except Exception as e:
+                    return f"Error executing SQL: {str(e)}"
+            self._log(sql, executed, time.perf_counter() - start, len(result["rows"]))
+            if self.cache is not None:
+                self.cache.set(sql, result, variant)
+        return self._materialize(result, output)
+
+    def _prepare(self, sql: str):
+        """Compiles `sql` without running it; raises sqlite3.Error if it is invalid."""
+        self.pool.get().execute("EXPLAIN " + sql).close()
+
+    def validate(self, sql: str) -> Dict[str, Any]:
+        """
+        Checks `sql` against the schema without executing it and applies
+        deterministic repairs (see agent/tools/sql_validator.py).
+        Returns {"sql", "ok", "error", "repairs"}.
+        """
+        return self.validator.validate(sql)
+
+    def explain(self, sql: str) -> Union[List[Dict[str, Any]], str]:
+        """
+        EXPLAIN QUERY PLAN for `sql` without running it, as a list of
+        {"id", "parent", "detail"} rows, or an error string.
+        """
+        try:
+            rows = self.pool.get().execute("EXPLAIN QUERY PLAN " + sql).fetchall()
         except Exception as e:
-            return f"Error executing SQL: {str(e)}"
+            return f"Error explaining SQL: {str(e)}"
+        return [{"id": r[0], "parent": r[1], "detail": r[3]} for r in rows]
 
     def get_schema(self, table_names: List[str] = None) -> str:
         """
-        Returns the schema definition for specified tables using PRAGMA.
+        Returns the schema definition for specified tables from the catalog.
         If table_names is None, returns schema for all tables.
         """
         schema_str = ""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # If no specific tables requested, get all tables
-                if not table_names:
-                    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-                    table_names = [row[0] for row in cursor.fetchall()]
-
-                for table in table_names:
-                    schema_str += f"Table: {table}\n"
-                    cursor.execute(f"PRAGMA table_info('{table}')")
-                    columns = cursor.fetchall()
-                    # format: (cid, name, type, notnull, dflt_value, pk)
-                    for col in columns:
-                        schema_str += f"  - {col[1]} ({col[2]})\n"
-                    schema_str += "\n"
+            catalog = self.catalog
+            
+            # If no specific tables requested, get all tables
+            if not table_names:
+                table_names = [name for name, info in catalog.tables.items() if info["type"] == "table"]
+
+            for table in table_names:
+                schema_str += f"Table: {table}\n"
+                name = catalog.resolve(table)
+                columns = catalog.tables[name]["columns"] if name else []
+                for col_name, col_type in columns:
+                    schema_str += f"  - {col_name} ({col_type})\n"
+                schema_str += "\n"
                     
             return schema_str
         except Exception as e:
             return f"Error retrieving schema: {str(e)}"
 
+    def close(self):
+        """Closes all pooled connections."""
+        self.pool.close()
+
 # Quick test block to verify it works when run directly
 if __name__ == "__main__":
     # Adjust path if running from agent/tools/ directly vs project root
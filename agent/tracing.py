@@ -0,0 +1,191 @@
+import contextlib
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# -------------------------------------------------------------------------
+# Structured Tracing
+# -------------------------------------------------------------------------
+# Spans and events per question: graph nodes, LM calls (per signature, with
+# token counts), SQL executions and retrievals. Every event is aggregated in
+# memory for the end-of-batch summary and, if a trace file is open, appended
+# to it as one JSON line:
+#   {"type": "lm", "name": "sql_generator", "id": "<question id>", "ts": ...,
+#    "seconds": 0.41, "node": "sql_gen", "prompt_tokens": 512, ...}
+# "context" events carry the tokens context packing saved per LM call.
+# Events raised inside a node are tagged with the question id and node name
+# of the enclosing span.
+# Numeric fields are summed in the summary, except the ones in MAX_FIELDS:
+# those describe the run (e.g. which repair attempt a node ran in) rather than
+# count something, so the summary gives their largest value as max_<field>.
+# Durations are kept as log-bucketed histograms, not as lists, so memory per
+# (type, name) stays fixed however many questions run (e.g. under --serve);
+# percentiles are then within HISTOGRAM_GROWTH (2%) of the exact value.
+_span = contextvars.ContextVar("trace_span", default=None)
+MAX_FIELDS = {"retry"}
+HISTOGRAM_BASE = 1e-6
+HISTOGRAM_GROWTH = 1.02
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0..100) of an unsorted list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+class LatencyHistogram:
+    """Count, sum and max of durations plus counts per bucket [BASE * GROWTH**(i-1), BASE * GROWTH**i)."""
+
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets: Dict[int, int] = {}
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        bucket = 0 if seconds <= HISTOGRAM_BASE else math.ceil(math.log(seconds / HISTOGRAM_BASE, HISTOGRAM_GROWTH))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def copy(self) -> "LatencyHistogram":
+        other = LatencyHistogram()
+        other.count, other.total, other.max, other.buckets = self.count, self.total, self.max, dict(self.buckets)
+        return other
+
+    def percentile(self, q: float) -> float:
+        """Nearest-rank percentile (q in 0..100), as the upper bound of its bucket."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(q / 100 * self.count))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(HISTOGRAM_BASE * HISTOGRAM_GROWTH ** bucket, self.max)
+        return self.max
+
+
+class Tracer:
+    """Thread-safe span/event recorder with an optional JSONL sink."""
+
+    def __init__(self):
+        self.path = None
+        self._file = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # (type, name) -> durations; (type, name) -> summed counters
+            self._seconds: Dict[tuple, LatencyHistogram] = {}
+            self._counters: Dict[tuple, Dict[str, float]] = {}
+
+    def open(self, path: str):
+        """Appends events to `path` from now on."""
+        self.close()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._lock:
+            self.path = path
+            self._file = open(path, "a", encoding="utf-8")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = None
+
+    @contextlib.contextmanager
+    def span(self, kind: str, name: str, question_id: Optional[str] = None, **fields):
+        """Times the block and emits one event; events inside it inherit the id and node."""
+        parent = _span.get()
+        question_id = question_id if question_id is not None else (parent or {}).get("id")
+        token = _span.set({"id": question_id, "node": name if kind == "node" else (parent or {}).get("node")})
+        start = time.perf_counter()
+        extra: Dict[str, Any] = {}
+        try:
+            yield extra
+        finally:
+            _span.reset(token)
+            self._record(kind, name, time.perf_counter() - start, question_id,
+                         (parent or {}).get("node") if kind != "node" else None, {**fields, **extra})
+
+    def emit(self, kind: str, name: str, seconds: float, question_id: Optional[str] = None, **fields):
+        """Records an already-timed event under the current span."""
+        current = _span.get() or {}
+        question_id = question_id if question_id is not None else current.get("id")
+        self._record(kind, name, seconds, question_id, current.get("node"), fields)
+
+    def _record(self, kind, name, seconds, question_id, node, fields):
+        key = (kind, name)
+        with self._lock:
+            histogram = self._seconds.get(key)
+            if histogram is None:
+                histogram = self._seconds[key] = LatencyHistogram()
+            histogram.add(seconds)
+            counters = self._counters.setdefault(key, {})
+            for field, value in fields.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                if field in MAX_FIELDS:
+                    field = f"max_{field}"
+                    counters[field] = max(counters.get(field, value), value)
+                else:
+                    counters[field] = counters.get(field, 0) + value
+            if self._file is not None:
+                event = {"type": kind, "name": name, "id": question_id, "ts": time.time(),
+                         "seconds": round(seconds, 6)}
+                if node and kind != "node":
+                    event["node"] = node
+                event.update(fields)
+                self._file.write(json.dumps(event, default=str) + "\n")
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """{"node:router": {"count", "p50_ms", "p95_ms", "p99_ms", "total_s", <counters>}, ...}"""
+        with self._lock:
+            items = [(key, histogram.copy(), dict(self._counters.get(key, {})))
+                     for key, histogram in self._seconds.items()]
+        summary = {}
+        for (kind, name), histogram, counters in items:
+            summary[f"{kind}:{name}"] = {
+                "count": histogram.count,
+                "p50_ms": histogram.percentile(50) * 1000,
+                "p95_ms": histogram.percentile(95) * 1000,
+                "p99_ms": histogram.percentile(99) * 1000,
+                "total_s": histogram.total,
+                **counters,
+            }
+        return summary
+
+    def report(self) -> str:
+        """Summary table grouped by event type, slowest total first."""
+        summary = self.summary()
+        if not summary:
+            return ""
+        lines = []
+        for kind in ("question", "cache", "node", "lm", "context", "sql", "retrieval"):
+            rows = sorted(((k.split(":", 1)[1], v) for k, v in summary.items() if k.split(":", 1)[0] == kind),
+                          key=lambda kv: -kv[1]["total_s"])
+            if not rows:
+                continue
+            lines.append(f"{'[' + kind + ']':<22}{'count':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'total s':>9}")
+            for name, s in rows:
+                extras = "  ".join(f"{k}={v:g}" for k, v in s.items()
+                                   if k not in ("count", "p50_ms", "p95_ms", "p99_ms", "total_s"))
+                lines.append(f"  {name:<20}{s['count']:>7} {s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} "
+                             f"{s['p99_ms']:>9.1f} {s['total_s']:>9.2f}  {extras}".rstrip())
+        return "\n".join(lines)
+
+
+tracer = Tracer()
@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# -------------------------------------------------------------------------
+# End-to-end graph benchmark (offline)
+# -------------------------------------------------------------------------
+# Runs generated questions (benchmarks/generate_questions.py) through the
+# full LangGraph app against any database (benchmarks/scale_northwind.py)
+# with an offline LM backend (agent/lm_backends.py: deterministic stub answers
+# or a replayed recording) in place of Ollama, so the numbers measure the
+# pipeline (routing, retrieval, schema selection, SQL, synthesis) rather than
+# the model. Reports throughput, p50/p95/p99 end to end and (from the trace)
+# per node, LM signature, SQL and retrieval, and peak memory.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from agent.tracing import percentile, tracer  # noqa: E402
+
+# --- measurement -------------------------------------------------------------
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def run(items, workers):
+    """Invokes the graph for every item; returns one record per question."""
+    from agent.graph_hybrid import get_app
+    from run_agent_hybrid import build_initial_state, cached_answer, context_savings, remember_answer
+
+    def one(item):
+        start = time.perf_counter()
+        if cached_answer(item) is not None:
+            return {"id": item["id"], "route": None, "tool_choice": None, "cached": True,
+                    "seconds": time.perf_counter() - start, "timings": [], "context_saved": 0, "error": ""}
+        try:
+            state = get_app().invoke(build_initial_state(item))
+            error = state.get("sql_error") or ""
+            remember_answer(item, {"final_answer": state.get("final_answer"), "sql": state.get("sql_query", ""),
+                                   "confidence": 0.5 if error else 1.0, "explanation": state.get("explanation", ""),
+                                   "citations": state.get("citations", [])})
+        except Exception as e:
+            state, error = {}, f"Error: {e}"
+        return {
+            "id": item["id"],
+            "route": item.get("route"),
+            "tool_choice": state.get("tool_choice"),
+            "cached": False,
+            "seconds": time.perf_counter() - start,
+            "timings": state.get("timings", []),
+            "context_saved": context_savings(state)["saved"] if state else 0,
+            "error": error,
+        }
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(one, items))
+
+
+def summarize(records, wall_seconds):
+    e2e = [r["seconds"] for r in records]
+    labelled = [r for r in records if r["route"]]
+    return {
+        "questions": len(records),
+        "errors": sum(1 for r in records if r["error"]),
+        "question_cache_hits": sum(1 for r in records if r["cached"]),
+        "context_tokens_saved": sum(r["context_saved"] for r in records),
+        "wall_seconds": wall_seconds,
+        "throughput_qps": len(records) / wall_seconds if wall_seconds else 0.0,
+        "end_to_end": {
+            "mean_ms": sum(e2e) / len(e2e) * 1000 if e2e else 0.0,
+            "p50_ms": percentile(e2e, 50) * 1000,
+            "p95_ms": percentile(e2e, 95) * 1000,
+            "p99_ms": percentile(e2e, 99) * 1000,
+        },
+        "trace": tracer.summary(),
+        "route_accuracy": (sum(1 for r in labelled if r["tool_choice"] == r["route"]) / len(labelled)
+                           if labelled else None),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def report(summary):
+    print(f"Questions: {summary['questions']}  errors: {summary['errors']}  "
+          f"question cache hits: {summary['question_cache_hits']}  "
+          f"context tokens saved: {summary['context_tokens_saved']}  "
+          f"wall: {summary['wall_seconds']:.2f}s  throughput: {summary['throughput_qps']:.1f} q/s")
+    e2e = summary["end_to_end"]
+    print(f"End to end (ms): mean {e2e['mean_ms']:.1f}  p50 {e2e['p50_ms']:.1f}  "
+          f"p95 {e2e['p95_ms']:.1f}  p99 {e2e['p99_ms']:.1f}")
+    if summary["route_accuracy"] is not None:
+        print(f"Route accuracy: {summary['route_accuracy']:.1%}")
+    if summary["peak_rss_mb"] is not None:
+        print(f"Peak RSS: {summary['peak_rss_mb']:.0f} MB")
+    print(tracer.report())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the agent graph end to end with a stub LM")
+    parser.add_argument("--db", default=os.path.join(ROOT, "data", "northwind.sqlite"), help="Database to query")
+    parser.add_argument("--questions", default=os.path.join(ROOT, ".cache", "bench_questions.jsonl"),
+                        help="JSONL from generate_questions.py")
+    parser.add_argument("--limit", type=int, default=None, help="Only run the first N questions")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent questions")
+    parser.add_argument("--warmup", type=int, default=20, help="Questions run first and left out of the numbers")
+    parser.add_argument("--lm", choices=["stub", "replay"], default="stub", help="Offline LM backend")
+    parser.add_argument("--lm-script", default=None, help="JSONL of scripted answers for the stub")
+    parser.add_argument("--lm-replay", default=None, help="Recording to serve with --lm replay")
+    parser.add_argument("--lm-latency", type=float, default=0.0, help="Milliseconds added to every LM call")
+    parser.add_argument("--lm-jitter", type=float, default=0.0, help="Random +/- milliseconds on top of --lm-latency")
+    parser.add_argument("--lm-cache", action="store_true", help="Keep the on-disk LM cache on")
+    parser.add_argument("--question-cache", action="store_true",
+                        help="Answer repeated/near-duplicate questions from the question cache")
+    parser.add_argument("--trace", default=None, help="Append trace events to this JSONL file")
+    parser.add_argument("--json", default=None, help="Also write the summary to this file")
+    args = parser.parse_args()
+
+    import dspy
+    import agent.graph_hybrid as graph
+    from agent.lm_backends import build_lm
+
+    graph.DB_PATH = os.path.abspath(args.db)
+    graph.lm_cache.enabled = args.lm_cache
+    graph.question_cache.enabled = args.question_cache
+    lm, engine = build_lm(args.lm, script=args.lm_script, replay=args.lm_replay,
+                          latency_ms=args.lm_latency, jitter_ms=args.lm_jitter)
+    dspy.configure(lm=lm)
+
+    with open(args.questions, "r", encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    if args.limit:
+        items = items[:args.limit]
+
+    run(items[:args.warmup], args.workers)
+    tracer.reset()
+    if args.trace:
+        tracer.open(args.trace)
+    start = time.perf_counter()
+    records = run(items, args.workers)
+    wall = time.perf_counter() - start
+    tracer.close()
+
+    summary = summarize(records, wall)
+    summary.update({"db": args.db, "workers": args.workers, "lm": args.lm, "lm_latency_ms": args.lm_latency,
+                    "lm_stats": engine.stats()})
+    report(summary)
+    print(f"LM ({args.lm}): {engine.stats()}  SQL templates: {graph.get_sql_templates().stats()}  "
+          f"SQL validator: {graph.get_db_tool().validator.stats()}")
+    if graph.get_db_tool().rewriter:
+        print(f"Rollups: {graph.get_db_tool().rewriter.stats()}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+
+# -------------------------------------------------------------------------
+# Synthetic eval question generator
+# -------------------------------------------------------------------------
+# Writes thousands of questions in the sample_questions_hybrid_eval.jsonl
+# format, mixed across rag / sql / hybrid. Entities come from the database
+# (categories, products, months with orders) and the docs (marketing calendar
+# campaigns), so every question is answerable. Each item also carries the
+# expected "route" for scoring the router.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from agent.rag.retrieval import chunk_markdown  # noqa: E402
+from agent.sql_templates import parse_calendar  # noqa: E402
+
+MONTH_NAMES = ["January", "February", "March", "April", "May", "June", "July",
+               "August", "September", "October", "November", "December"]
+REVENUE_HINT = "Revenue uses Order Details: SUM(UnitPrice*Quantity*(1-Discount))."
+
+# (route, shape, [phrasings], format_hint). Placeholders are filled per item.
+SHAPES = [
+    ("rag", "return_window", [
+        "According to the product policy, what is the return window (days) for unopened {policy_category}? Return an integer.",
+        "Per the returns policy, how many days do customers have to return unopened {policy_category}? Return an integer.",
+    ], "int"),
+    ("rag", "campaign_dates", [
+        "What are the dates of '{campaign}' in the marketing calendar? Return {{start:str, end:str}}.",
+        "According to the marketing calendar, when does '{campaign}' run? Return {{start:str, end:str}}.",
+    ], "{start:str, end:str}"),
+    ("rag", "kpi_definition", [
+        "How is {kpi} defined in the KPI docs? Return the formula as a string.",
+        "What formula do the KPI definitions give for {kpi}? Return a string.",
+    ], "str"),
+    ("sql", "top_products_year", [
+        "Top {n} products by total revenue in {year}. " + REVENUE_HINT + " Return list[{{product:str, revenue:float}}].",
+        "Which {n} products generated the most revenue in {year}? Return list[{{product:str, revenue:float}}].",
+    ], "list[{product:str, revenue:float}]"),
+    ("sql", "top_products_alltime", [
+        "Top {n} products by total revenue all-time. " + REVENUE_HINT + " Return list[{{product:str, revenue:float}}].",
+    ], "list[{product:str, revenue:float}]"),
+    ("sql", "category_revenue_month", [
+        "Total revenue for the {category} category in {month} {year}. Return a float rounded to 2 decimals.",
+        "What was {category} revenue in {month} {year}? Return a float rounded to 2 decimals.",
+    ], "float"),
+    ("sql", "top_category_quantity", [
+        "Which product category had the highest total quantity sold in {year}? Return {{category:str, quantity:int}}.",
+    ], "{category:str, quantity:int}"),
+    ("sql", "order_count_month", [
+        "How many orders were placed in {month} {year}? Return an integer.",
+    ], "int"),
+    ("sql", "top_customer_revenue", [
+        "Who was the top customer by revenue in {year}? Return {{customer:str, revenue:float}}.",
+    ], "{customer:str, revenue:float}"),
+    ("sql", "product_quantity_year", [
+        "How many units of {product} were sold in {year}? Return an integer.",
+    ], "int"),
+    ("hybrid", "campaign_top_category", [
+        "During '{campaign}' as defined in the marketing calendar, which product category had the highest total quantity sold? Return {{category:str, quantity:int}}.",
+    ], "{category:str, quantity:int}"),
+    ("hybrid", "campaign_aov", [
+        "Using the AOV definition from the KPI docs, what was the Average Order Value during '{campaign}'? Return a float rounded to 2 decimals.",
+    ], "float"),
+    ("hybrid", "campaign_category_revenue", [
+        "Total revenue from the '{category}' category during '{campaign}' dates. Return a float rounded to 2 decimals.",
+    ], "float"),
+    ("hybrid", "campaign_top_products", [
+        "Top {n} products by revenue during '{campaign}' per the marketing calendar. Return list[{{product:str, revenue:float}}].",
+    ], "list[{product:str, revenue:float}]"),
+    ("hybrid", "customer_margin_year", [
+        "Per the KPI definition of gross margin, who was the top customer by gross margin in {year}? "
+        "Assume CostOfGoods is approximated by 70% of UnitPrice if not available. Return {{customer:str, margin:float}}.",
+    ], "{customer:str, margin:float}"),
+]
+
+
+def load_entities(db_path: str, docs_path: str) -> dict:
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        categories = [r[0] for r in conn.execute("SELECT CategoryName FROM Categories ORDER BY CategoryID")]
+        products = [r[0] for r in conn.execute("SELECT ProductName FROM Products ORDER BY ProductID")]
+        months = [r[0] for r in conn.execute("SELECT DISTINCT substr(OrderDate, 1, 7) FROM Orders ORDER BY 1") if r[0]]
+    finally:
+        conn.close()
+
+    chunks = []
+    for name in sorted(os.listdir(docs_path)):
+        if name.endswith(".md"):
+            with open(os.path.join(docs_path, name), "r", encoding="utf-8") as f:
+                chunks.extend(chunk_markdown(name, f.read()))
+    # parse_calendar keys are lowercased; keep the titles as written
+    calendar = parse_calendar(chunks)
+    titles = [c["text"].splitlines()[0].lstrip("#").strip() for c in chunks if c["text"].strip()]
+    campaigns = [t for t in titles if t.lower() in calendar]
+    return {
+        "categories": categories,
+        "products": products,
+        "months": months,
+        "campaigns": campaigns,
+        "policy_categories": ["Beverages", "Produce", "Seafood", "Dairy Products", "Condiments", "Confections"],
+        "kpis": ["Average Order Value (AOV)", "Gross Margin"],
+    }
+
+
+def make_item(index: int, shape: tuple, entities: dict, rng: random.Random) -> dict:
+    route, name, phrasings, format_hint = shape
+    year_month = rng.choice(entities["months"])
+    values = {
+        "n": rng.choice([3, 5, 10]),
+        "year": year_month[:4],
+        "month": MONTH_NAMES[int(year_month[5:7]) - 1],
+        "category": rng.choice(entities["categories"]),
+        "product": rng.choice(entities["products"]),
+        "campaign": rng.choice(entities["campaigns"]) if entities["campaigns"] else "",
+        "policy_category": rng.choice(entities["policy_categories"]),
+        "kpi": rng.choice(entities["kpis"]),
+    }
+    return {
+        "id": f"{route}_{name}_{index:06d}",
+        "question": rng.choice(phrasings).format(**values),
+        "format_hint": format_hint,
+        "route": route,
+    }
+
+
+def generate(n: int, mix: dict, entities: dict, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    shapes = [s for s in SHAPES if mix.get(s[0], 0) > 0
+              and (entities["campaigns"] or "{campaign}" not in "".join(s[2]))]
+    per_route = {}
+    for s in shapes:
+        per_route.setdefault(s[0], []).append(s)
+    routes = sorted(per_route)
+    weights = [mix[r] for r in routes]
+    items = []
+    for i in range(n):
+        route = rng.choices(routes, weights)[0]
+        items.append(make_item(i, rng.choice(per_route[route]), entities, rng))
+    return items
+
+
+def parse_mix(text: str) -> dict:
+    """Parses "rag:0.2,sql:0.4,hybrid:0.4" into {"rag": 0.2, ...}."""
+    mix = {}
+    for part in text.split(","):
+        route, _, weight = part.partition(":")
+        mix[route.strip()] = float(weight)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic eval questions across rag/sql/hybrid")
+    parser.add_argument("--db", default=os.path.join(ROOT, "data", "northwind.sqlite"), help="Database for entities")
+    parser.add_argument("--docs", default=os.path.join(ROOT, "docs"), help="Docs directory")
+    parser.add_argument("--out", default=os.path.join(ROOT, ".cache", "bench_questions.jsonl"), help="Output JSONL")
+    parser.add_argument("--n", type=int, default=5000, help="Number of questions")
+    parser.add_argument("--mix", default="rag:0.2,sql:0.4,hybrid:0.4", help="Route weights")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    items = generate(args.n, parse_mix(args.mix), load_entities(args.db, args.docs), seed=args.seed)
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        for item in items:
+            f.write(json.dumps(item) + "\n")
+    counts = {}
+    for item in items:
+        counts[item["route"]] = counts.get(item["route"], 0) + 1
+    print(f"Wrote {len(items)} questions to {args.out} {counts}")
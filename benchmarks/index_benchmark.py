@@ -0,0 +1,107 @@
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+# -------------------------------------------------------------------------
+# Index advisor before/after benchmark
+# -------------------------------------------------------------------------
+# Times a representative SQL workload on a copy of the database, applies the
+# index advisor's proposals to the copy, and times it again. Point --db at a
+# scaled-up Northwind; on the stock database every query is already fast.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from agent.tools.index_advisor import IndexAdvisor, load_query_log  # noqa: E402
+from agent.tools.sqlite_tool import SQLiteDB  # noqa: E402
+
+REVENUE = "SUM(oi.UnitPrice * oi.Quantity * (1 - oi.Discount))"
+WORKLOAD = [
+    # Cheat-sheet shapes as the LM writes them (date-prefix LIKE filters)
+    f"SELECT {REVENUE} FROM orders o JOIN order_items oi ON o.OrderID = oi.OrderID "
+    "JOIN products p ON oi.ProductID = p.ProductID JOIN categories c ON p.CategoryID = c.CategoryID "
+    "WHERE c.CategoryName = 'Beverages' AND o.OrderDate LIKE '1997-06%'",
+    f"SELECT {REVENUE} / COUNT(DISTINCT o.OrderID) FROM orders o JOIN order_items oi ON o.OrderID = oi.OrderID "
+    "WHERE o.OrderDate LIKE '1997-12%'",
+    "SELECT c.CategoryName, SUM(oi.Quantity) AS Qty FROM orders o JOIN order_items oi ON o.OrderID = oi.OrderID "
+    "JOIN products p ON oi.ProductID = p.ProductID JOIN categories c ON p.CategoryID = c.CategoryID "
+    "WHERE o.OrderDate LIKE '1997-06%' GROUP BY c.CategoryName ORDER BY Qty DESC LIMIT 1",
+    f"SELECT p.ProductName, {REVENUE} AS Rev FROM order_items oi JOIN products p ON oi.ProductID = p.ProductID "
+    "GROUP BY p.ProductName ORDER BY Rev DESC LIMIT 3",
+    # Template shapes (half-open OrderDate ranges)
+    f"SELECT {REVENUE} AS Revenue FROM orders o JOIN order_items oi ON o.OrderID = oi.OrderID "
+    "WHERE o.OrderDate >= '1997-06-01' AND o.OrderDate < '1997-07-01'",
+    f"SELECT cu.CompanyName, SUM((oi.UnitPrice - 0.7 * oi.UnitPrice) * oi.Quantity * (1 - oi.Discount)) AS Margin "
+    "FROM orders o JOIN order_items oi ON o.OrderID = oi.OrderID JOIN customers cu ON o.CustomerID = cu.CustomerID "
+    "WHERE o.OrderDate LIKE '1997%' GROUP BY cu.CompanyName ORDER BY Margin DESC LIMIT 1",
+]
+
+
+def time_workload(db, queries, runs):
+    """Median seconds per query; results are returned to check nothing changed."""
+    timings, results = {}, {}
+    for sql in queries:
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            results[sql] = db.execute_query(sql)
+            samples.append(time.perf_counter() - start)
+        timings[sql] = statistics.median(samples)
+    return timings, results
+
+
+def same_rows(a, b):
+    if isinstance(a, str) or isinstance(b, str) or len(a) != len(b):
+        return a == b
+    for x, y in zip(a, b):
+        for u, v in zip(x.values(), y.values()):
+            if isinstance(u, float) and isinstance(v, float):
+                if abs(u - v) > 1e-6 * max(1.0, abs(u)):
+                    return False
+            elif u != v:
+                return False
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time a SQL workload before/after the advisor's indexes")
+    parser.add_argument("--db", default=os.path.join(ROOT, "data", "northwind.sqlite"), help="Database to copy")
+    parser.add_argument("--log", action="append", default=[], help="Use queries from a SQLiteDB query_log instead")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per query (median is reported)")
+    args = parser.parse_args()
+
+    workload = Counter()
+    for path in args.log:
+        workload.update(load_query_log(path))
+    if not workload:
+        workload = Counter(WORKLOAD)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, os.path.basename(args.db))
+        shutil.copy(args.db, path)
+        # No result cache and no rollups, so every run hits the tables
+        db = SQLiteDB(path, cache_size=0)
+        before, before_rows = time_workload(db, workload, args.runs)
+
+        advisor = IndexAdvisor(db)
+        analysis = advisor.analyze(workload)
+        proposals = advisor.propose(analysis)
+        print(advisor.report(analysis, proposals))
+        start = time.perf_counter()
+        # A throwaway copy, so OrderDay may be added to its Orders table
+        advisor.apply(proposals, add_order_day=True)
+        print(f"Indexes built in {time.perf_counter() - start:.1f}s\n")
+
+        after, after_rows = time_workload(db, workload, args.runs)
+        db.close()
+
+    print(f"{'before':>10} {'after':>10} {'speedup':>8}  query")
+    for sql in workload:
+        flag = "" if same_rows(before_rows[sql], after_rows[sql]) else "  RESULTS DIFFER"
+        print(f"{before[sql] * 1000:8.1f}ms {after[sql] * 1000:8.1f}ms {before[sql] / after[sql]:7.1f}x  {sql[:70]}{flag}")
+    print(f"{sum(before.values()) * 1000:8.1f}ms {sum(after.values()) * 1000:8.1f}ms "
+          f"{sum(before.values()) / sum(after.values()):7.1f}x  total")
@@ -0,0 +1,232 @@
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+# -------------------------------------------------------------------------
+# Scaled-up Northwind generator
+# -------------------------------------------------------------------------
+# Copies the database and replaces Orders / "Order Details" with a synthetic
+# history of --lines order lines (10M+ is the intended range). Dimensions
+# (customers, products, categories, employees) are kept as they are; the
+# distributions are shaped like a real retailer:
+#   * order volume grows over the period, is seasonal (Q4 peak, summer dip)
+#     and lighter at weekends
+#   * customers and products follow a Zipf-like popularity curve
+#   * lines per order are 1 + Poisson (mean ~2.6), quantities log-normal,
+#     discounts mostly 0 with a tail of 5-25%
+#   * unit prices are the product list price, sometimes an older lower price
+# Non-key Orders columns are copied from a real order of the same customer,
+# with any other *Date columns shifted by the same offset as OrderDate.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MEAN_EXTRA_LINES = 1.6
+DISCOUNTS = np.array([0.0, 0.05, 0.1, 0.15, 0.2, 0.25])
+DISCOUNT_WEIGHTS = np.array([0.62, 0.1, 0.1, 0.08, 0.06, 0.04])
+# Relative order volume per calendar month (Jan..Dec)
+MONTH_WEIGHTS = np.array([0.9, 0.85, 0.95, 1.0, 1.0, 0.9, 0.85, 0.9, 1.0, 1.1, 1.25, 1.4])
+WEEKDAY_WEIGHTS = np.array([1.1, 1.1, 1.05, 1.05, 1.0, 0.6, 0.45])
+INSERT_CHUNK = 200_000
+
+
+def zipf_weights(n: int, rng: np.random.Generator, exponent: float = 0.9) -> np.ndarray:
+    """Popularity weights for n items, with the ranks shuffled so IDs carry no signal."""
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def day_weights(days: list, growth: float) -> np.ndarray:
+    """Relative order volume per day: linear growth x seasonality x weekday."""
+    trend = np.linspace(1.0, 1.0 + growth, len(days))
+    months = np.array([d.month - 1 for d in days])
+    weekdays = np.array([d.weekday() for d in days])
+    weights = trend * MONTH_WEIGHTS[months] * WEEKDAY_WEIGHTS[weekdays]
+    return weights / weights.sum()
+
+
+def _columns(conn, table):
+    """Stored (non-generated) columns, in table order."""
+    return [r[1] for r in conn.execute(f'PRAGMA table_xinfo("{table}")') if r[6] == 0]
+
+
+def _parse_day(value):
+    try:
+        return datetime.date.fromisoformat(str(value)[:10])
+    except (TypeError, ValueError):
+        return None
+
+
+def prepare(conn):
+    """
+    Empties the fact tables and takes them out of the way of a bulk load:
+    secondary indexes and rollup triggers are dropped (their DDL is returned
+    so indexes can be recreated afterwards).
+    """
+    indexes = [r[0] for r in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+        " AND tbl_name IN ('Orders', 'Order Details')")]
+    for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+            " AND tbl_name IN ('Orders', 'Order Details')").fetchall():
+        conn.execute(f'DROP INDEX "{name}"')
+    for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'rollup_dirty_%'").fetchall():
+        conn.execute(f'DROP TRIGGER "{name}"')
+    conn.execute('DELETE FROM "Order Details"')
+    conn.execute("DELETE FROM Orders")
+    conn.commit()
+    return indexes
+
+
+def generate(conn, templates, lines, start, end, growth, rng):
+    """Inserts the synthetic orders and lines. Returns (orders, lines) written."""
+    order_cols = _columns(conn, "Orders")
+    line_cols = _columns(conn, "Order Details")
+    customers = [r[0] for r in conn.execute("SELECT CustomerID FROM Customers ORDER BY CustomerID")]
+    products = conn.execute("SELECT ProductID, UnitPrice FROM Products ORDER BY ProductID").fetchall()
+    product_ids = np.array([p[0] for p in products])
+    list_prices = np.array([float(p[1] or 0.0) for p in products])
+
+    # Real orders grouped by customer supply the remaining Orders columns
+    by_customer = {}
+    for row in templates:
+        by_customer.setdefault(row["CustomerID"], []).append(row)
+    fallback = templates
+
+    days = [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+    # Oversampled: repeated products within an order are dropped below and the
+    # surplus orders are cut off once `lines` is reached
+    n_orders = max(1, int(lines / (1 + MEAN_EXTRA_LINES) * 1.15))
+    per_day = rng.multinomial(n_orders, day_weights(days, growth))
+    order_days = np.repeat(np.arange(len(days)), per_day)
+    order_customers = rng.choice(len(customers), size=n_orders, p=zipf_weights(len(customers), rng))
+    first_id = 10248
+
+    # Lines: sample with replacement, then drop repeated products within an order
+    # (the (OrderID, ProductID) primary key)
+    counts = np.minimum(1 + rng.poisson(MEAN_EXTRA_LINES, size=n_orders), len(products))
+    line_orders = np.repeat(np.arange(n_orders), counts)
+    line_products = rng.choice(len(products), size=len(line_orders), p=zipf_weights(len(products), rng))
+    _, keep = np.unique(line_orders * len(products) + line_products, return_index=True)
+    keep.sort()
+    line_orders, line_products = line_orders[keep], line_products[keep]
+    if len(line_orders) > lines:
+        cut = np.searchsorted(line_orders, line_orders[lines], side="left")
+        line_orders, line_products = line_orders[:cut], line_products[:cut]
+    # Orders past the cut are dropped; the ones kept are spread over every day
+    kept = int(line_orders[-1]) + 1
+    order_index = np.sort(rng.choice(n_orders, size=kept, replace=False))
+    order_days, order_customers, n_orders = order_days[order_index], order_customers[order_index], kept
+
+    n_lines = len(line_orders)
+    quantities = np.clip(np.rint(rng.lognormal(np.log(12), 0.8, size=n_lines)), 1, 130).astype(int)
+    discounts = rng.choice(DISCOUNTS, size=n_lines, p=DISCOUNT_WEIGHTS)
+    prices = list_prices[line_products] * np.where(rng.random(n_lines) < 0.2, 0.8, 1.0)
+
+    print(f"Writing {n_orders:,} orders...")
+    placeholders = ", ".join("?" for _ in order_cols)
+    insert = f'INSERT INTO Orders ({", ".join(order_cols)}) VALUES ({placeholders})'
+    picks = rng.random(n_orders)
+    batch = []
+    for i in range(n_orders):
+        customer = customers[order_customers[i]]
+        pool = by_customer.get(customer) or fallback
+        row = pool[int(picks[i] * len(pool))]
+        day = days[order_days[i]]
+        base = _parse_day(row["OrderDate"])
+        values = []
+        for col in order_cols:
+            value = row[col]
+            if col == "OrderID":
+                value = first_id + i
+            elif col == "CustomerID":
+                value = customer
+            elif col == "OrderDate":
+                value = day.isoformat() + str(value)[10:]
+            elif col.endswith("Date") and base and _parse_day(value):
+                shifted = day + (_parse_day(value) - base)
+                value = shifted.isoformat() + str(value)[10:]
+            values.append(value)
+        batch.append(values)
+        if len(batch) >= INSERT_CHUNK:
+            conn.executemany(insert, batch)
+            batch = []
+    conn.executemany(insert, batch)
+    conn.commit()
+
+    print(f"Writing {n_lines:,} order lines...")
+    generated = {
+        "OrderID": line_orders + first_id,
+        "ProductID": product_ids[line_products],
+        "UnitPrice": np.round(prices, 2),
+        "Quantity": quantities,
+        "Discount": discounts,
+    }
+    columns = [c for c in line_cols if c in generated]
+    insert = f'INSERT INTO "Order Details" ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})'
+    for lo in range(0, n_lines, INSERT_CHUNK):
+        hi = min(lo + INSERT_CHUNK, n_lines)
+        conn.executemany(insert, zip(*(generated[c][lo:hi].tolist() for c in columns)))
+    conn.commit()
+    return n_orders, n_lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a scaled-up copy of the Northwind database")
+    parser.add_argument("--src", default=os.path.join(ROOT, "data", "northwind.sqlite"), help="Database to copy")
+    parser.add_argument("--out", default=os.path.join(ROOT, "data", "northwind_scaled.sqlite"), help="Output path")
+    parser.add_argument("--lines", type=int, default=10_000_000, help="Order lines to generate")
+    parser.add_argument("--start", default="1996-07-01", help="First order date")
+    parser.add_argument("--end", default="1998-05-31", help="Last order date")
+    parser.add_argument("--growth", type=float, default=0.6, help="Order volume growth over the period (0.6 = +60%%)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rollups", action="store_true", help="Build the daily rollups afterwards")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if os.path.exists(args.out):
+        os.remove(args.out)
+    src = sqlite3.connect(f"file:{args.src}?mode=ro", uri=True)
+    src.row_factory = sqlite3.Row
+    templates = [dict(r) for r in src.execute("SELECT * FROM Orders")]
+    src.execute("VACUUM INTO ?", (args.out,))
+    src.close()
+    if not templates:
+        sys.exit(f"{args.src} has no orders to use as templates")
+
+    conn = sqlite3.connect(args.out)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -262144")
+    indexes = prepare(conn)
+    n_orders, n_lines = generate(
+        conn, templates, args.lines,
+        datetime.date.fromisoformat(args.start), datetime.date.fromisoformat(args.end),
+        args.growth, np.random.default_rng(args.seed),
+    )
+
+    print("Recreating indexes and statistics...")
+    for ddl in indexes:
+        conn.execute(ddl)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'rollup_dirty_days'").fetchone():
+        # The old rollups describe the old orders
+        conn.execute("INSERT OR IGNORE INTO rollup_dirty_days VALUES ('*')")
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+    if args.rollups:
+        from agent.tools.rollups import build_rollups
+        print("Building rollups...")
+        summary = build_rollups(args.out, full=True)
+        print(f"Rollups built ({summary['days']} days, {summary['seconds']:.1f}s).")
+
+    size = os.path.getsize(args.out) / 2**20
+    print(f"Wrote {n_orders:,} orders / {n_lines:,} lines to {args.out} "
+          f"({size:,.0f} MB, {time.perf_counter() - started:.1f}s)")
@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+# -------------------------------------------------------------------------
+# SQL rewriter: correctness corpus and microbenchmark
+# -------------------------------------------------------------------------
+# Checks every case of sql_rewriter_corpus.jsonl ({name, input, expected,
+# compiles}) against agent/tools/sql_rewriter.py. When "compiles" is set,
+# the expected SQL must also compile against the database. Exits non-zero
+# on any failure.
+# Then times clean_sql_query (which runs the rewriter) against the regex
+# passes it replaced. The workloads are the corpus queries that need
+# rewriting, SQL as the pipeline generates it (already valid SQLite, the
+# common case), and a mix of the two. It also measures the memory each call
+# allocates.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from agent.graph_hybrid import clean_sql_query  # noqa: E402
+from agent.tools.sql_rewriter import default_rewriter  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sql_rewriter_corpus.jsonl")
+
+
+def legacy_clean_sql_query(sql: str) -> str:
+    """clean_sql_query as it was before the rewriter, for comparison."""
+    sql = sql.replace("```sql", "").replace("```", "").strip()
+    match = re.search(r"(SELECT.*?(?:;|$))", sql, re.IGNORECASE | re.DOTALL)
+    if match:
+        sql = match.group(1).strip()
+    sql = re.sub(r"YEAR\((.*?)\)", r"strftime('%Y', \1)", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"MONTH\((.*?)\)", r"strftime('%m', \1)", sql, flags=re.IGNORECASE)
+    if not sql.endswith(";"):
+        sql += ";"
+    return sql
+
+
+def check(cases, db_path):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True) if os.path.exists(db_path) else None
+    failures = 0
+    for case in cases:
+        got = default_rewriter.rewrite(case["input"])
+        if got != case["expected"]:
+            failures += 1
+            print(f"FAIL {case['name']}\n  input:    {case['input']}\n  expected: {case['expected']}\n  got:      {got}")
+            continue
+        if case.get("compiles") and conn is not None:
+            try:
+                conn.execute("EXPLAIN " + got).close()
+            except sqlite3.Error as e:
+                failures += 1
+                print(f"FAIL {case['name']}: does not compile ({e})\n  {got}")
+    if conn is None:
+        print(f"({db_path} not found: compile checks skipped)")
+    print(f"Corpus: {len(cases) - failures}/{len(cases)} cases pass")
+    return failures
+
+
+def time_per_call(fn, workload, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for sql in workload:
+            fn(sql)
+    return (time.perf_counter() - start) / (repeat * len(workload)) * 1e6
+
+
+def bytes_per_call(fn, workload):
+    tracemalloc.start()
+    peak = 0
+    for sql in workload:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        fn(sql)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return peak
+
+
+def generated_sql(db_path, n=200):
+    """SQL as the pipeline generates it (stub SQL generator over synthetic questions)."""
+    from agent.lm_backends import stub_sql
+    from generate_questions import generate, load_entities
+
+    entities = load_entities(db_path, os.path.join(ROOT, "docs"))
+    items = generate(n, {"sql": 0.5, "hybrid": 0.5}, entities, seed=0)
+    return [stub_sql(item["question"]) for item in items]
+
+
+def bench(cases, repeat, db_path):
+    dialect = [c["input"] for c in cases if c["input"] != c["expected"]]
+    if os.path.exists(db_path):
+        valid = generated_sql(db_path)
+        repeat = max(1, repeat * len(dialect) // len(valid))
+    else:
+        valid = [c["expected"] for c in cases if c["expected"] == c["input"]]
+    mixed = valid[:len(dialect) * 4] + dialect
+    workloads = {"dialect": dialect, "generated (valid)": valid, "mixed (80% valid)": mixed}
+    print(f"{'workload':<20}{'queries':>8} {'legacy us':>10} {'rewriter us':>12} {'speedup':>8} "
+          f"{'legacy peak B':>14} {'rewriter peak B':>16}")
+    for name, workload in workloads.items():
+        legacy = time_per_call(legacy_clean_sql_query, workload, repeat)
+        current = time_per_call(clean_sql_query, workload, repeat)
+        print(f"{name:<20}{len(workload):>8} {legacy:>10.2f} {current:>12.2f} {legacy / current:>7.2f}x "
+              f"{bytes_per_call(legacy_clean_sql_query, workload):>14} {bytes_per_call(clean_sql_query, workload):>16}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and benchmark the SQL dialect rewriter")
+    parser.add_argument("--corpus", default=CORPUS, help="JSONL of {name, input, expected, compiles}")
+    parser.add_argument("--db", default=os.path.join(ROOT, "data", "northwind.sqlite"),
+                        help="Database the expected SQL must compile against")
+    parser.add_argument("--repeat", type=int, default=2000, help="Passes over each workload")
+    parser.add_argument("--check-only", action="store_true", help="Only run the correctness corpus")
+    args = parser.parse_args()
+
+    with open(args.corpus, "r", encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    failures = check(cases, args.db)
+    if not args.check_only:
+        bench(cases, args.repeat, args.db)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,70 @@
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+# -------------------------------------------------------------------------
+# Startup-time benchmark
+# -------------------------------------------------------------------------
+# Measures how long common entry points take to start, plus `python -X importtime`
+# totals per top-level package, so lazy-loading regressions show up as numbers.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    "cli --help": [sys.executable, "run_agent_hybrid.py", "--help"],
+    "import graph": [sys.executable, "-c", "import agent.graph_hybrid"],
+    "import sqlite tool": [sys.executable, "-c", "import agent.tools.sqlite_tool"],
+}
+
+_IMPORTTIME = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def wall_time(cmd, runs):
+    """Median wall-clock seconds over `runs` executions."""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def import_profile(cmd, top):
+    """
+    Total import time (ms) and the heaviest packages, from -X importtime.
+    A package's cost is the cumulative time of its root module, wherever in
+    the import tree it was first pulled in (e.g. dspy imported by agent.*).
+    """
+    proc = subprocess.run(cmd[:1] + ["-X", "importtime"] + cmd[1:], cwd=ROOT,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=False)
+    total = 0.0
+    packages = {}
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME.match(line)
+        if not m:
+            continue
+        cumulative = int(m.group(2)) / 1000
+        module = m.group(4)
+        # Lines without nesting indent are top-level imports
+        if len(m.group(3)) <= 1:
+            total += cumulative
+        if "." not in module and module not in packages:
+            packages[module] = cumulative
+    return total, sorted(packages.items(), key=lambda kv: kv[1], reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure CLI and import startup time")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per command (median is reported)")
+    parser.add_argument("--top", type=int, default=8, help="Heaviest packages to list per command")
+    args = parser.parse_args()
+
+    for label, cmd in COMMANDS.items():
+        seconds = wall_time(cmd, args.runs)
+        total, heaviest = import_profile(cmd, args.top)
+        print(f"{label:<20} wall {seconds * 1000:8.1f} ms   imports {total:8.1f} ms")
+        for name, ms in heaviest:
+            print(f"    {name:<28}{ms:8.1f} ms")
@@ -1,100 +1,388 @@
 import argparse
 import json
-import dspy
+import logging
+import threading
+import time
 import os
-from agent.graph_hybrid import app
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from agent.graph_hybrid import (QuestionCancelled, cancel_event, get_app, get_db_tool, get_fast_router,
+                                 get_sql_templates, lm_cache, question_cache, question_cache_context)
+from agent.context_packing import CONTEXT_BUDGETS
+from agent.tracing import tracer
+
+logger = logging.getLogger(__name__)
 
 # -------------------------------------------------------------------------
 # Configuration
 # -------------------------------------------------------------------------
-# Ensure this matches the model you just pulled (phi3.5)
-MODEL_NAME = 'phi3.5' 
-API_BASE = 'http://localhost:11434'
-
-def setup_dspy():
-    """Configures DSPy to use the local Ollama model."""
-    print(f"Connecting to Ollama model: {MODEL_NAME}...")
-    lm = dspy.LM(model=f"ollama/{MODEL_NAME}", api_base=API_BASE, temperature=0)
+# The Ollama model (phi3.5) and server are set in agent/lm_backends.py
+
+def setup_dspy(backend="ollama", script=None, replay=None, latency_ms=0.0, jitter_ms=0.0, record=None):
+    """
+    Configures DSPy with the chosen LM backend: the local Ollama model, or an
+    offline stand-in ("stub" scripted answers, "replay" of a recording).
+    Returns (lm, engine); engine is None for Ollama.
+    """
+    import dspy
+    from agent.lm_backends import OLLAMA_MODEL, build_lm
+    if backend == "ollama":
+        print(f"Connecting to Ollama model: {OLLAMA_MODEL}...")
+    else:
+        print(f"Using offline LM backend: {backend} (latency {latency_ms:g} ms)")
+    lm, engine = build_lm(backend, script=script, replay=replay, latency_ms=latency_ms,
+                          jitter_ms=jitter_ms, record=record)
     dspy.configure(lm=lm)
-    return lm
+    return lm, engine
 
-def run_batch(input_file, output_file):
-    print(f"Reading from {input_file}...")
-    
-    results = []
-    
+# -------------------------------------------------------------------------
+# Per-question helpers
+# -------------------------------------------------------------------------
+def build_initial_state(item):
+    """Initial graph state for one input line."""
+    return {
+        "id": item['id'],
+        "question": item['question'],
+        "format_hint": item['format_hint'],
+        "retry_count": 0,
+        "tool_choice": "",
+        "sql_query": "",
+        "sql_error": "",
+        "sql_results": [],
+        "sql_truncated": False,
+        "retrieved_docs": [],
+        "final_answer": None,
+        "explanation": "",
+        "citations": [],
+        "schema_context": "",
+        "doc_context": "",
+        "timings": [],
+        "context_tokens": []
+    }
+
+def error_output(q_id, message):
+    """Fallback output object when a question fails or times out."""
+    return {
+        "id": q_id,
+        "final_answer": "Error",
+        "sql": "",
+        "confidence": 0.0,
+        "explanation": message,
+        "citations": []
+    }
+
+def context_savings(final_state):
+    """Prompt tokens of LM context before and after packing, summed over the question's LM calls."""
+    entries = final_state.get('context_tokens') or []
+    unpacked = sum(e['unpacked'] for e in entries)
+    packed = sum(e['packed'] for e in entries)
+    return {"unpacked": unpacked, "packed": packed, "saved": unpacked - packed}
+
+def cached_answer(item):
+    """Output for a question answered before (same or near-duplicate wording), or None."""
+    if not question_cache.enabled:
+        return None
+    start = time.perf_counter()
+    answer = question_cache.lookup(item['question'], item['format_hint'], question_cache_context())
+    tracer.emit("cache", "question", time.perf_counter() - start, question_id=item['id'], hits=answer is not None)
+    if answer is None:
+        return None
+    return {"id": item['id'], **answer}
+
+def remember_answer(item, output):
+    """Caches a successful output for later near-duplicate questions."""
+    if question_cache.enabled and output['confidence'] == 1.0 and output['final_answer'] != "Error":
+        # Token savings belong to the run that produced the answer
+        answer = {k: v for k, v in output.items() if k not in ('id', 'context_tokens')}
+        question_cache.store(item['question'], item['format_hint'], question_cache_context(), answer)
+
+def process_item(item, cancel=None):
+    """
+    Runs the graph for one question and builds the output object per contract.
+    Once the `cancel` event is set, the graph stops before its next node.
+    """
+    q_id = item['id']
+    logger.info("Processing ID: %s", q_id)
+    cached = cached_answer(item)
+    if cached is not None:
+        logger.info("Answered %s from the question cache", q_id)
+        return cached
+    token = cancel_event.set(cancel)
+    try:
+        with tracer.span("question", "invoke", question_id=q_id) as span:
+            final_state = get_app().invoke(build_initial_state(item))
+            span.update(route=final_state.get('tool_choice', ""), retries=final_state.get('retry_count', 0),
+                        sql_errors=bool(final_state.get('sql_error')))
+        output = {
+            "id": q_id,
+            "final_answer": final_state.get('final_answer'),
+            "sql": final_state.get('sql_query', ""),
+            "confidence": 1.0 if not final_state.get('sql_error') else 0.5,
+            "explanation": final_state.get('explanation', "No explanation generated."),
+            "citations": final_state.get('citations', []),
+            "context_tokens": context_savings(final_state)
+        }
+        remember_answer(item, output)
+        return output
+    except QuestionCancelled as e:
+        logger.info("Stopped %s: %s", q_id, e)
+        return error_output(q_id, str(e))
+    except Exception as e:
+        logger.error("ERROR processing %s: %s", q_id, e)
+        return error_output(q_id, str(e))
+    finally:
+        cancel_event.reset(token)
+
+def component_stats():
+    """Counters of the shared components (router, SQL templates/validator, rollups, caches)."""
+    stats = {
+        "router": get_fast_router().stats(),
+        "sql_templates": get_sql_templates().stats(),
+        "sql_validator": get_db_tool().validator.stats(),
+    }
+    if get_db_tool().rewriter is not None:
+        stats["rollups"] = get_db_tool().rewriter.stats()
+    if lm_cache.enabled:
+        stats["lm_cache"] = lm_cache.stats()
+    if question_cache.enabled:
+        stats["question_cache"] = question_cache.stats()
+    return stats
+
+def run_concurrent(items, workers, timeout=None, window=None):
+    """
+    Yields (index, output) pairs as graph invocations finish (completion order).
+    At most `workers` questions run at a time, and none is started more than
+    `window` (default 2 x workers) places after the earliest question not yet
+    yielded, so a caller writing in input order holds at most that many outputs
+    behind a slow question. A question running longer than
+    `timeout` seconds is reported as an error right away and told to stop: its
+    graph ends before the next node, but a node already running (an LM call,
+    a SQL query under its own time limit) finishes first. Until then its thread
+    keeps its worker slot, and leaving the generator does not wait for it,
+    though the interpreter does at exit.
+    """
+    window = window or 2 * workers
+    started = {}
+    cancels = {}
+    # Lowest index not yet yielded, and the yielded indexes above it
+    lowest, yielded = 0, set()
+    submitted = 0
+
+    def advance(index):
+        nonlocal lowest
+        yielded.add(index)
+        while lowest in yielded:
+            yielded.remove(lowest)
+            lowest += 1
+
+    def task(index, item):
+        started[index] = time.monotonic()
+        return process_item(item, cancels[index])
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = {}
+    # Timed-out questions whose threads have not stopped yet
+    abandoned = set()
+    source = iter(enumerate(items))
+    exhausted = False
+    try:
+        while True:
+            abandoned = {future for future in abandoned if not future.done()}
+            while not exhausted and len(pending) + len(abandoned) < workers and submitted < lowest + window:
+                nxt = next(source, None)
+                if nxt is None:
+                    exhausted = True
+                    break
+                index, item = nxt
+                submitted += 1
+                cancels[index] = threading.Event()
+                pending[executor.submit(task, index, item)] = (index, item)
+            if not pending and (exhausted or not abandoned):
+                break
+
+            # A stopping thread frees its slot for the next question
+            done, _ = wait(set(pending) | abandoned, timeout=1.0 if timeout else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future not in pending:
+                    continue
+                index, _item = pending.pop(future)
+                started.pop(index, None)
+                cancels.pop(index, None)
+                advance(index)
+                yield index, future.result()
+
+            if timeout:
+                now = time.monotonic()
+                for future, (index, item) in list(pending.items()):
+                    if index in started and now - started[index] > timeout:
+                        logger.warning("TIMEOUT processing %s after %ss", item['id'], timeout)
+                        del pending[future]
+                        started.pop(index, None)
+                        cancels.pop(index).set()
+                        abandoned.add(future)
+                        advance(index)
+                        yield index, error_output(item['id'], f"Timed out after {timeout}s")
+    finally:
+        for event in cancels.values():
+            event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def iter_items(input_file, skip_ids=None):
+    """Lazily yields input items, skipping blank lines and ids already done."""
     with open(input_file, 'r', encoding='utf-8') as f_in:
         for line in f_in:
             if not line.strip(): continue
             item = json.loads(line)
-            
-            q_id = item['id']
-            question = item['question']
-            format_hint = item['format_hint']
-            
-            print(f"\nProcessing ID: {q_id}")
-            
-            # Initialize State
-            initial_state = {
-                "id": q_id,
-                "question": question,
-                "format_hint": format_hint,
-                "retry_count": 0,
-                "tool_choice": "",
-                "sql_query": "",
-                "sql_error": "",
-                "sql_results": [],
-                "retrieved_docs": [],
-                "final_answer": None,
-                "explanation": "",
-                "citations": []
-            }
-            
-            # Run Graph
+            if skip_ids and item['id'] in skip_ids:
+                continue
+            yield item
+
+def is_failed_output(output):
+    """True for the error_output of a question that failed or timed out."""
+    return output.get('final_answer') == "Error" and not output.get('confidence')
+
+def load_completed_ids(output_file):
+    """
+    Returns the ids already answered in `output_file`.
+    Error and timeout outputs are removed from the file so that their
+    questions are run again, and a trailing partial line (e.g. from a crash
+    mid-write) is dropped so that appended results start on a fresh line.
+    """
+    done = set()
+    if not os.path.exists(output_file):
+        return done
+    kept, changed = [], False
+    with open(output_file, 'rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                changed = True
+                break
             try:
-                final_state = app.invoke(initial_state)
-                
-                # Construct Output Object per Contract
-                output_obj = {
-                    "id": q_id,
-                    "final_answer": final_state.get('final_answer'),
-                    "sql": final_state.get('sql_query', ""),
-                    "confidence": 1.0 if not final_state.get('sql_error') else 0.5,
-                    "explanation": final_state.get('explanation', "No explanation generated."),
-                    "citations": final_state.get('citations', [])
-                }
-                
-                results.append(output_obj)
-                
-            except Exception as e:
-                print(f"ERROR processing {q_id}: {e}")
-                # Fallback for error
-                results.append({
-                    "id": q_id,
-                    "final_answer": "Error",
-                    "sql": "",
-                    "confidence": 0.0,
-                    "explanation": str(e),
-                    "citations": []
-                })
-
-    # Write Output
-    print(f"\nWriting results to {output_file}...")
-    with open(output_file, 'w', encoding='utf-8') as f_out:
-        for res in results:
-            f_out.write(json.dumps(res) + "\n")
-    
+                output = json.loads(line)
+                q_id = output['id']
+            except (ValueError, KeyError, TypeError):
+                kept.append(line)
+                continue
+            if is_failed_output(output):
+                changed = True
+                continue
+            done.add(q_id)
+            kept.append(line)
+    if changed:
+        tmp = output_file + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.writelines(kept)
+        os.replace(tmp, output_file)
+    return done
+
+def run_batch(input_file, output_file, workers=1, timeout=None, resume=False):
+    print(f"Reading from {input_file}...")
+    tracer.reset()
+
+    skip_ids = load_completed_ids(output_file) if resume else set()
+    if skip_ids:
+        print(f"Resuming: skipping {len(skip_ids)} questions already answered in {output_file}")
+
+    # Stream results to disk in input order: an output that finishes early
+    # waits here until every question before it has been written (at most
+    # 2 x workers of them, see run_concurrent)
+    print(f"Writing results to {output_file}...")
+    count = 0
+    start = time.monotonic()
+    with open(output_file, 'a' if resume else 'w', encoding='utf-8') as f_out:
+        items = iter_items(input_file, skip_ids)
+        finished = {}
+        for index, output_obj in run_concurrent(items, max(1, workers), timeout):
+            finished[index] = output_obj
+            while count in finished:
+                f_out.write(json.dumps(finished.pop(count)) + "\n")
+                count += 1
+            f_out.flush()
+    elapsed = time.monotonic() - start
+
+    if count:
+        print(f"\nProcessed {count} questions in {elapsed:.1f}s "
+              f"({count / max(elapsed, 1e-9):.2f} q/s, workers={workers}).")
+        print(f"Router: {get_fast_router().stats()}")
+        print(f"SQL templates: {get_sql_templates().stats()}")
+        print(f"SQL validator: {get_db_tool().validator.stats()}")
+        if get_db_tool().rewriter is not None:
+            print(f"Rollups: {get_db_tool().rewriter.stats()}")
+        print("Trace summary (ms):")
+        print(tracer.report())
+    if lm_cache.enabled:
+        print(f"LM cache: {lm_cache.stats()}")
+    if question_cache.enabled:
+        print(f"Question cache: {question_cache.stats()}")
     print("Batch processing complete.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run the Retail Analytics Copilot")
-    parser.add_argument("--batch", required=True, help="Input JSONL file")
-    parser.add_argument("--out", required=True, help="Output JSONL file")
+    parser.add_argument("--batch", help="Input JSONL file")
+    parser.add_argument("--out", help="Output JSONL file")
+    parser.add_argument("--serve", default=None, metavar="HOST:PORT|unix:PATH",
+                        help="Instead of a batch, keep the agent loaded and answer questions over HTTP "
+                             "(POST /ask, POST /batch, GET /health, GET /metrics)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of questions to run concurrently; outputs are still written "
+                             "in input order (default: 1)")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Per-question timeout in seconds (default: none)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Append to --out, skipping ids already answered in it (errors and timeouts are rerun)")
+    parser.add_argument("--no-lm-cache", action="store_true",
+                        help="Always call the LM instead of reusing cached responses")
+    parser.add_argument("--no-question-cache", action="store_true",
+                        help="Run every question through the graph instead of reusing answers to similar ones")
+    parser.add_argument("--question-similarity", type=float, default=None,
+                        help="Minimum TF-IDF cosine similarity for a near-duplicate question (default: 0.85)")
+    parser.add_argument("--sql-log", default=None,
+                        help="Append every executed SQL query to this JSONL file (input for the index advisor)")
+    parser.add_argument("--lm", choices=["ollama", "stub", "replay"], default="ollama",
+                        help="LM backend: the Ollama model, scripted offline answers, or a replayed recording")
+    parser.add_argument("--lm-script", default=None,
+                        help="JSONL of scripted answers for --lm stub/replay ({field, match, response})")
+    parser.add_argument("--lm-replay", default=None, help="Recording to serve with --lm replay")
+    parser.add_argument("--lm-record", default=None, help="Append every LM prompt and completion to this JSONL file")
+    parser.add_argument("--lm-latency", type=float, default=0.0,
+                        help="Milliseconds added to every offline LM call")
+    parser.add_argument("--lm-jitter", type=float, default=0.0,
+                        help="Random +/- milliseconds on top of --lm-latency")
+    parser.add_argument("--context-budget", action="append", default=[], metavar="SIGNATURE=TOKENS",
+                        help="Token budget for a signature's packed context, e.g. synthesizer=600 (repeatable)")
+    parser.add_argument("--trace", default=None,
+                        help="Append per-node/LM/SQL/retrieval trace events to this JSONL file")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="DEBUG shows every graph step; WARNING keeps the console quiet under load")
     
     args = parser.parse_args()
+    if not args.serve and not (args.batch and args.out):
+        parser.error("--batch and --out are required unless --serve is given")
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.trace:
+        tracer.open(args.trace)
     
     # 1. Setup LM
-    setup_dspy()
+    _lm, lm_engine = setup_dspy(args.lm, script=args.lm_script, replay=args.lm_replay,
+                                latency_ms=args.lm_latency, jitter_ms=args.lm_jitter, record=args.lm_record)
+    lm_cache.enabled = not args.no_lm_cache
+    question_cache.enabled = not args.no_question_cache
+    if args.question_similarity is not None:
+        question_cache.threshold = args.question_similarity
+    if args.sql_log:
+        get_db_tool().query_log = args.sql_log
+    for budget in args.context_budget:
+        signature, _, tokens = budget.partition("=")
+        if signature not in CONTEXT_BUDGETS:
+            parser.error(f"--context-budget: unknown signature {signature!r} (one of {', '.join(CONTEXT_BUDGETS)})")
+        CONTEXT_BUDGETS[signature] = int(tokens)
     
-    # 2. Run Batch
-    run_batch(args.batch, args.out)
\ No newline at end of file
+    # 2. Run Batch (or serve)
+    if args.serve:
+        from agent.server import serve
+        serve(args.serve, process_item, error_output, component_stats, workers=max(1, args.workers),
+              timeout=args.timeout)
+    else:
+        run_batch(args.batch, args.out, workers=args.workers, timeout=args.timeout, resume=args.resume)
+    if lm_engine is not None:
+        print(f"LM backend ({args.lm}): {lm_engine.stats()}")
+    tracer.close()
@@ -39,4 +39,16 @@ try:
     print("Views created successfully.")
     
 except Exception as e:
-    print(f"Error executing SQL: {e}")
\ No newline at end of file
+    print(f"Error executing SQL: {e}")
+
+# 3. Build Rollup Tables
+print("Building rollup tables...")
+try:
+    from agent.tools.rollups import build_rollups
+    summary = build_rollups(db_path, full=True)
+    print(f"Rollups built ({summary['days']} days).")
+    if not summary["complete"]:
+        print("Warning: some order lines have no matching order/product/category/customer; "
+              "queries will not be routed to the rollups.")
+except Exception as e:
+    print(f"Error building rollups: {e}")
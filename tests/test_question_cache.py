@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+# -------------------------------------------------------------------------
+# Question cache matching
+# -------------------------------------------------------------------------
+# A near-duplicate may differ in word order, inflection and stopwords only;
+# any word that changes the answer must make the lookup miss.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from agent.question_cache import QuestionCache  # noqa: E402
+
+CONTEXT = "test-context"
+ANSWER = {"final_answer": 1, "sql": "", "confidence": 1.0, "explanation": "", "citations": []}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return QuestionCache(str(tmp_path / "question_cache.sqlite"))
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("What is the return policy for unopened beverages?", "What is the return policy for opened beverages?"),
+    ("What was the total revenue in June 1997 before discounts?",
+     "What was the total revenue in June 1997 after discounts?"),
+    ("Top 3 products by revenue in 1997.", "Top 5 products by revenue in 1997."),
+    ("Top 3 products by revenue in 1997.", "Top 3 products by revenue in 1998."),
+    ("Total revenue from Beverages in 1997.", "Total quantity from Beverages in 1997."),
+    ("Which customer placed the most orders in 1997?", "Which customer placed the fewest orders in 1997?"),
+    ("How many orders were shipped to Germany in 1997?", "How many orders were shipped to France in 1997?"),
+    ("Total revenue from Beverages in 1997.", "Total revenue from Beverages in 1997 excluding discounts."),
+])
+def test_different_question_misses(cache, stored, asked):
+    cache.store(stored, "float", CONTEXT, ANSWER)
+    assert cache.lookup(asked, "float", CONTEXT) is None
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("What were the top 3 products by revenue in 1997?", "What are the top 3 products by revenue in 1997?"),
+    ("How many orders were placed in 1997?", "how many orders were placed in 1997"),
+    ("Which customers ordered the most Chai in 1997?", "Which customer ordered the most Chai in 1997?"),
+])
+def test_rewording_hits(cache, stored, asked):
+    cache.store(stored, "float", CONTEXT, ANSWER)
+    assert cache.lookup(asked, "float", CONTEXT) == ANSWER
+
+
+def test_other_format_hint_or_context_misses(cache):
+    question = "How many orders were placed in 1997?"
+    cache.store(question, "int", CONTEXT, ANSWER)
+    assert cache.lookup(question, "float", CONTEXT) is None
+    assert cache.lookup(question, "int", "other-context") is None
+    assert cache.lookup(question, "int", CONTEXT) == ANSWER
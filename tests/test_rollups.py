@@ -0,0 +1,129 @@
+import os
+import shutil
+import sqlite3
+import sys
+
+import pytest
+
+# -------------------------------------------------------------------------
+# Rollup rewrites
+# -------------------------------------------------------------------------
+# Runs on a copy of data/northwind.sqlite (run setup_db.py first) with the
+# rollups rebuilt. A rewritten query must return what the raw query returns;
+# any other shape must be left to the raw tables.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from agent.tools.rollups import RollupRewriter, build_rollups  # noqa: E402
+from agent.tools.sqlite_tool import SQLiteDB  # noqa: E402
+
+DB_PATH = os.path.join(ROOT, "data", "northwind.sqlite")
+
+pytestmark = pytest.mark.skipif(not os.path.exists(DB_PATH), reason=f"{DB_PATH} not found: run setup_db.py")
+
+REVENUE = "SUM(oi.UnitPrice * oi.Quantity * (1 - oi.Discount))"
+
+SUPPORTED = {
+    "revenue_total": f"SELECT {REVENUE} FROM orders o JOIN order_items oi ON o.OrderID = oi.OrderID",
+    "revenue_month": (f"SELECT ROUND({REVENUE}, 2) AS revenue FROM orders o "
+                      "JOIN order_items oi ON o.OrderID = oi.OrderID WHERE o.OrderDate LIKE '1997-06%'"),
+    "revenue_date_range": (f"SELECT {REVENUE} AS revenue FROM orders o JOIN order_items oi ON o.OrderID = oi.OrderID "
+                           "WHERE o.OrderDate >= '1997-01-01' AND o.OrderDate < '1998-01-01'"),
+    "quantity_by_product": ("SELECT p.ProductName, SUM(oi.Quantity) AS qty FROM orders o "
+                            "JOIN order_items oi ON o.OrderID = oi.OrderID "
+                            "JOIN products p ON oi.ProductID = p.ProductID "
+                            "WHERE o.OrderDate LIKE '1997%' GROUP BY p.ProductName ORDER BY qty DESC, p.ProductName LIMIT 5"),
+    "revenue_by_category": (f"SELECT c.CategoryName, {REVENUE} AS revenue FROM orders o "
+                            "JOIN order_items oi ON o.OrderID = oi.OrderID "
+                            "JOIN products p ON oi.ProductID = p.ProductID "
+                            "JOIN categories c ON p.CategoryID = c.CategoryID "
+                            "GROUP BY c.CategoryName ORDER BY c.CategoryName"),
+    "aov_one_category": (f"SELECT ROUND({REVENUE} / COUNT(DISTINCT o.OrderID), 2) AS aov FROM orders o "
+                         "JOIN order_items oi ON o.OrderID = oi.OrderID "
+                         "JOIN products p ON oi.ProductID = p.ProductID "
+                         "JOIN categories c ON p.CategoryID = c.CategoryID "
+                         "WHERE c.CategoryName = 'Beverages' AND o.OrderDate LIKE '1997%'"),
+    "top_customer": (f"SELECT cu.CompanyName, {REVENUE} AS revenue FROM orders o "
+                     "JOIN order_items oi ON o.OrderID = oi.OrderID "
+                     "JOIN customers cu ON o.CustomerID = cu.CustomerID "
+                     "GROUP BY cu.CompanyName ORDER BY revenue DESC LIMIT 3"),
+    "order_count": ("SELECT COUNT(DISTINCT o.OrderID) FROM orders o JOIN order_items oi ON o.OrderID = oi.OrderID "
+                    "WHERE o.OrderDate LIKE '1997%'"),
+    "order_count_no_days": ("SELECT COUNT(DISTINCT o.OrderID) FROM orders o "
+                            "JOIN order_items oi ON o.OrderID = oi.OrderID WHERE o.OrderDate LIKE '1901%'"),
+}
+
+UNSUPPORTED = {
+    "raw_rows": "SELECT o.OrderID, o.OrderDate FROM orders o JOIN order_items oi ON o.OrderID = oi.OrderID",
+    "average": "SELECT AVG(oi.Quantity) FROM orders o JOIN order_items oi ON o.OrderID = oi.OrderID",
+    "list_price": ("SELECT SUM(p.UnitPrice * oi.Quantity * (1 - oi.Discount)) FROM order_items oi "
+                   "JOIN products p ON oi.ProductID = p.ProductID"),
+    "month_of_any_year": ("SELECT SUM(oi.Quantity) FROM orders o JOIN order_items oi ON o.OrderID = oi.OrderID "
+                          "WHERE o.OrderDate LIKE '%-06-%'"),
+    "time_of_day": ("SELECT SUM(oi.Quantity) FROM orders o JOIN order_items oi ON o.OrderID = oi.OrderID "
+                    "WHERE o.OrderDate >= '1997-01-01 12:00:00'"),
+    "or_filter": ("SELECT SUM(oi.Quantity) FROM orders o JOIN order_items oi ON o.OrderID = oi.OrderID "
+                  "WHERE o.OrderDate LIKE '1997%' OR o.OrderDate LIKE '1998%'"),
+    "having": ("SELECT p.ProductName, SUM(oi.Quantity) FROM order_items oi JOIN products p "
+               "ON oi.ProductID = p.ProductID GROUP BY p.ProductName HAVING SUM(oi.Quantity) > 100"),
+    "orders_by_product": ("SELECT p.ProductName, COUNT(DISTINCT o.OrderID) FROM orders o "
+                          "JOIN order_items oi ON o.OrderID = oi.OrderID "
+                          "JOIN products p ON oi.ProductID = p.ProductID GROUP BY p.ProductName"),
+    "left_join": ("SELECT SUM(oi.Quantity) FROM orders o LEFT JOIN order_items oi ON o.OrderID = oi.OrderID"),
+    "no_order_items": "SELECT COUNT(DISTINCT o.OrderID) FROM orders o",
+}
+
+
+@pytest.fixture(scope="module")
+def db_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("rollups") / "northwind.sqlite")
+    shutil.copyfile(DB_PATH, path)
+    assert build_rollups(path, full=True)["complete"]
+    return path
+
+
+@pytest.fixture(scope="module")
+def rewriter(db_path):
+    return SQLiteDB(db_path, cache_size=0, rollups=True).rewriter
+
+
+def run(db_path, sql):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return [tuple(round(v, 6) if isinstance(v, float) else v for v in row)
+                for row in conn.execute(sql).fetchall()]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("sql", SUPPORTED.values(), ids=SUPPORTED.keys())
+def test_rewrite_returns_raw_result(rewriter, db_path, sql):
+    rewritten = rewriter.rewrite(sql)
+    assert rewritten is not None and "rollup_" in rewritten
+    expected = run(db_path, sql)
+    assert expected
+    assert run(db_path, rewritten) == expected
+
+
+@pytest.mark.parametrize("sql", UNSUPPORTED.values(), ids=UNSUPPORTED.keys())
+def test_unsupported_shape_is_not_rewritten(rewriter, sql):
+    assert rewriter.rewrite(sql) is None
+
+
+def test_pending_changes_disable_rewrites(db_path, tmp_path):
+    path = str(tmp_path / "northwind.sqlite")
+    shutil.copyfile(db_path, path)
+    rewriter = SQLiteDB(path, cache_size=0, rollups=True).rewriter
+    sql = SUPPORTED["revenue_month"]
+    assert rewriter.rewrite(sql) is not None
+
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute('UPDATE "Order Details" SET Quantity = Quantity + 1 WHERE OrderID = '
+                     "(SELECT MIN(OrderID) FROM orders WHERE OrderDate LIKE '1997-06%')")
+    conn.close()
+    assert rewriter.rewrite(sql) is None
+
+    assert build_rollups(path)["mode"] == "incremental"
+    rewritten = rewriter.rewrite(sql)
+    assert rewritten is not None and run(path, rewritten) == run(path, sql)
@@ -0,0 +1,44 @@
+import json
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# -------------------------------------------------------------------------
+# SQL rewriter correctness corpus
+# -------------------------------------------------------------------------
+# The cases of benchmarks/sql_rewriter_corpus.jsonl, one test each, so the
+# corpus runs with the test suite and not only as a benchmark mode.
+# Cases marked "compiles" are also compiled against data/northwind.sqlite
+# when it exists (run setup_db.py first).
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from agent.tools.sql_rewriter import default_rewriter  # noqa: E402
+
+CORPUS = os.path.join(ROOT, "benchmarks", "sql_rewriter_corpus.jsonl")
+DB_PATH = os.path.join(ROOT, "data", "northwind.sqlite")
+
+with open(CORPUS, "r", encoding="utf-8") as f:
+    CASES = [json.loads(line) for line in f if line.strip()]
+
+
+@pytest.fixture(scope="module")
+def conn():
+    if not os.path.exists(DB_PATH):
+        yield None
+        return
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("case", CASES, ids=[case["name"] for case in CASES])
+def test_corpus_case(case, conn):
+    got = default_rewriter.rewrite(case["input"])
+    assert got == case["expected"]
+    if case.get("compiles"):
+        if conn is None:
+            pytest.skip(f"{DB_PATH} not found: run setup_db.py")
+        conn.execute("EXPLAIN " + got).close()
@@ -0,0 +1,77 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# -------------------------------------------------------------------------
+# SQL validator repairs
+# -------------------------------------------------------------------------
+# Repairs run against data/northwind.sqlite (run setup_db.py first). A
+# repair must never change which data a query reads; when it could, the
+# query has to be rejected so the LM rewrites it.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from agent.tools.sqlite_tool import SQLiteDB  # noqa: E402
+
+DB_PATH = os.path.join(ROOT, "data", "northwind.sqlite")
+
+pytestmark = pytest.mark.skipif(not os.path.exists(DB_PATH), reason=f"{DB_PATH} not found: run setup_db.py")
+
+
+@pytest.fixture(scope="module")
+def db():
+    return SQLiteDB(DB_PATH, cache_size=0)
+
+
+def run(sql):
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def test_ambiguous_column_in_two_unjoined_tables_is_rejected(db):
+    # products.UnitPrice is the list price, order_items.UnitPrice the price paid
+    check = db.validate("SELECT SUM(UnitPrice * Quantity * (1 - Discount)) FROM products p "
+                        "JOIN order_items oi ON p.ProductID = oi.ProductID")
+    assert not check["ok"]
+    assert "ambiguous column name: UnitPrice" in check["error"]
+
+
+def test_ambiguous_join_key_is_qualified(db):
+    check = db.validate("SELECT ProductID, COUNT(*) FROM products p JOIN order_items oi "
+                        "ON p.ProductID = oi.ProductID GROUP BY ProductID")
+    assert check["ok"]
+    assert check["sql"].startswith("SELECT p.ProductID, COUNT(*)")
+    assert run(check["sql"]) == run(check["sql"].replace("p.ProductID, COUNT", "oi.ProductID, COUNT"))
+
+
+def test_join_key_of_only_some_tables_is_rejected(db):
+    check = db.validate('SELECT OrderID FROM orders o JOIN order_items oi ON o.OrderID = oi.OrderID '
+                        'JOIN "Order Details" od ON oi.ProductID = od.ProductID')
+    assert not check["ok"]
+
+
+def test_output_alias_is_not_qualified(db):
+    check = db.validate("SELECT ProductID AS ProductID FROM products p JOIN order_items oi "
+                        "ON p.ProductID = oi.ProductID ORDER BY ProductID")
+    assert check["ok"]
+    assert "AS ProductID" in check["sql"] and check["sql"].endswith("ORDER BY ProductID")
+
+
+@pytest.mark.parametrize("sql, repaired", [
+    ("SELECT o.OrderDat FROM orders o", "SELECT o.OrderDate FROM orders o"),
+    ("SELECT Qty FROM order_items", "SELECT Quantity FROM order_items"),
+    ("SELECT * FROM order_item", "SELECT * FROM order_items"),
+])
+def test_unique_close_name_is_repaired(db, sql, repaired):
+    check = db.validate(sql)
+    assert check["ok"] and check["sql"] == repaired
+
+
+def test_writes_are_rejected(db):
+    assert not db.validate("DELETE FROM orders")["ok"]
+    assert not db.validate("SELECT 1; DROP TABLE orders")["ok"]